@@ -0,0 +1,61 @@
+import argparse
+import json
+import os
+import shlex
+import tempfile
+from typing import Dict, List
+
+from bench.pipeline import run_processor
+from bench.s3stub import S3Stub
+from bench.warcgen import generate_corpus
+
+
+# Peak RSS of the copy processor (which buffers whole pages as results) on a corpus with heavily skewed page sizes,
+# without a memory budget and with each of `budgets` (in MB).  A corpus of tiny pages gives the baseline RSS of the
+# interpreters (main process, manager and workers), which the budget does not cover.
+def run(files: int, records: int, median_size: int, sigma: float, threads: int, budgets: List[float],
+        extra_args: List[str]) -> Dict:
+    report = {'cpus': os.cpu_count(), 'files': files, 'records': records, 'median_size': median_size, 'sigma': sigma,
+              'threads': threads}
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline = os.path.join(tmp, 'baseline')
+        generate_corpus(baseline, files=files, records=10, kind='news', median_size=256, sigma=0.0)
+        with S3Stub(baseline) as stub:
+            report['baseline_rss_mb'] = run_processor('copy', baseline, stub, threads, extra_args)['peak_rss_mb']
+
+        skewed = os.path.join(tmp, 'skewed')
+        generate_corpus(skewed, files=files, records=records, kind='news', median_size=median_size, sigma=sigma)
+        report['corpus_mb'] = round(sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(skewed)
+                                        for f in fs) / (1024 * 1024), 1)
+        with S3Stub(skewed) as stub:
+            for budget in [None] + budgets:
+                args = extra_args + (['--memory-mb', str(budget)] if budget is not None else [])
+                result = run_processor('copy', skewed, stub, threads, args)
+                report[f'budget_{budget}' if budget is not None else 'unlimited'] = {
+                    'records': result['records'],
+                    'wall_seconds': result['wall_seconds'],
+                    'peak_rss_mb': result['peak_rss_mb'],
+                    'over_baseline_mb': round(result['peak_rss_mb'] - report['baseline_rss_mb'], 1),
+                }
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure peak RSS with and without a memory budget on skewed pages')
+    parser.add_argument('-f', '--files', help='WARC files (default=2)', type=int, default=2)
+    parser.add_argument('-r', '--records', help='Response records per file (default=150)', type=int, default=150)
+    parser.add_argument('-m', '--median-size', help='Median page size in bytes (default=1000000)', type=int,
+                        default=1000000)
+    parser.add_argument('-s', '--sigma', help='Log-normal sigma of the page size (default=1.0)', type=float,
+                        default=1.0)
+    parser.add_argument('-t', '--threads', help='Worker processes (default=4)', type=int, default=4)
+    parser.add_argument('-b', '--budgets', help='Comma-separated memory budgets in MB (default=32,128)',
+                        default='32,128')
+    parser.add_argument('--main-args', help='Extra arguments passed to src/main.py', default='')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.files, args.records, args.median_size, args.sigma, args.threads,
+                         [float(b) for b in args.budgets.split(',')], shlex.split(args.main_args)), indent=2))
@@ -0,0 +1,123 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from typing import Dict, Iterator, List, Set
+
+from projects.btc.raw2txn import AddressGroup
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def address(i: int) -> str:
+    return f'1{i:010d}{hashlib.md5(i.to_bytes(8, "little")).hexdigest()[:23]}'
+
+
+# Streams the input address lists of a synthetic transaction graph until `addresses` distinct addresses have been
+# spent.  Inputs reuse recent addresses with a heavy-tailed distribution (so clusters chain together and merge the way
+# wallets do), and addresses are rebuilt from their index, so the generator itself needs no memory.
+def transactions(addresses: int, seed: int = 1, reuse: float = 0.6) -> Iterator[List[str]]:
+    rng = random.Random(seed)
+    seen = 0
+    while seen < addresses:
+        inputs = []
+        for _ in range(1 + int(rng.expovariate(0.6))):
+            if seen > 0 and rng.random() < reuse:
+                inputs.append(address(seen - min(int(rng.paretovariate(0.8)), seen)))
+            else:
+                inputs.append(address(seen))
+                seen += 1
+        yield inputs
+
+
+# The set-based grouping raw2txn used before the union-find, kept for comparison
+class SetAddressGroup:
+    def __init__(self):
+        self.addrs: Dict[str, Set] = {}
+        self.reverse: Dict[str, str] = {}
+
+    def add(self, addrs=[]):
+        found = False
+        for addr in addrs:
+            if addr in self.reverse:
+                group_addr = self.reverse[addr]
+                found = True
+                self.addrs[group_addr] = self.addrs[group_addr].union(set(addrs))
+                break
+        if found is False:
+            self.addrs[addrs[0]] = set(addrs)
+            group_addr = addrs[0]
+        for addr in addrs:
+            self.reverse[addr] = group_addr
+
+    def group_addr(self, addr):
+        return self.reverse[addr]
+
+    def groups(self) -> int:
+        return len(set(self.reverse.values()))
+
+
+class NullAddressGroup:
+    def add(self, addrs=[]):
+        pass
+
+    def group_addr(self, addr):
+        return addr
+
+    def groups(self) -> int:
+        return 0
+
+
+def union_find_groups(group: AddressGroup) -> int:
+    return sum(1 for i in range(len(group)) if group.find(i) == i)
+
+
+IMPLEMENTATIONS = {'none': NullAddressGroup, 'sets': SetAddressGroup, 'union-find': AddressGroup}
+
+
+# Child process: clusters the graph with one implementation, the way raw2txn.main() calls it
+def cluster(implementation: str, addresses: int, seed: int) -> Dict:
+    group = IMPLEMENTATIONS[implementation]()
+    begin = time.time()
+    txns = 0
+    for inputs in transactions(addresses, seed):
+        group.add(inputs)
+        group.group_addr(inputs[0])
+        txns += 1
+    seconds = time.time() - begin
+    groups = union_find_groups(group) if isinstance(group, AddressGroup) else group.groups()
+    return {'implementation': implementation, 'addresses': addresses, 'transactions': txns,
+            'seconds': round(seconds, 2), 'groups': groups}
+
+
+# Runs cluster() in a child process, so each implementation's peak RSS is measured on its own
+def run(implementation: str, addresses: int, seed: int) -> Dict:
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--child', implementation, '-a', str(addresses),
+                             '--seed', str(seed)], env=dict(os.environ, PYTHONPATH=REPO_ROOT), stdout=subprocess.PIPE)
+    result = json.loads(proc.stdout.read())
+    _, status, usage = os.wait4(proc.pid, 0)
+    result['peak_rss_mb'] = round(usage.ru_maxrss / 1024, 1)
+    return result
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare address clustering implementations on a synthetic graph')
+    parser.add_argument('-a', '--addresses', help='Distinct addresses (default=2000000)', type=int, default=2000000)
+    parser.add_argument('--seed', help='Random seed (default=1)', type=int, default=1)
+    parser.add_argument('--implementations', help=f'Implementations to run (default=all of {list(IMPLEMENTATIONS)})',
+                        nargs='+', default=list(IMPLEMENTATIONS))
+    parser.add_argument('--child', help=argparse.SUPPRESS, default=None)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    if args.child is not None:
+        print(json.dumps(cluster(args.child, args.addresses, args.seed)))
+    else:
+        for implementation in args.implementations:
+            print(json.dumps(run(implementation, args.addresses, args.seed)), flush=True)
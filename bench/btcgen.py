@@ -0,0 +1,70 @@
+import argparse
+import json
+import random
+from typing import Dict, List
+
+from src.storage.storage import StorageDescriptor, StorageObject
+
+SATOSHI = 100000000
+
+
+def address(rng: random.Random, i: int) -> str:
+    return f'1{i:010d}{rng.getrandbits(64):016x}'
+
+
+# Generates raw blocks in the blockchain.info format consumed by projects/btc/raw2txn.py.  Inputs mostly spend from a
+# pool of previously seen addresses (with a heavy-tailed reuse distribution), so transactions link addresses into
+# clusters the way real wallets do.
+class BlockGenerator:
+    def __init__(self, seed: int = 1, reuse: float = 0.7):
+        self.rng = random.Random(seed)
+        self.reuse = reuse
+        self.addresses: List[str] = []
+
+    def _address(self) -> str:
+        if len(self.addresses) > 0 and self.rng.random() < self.reuse:
+            # Pareto-distributed index: recent addresses are reused far more often
+            back = min(int(self.rng.paretovariate(1.2)) - 1, len(self.addresses) - 1)
+            return self.addresses[-1 - back]
+        addr = address(self.rng, len(self.addresses))
+        self.addresses.append(addr)
+        return addr
+
+    def transaction(self) -> Dict:
+        inputs = [{'prev_out': {'value': self.rng.randint(1, 50) * SATOSHI // 10, 'addr': self._address()}}
+                  for _ in range(max(1, int(self.rng.expovariate(0.6))))]
+        outputs = [{'value': self.rng.randint(1, 40) * SATOSHI // 10, 'addr': self._address()}
+                   for _ in range(self.rng.randint(1, 3))]
+        return {'fee': self.rng.randint(1000, 50000), 'inputs': inputs, 'out': outputs}
+
+    def block(self, block_index: int, transactions: int) -> Dict:
+        coinbase = {'fee': 0, 'inputs': [{'prev_out': {'value': 0}}],
+                    'out': [{'value': 625 * SATOSHI // 100, 'addr': self._address()}]}
+        return {'blocks': [{'block_index': block_index,
+                            'tx': [coinbase] + [self.transaction() for _ in range(transactions)]}]}
+
+
+# Writes blocks the way `main.py -I btc -p copy` does: one copy-processor result per block, in the line format
+def write_blocks(path: str, blocks: int, transactions: int = 500, seed: int = 1, first_block: int = 700000) -> str:
+    generator = BlockGenerator(seed)
+    storage_object = StorageObject(StorageDescriptor(f'file://{path}'))
+    for i in range(blocks):
+        height = first_block + i
+        storage_object.append_results([{'uri': f'https://blockchain.info/block-height/{height}', 'ts': 1614556800 + i,
+                                         'content': json.dumps(generator.block(height, transactions))}])
+    storage_object.close_and_flush()
+    return path
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Generate synthetic raw BTC blocks in the crawl output format')
+    parser.add_argument('-o', '--output', help='Output file', required=True)
+    parser.add_argument('-b', '--blocks', help='Number of blocks (default=100)', type=int, default=100)
+    parser.add_argument('-t', '--transactions', help='Transactions per block (default=500)', type=int, default=500)
+    parser.add_argument('--seed', help='Random seed (default=1)', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(write_blocks(args.output, args.blocks, args.transactions, args.seed))
@@ -0,0 +1,104 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import shlex
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+from bench.pipeline import run_processor
+from bench.s3stub import S3Stub
+from bench.warcgen import WORDS, generate_corpus, paragraph
+from src.processors.dedup import NearDuplicateFilter
+from src.util.sketch import LSHIndex, MinHash
+
+
+def read_lines(path: str) -> List[Dict]:
+    with open(path) as fd:
+        return [json.loads(gzip.decompress(base64.b64decode(line))) for line in fd if line.strip()]
+
+
+# Articles of about `words` words, where every other one is a copy of an earlier original with a paragraph rewritten
+def articles(rng: random.Random, n: int, words: int) -> List[Dict]:
+    results = []
+    for i in range(n):
+        if i % 2 == 1:
+            paragraphs = results[rng.randrange(0, len(results), 2)]['text'].split('\n\n')
+            paragraphs[rng.randrange(len(paragraphs))] = paragraph(rng, WORDS['en'])
+        else:
+            paragraphs = []
+            while sum(len(p.split()) for p in paragraphs) < words:
+                paragraphs.append(paragraph(rng, WORDS['en']))
+        results.append({'uri': f'https://example.com/{i}', 'text': '\n\n'.join(paragraphs)})
+    return results
+
+
+# Articles per second through the filter, in batches of 100 like the flushes of src/main.py
+def filter_throughput(n: int, words: int) -> Dict:
+    results = articles(random.Random(1), n, words)
+    dedup = NearDuplicateFilter('text')
+    begin = time.time()
+    kept = sum(len(dedup.filter(results[i:i + 100])) for i in range(0, n, 100))
+    wall = time.time() - begin
+    return {'articles': n, 'words': words, 'kept': kept, 'duplicates': dedup.duplicates,
+            'articles_per_second': round(n / wall, 1)}
+
+
+# Python heap per signature remembered by the index
+def index_bytes(n: int) -> Dict:
+    rng = random.Random(1)
+    minhash = MinHash()
+    signatures = [minhash.signature(' '.join(rng.choice(WORDS['en']) for _ in range(200))) for _ in range(n)]
+    tracemalloc.start()
+    index = LSHIndex(0.8, capacity=n)
+    for i, signature in enumerate(signatures):
+        index.offer(i, signature)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'signatures': len(index), 'bytes_per_signature': round(size / n)}
+
+
+# The news processor on a corpus with `syndicated` republished articles, without and with --dedup drop.  Republished
+# articles keep their title, so the results without --dedup give the number of copies.
+def pipeline(files: int, records: int, syndicated: float, threads: int, extra_args: List[str], tmp: str) -> Dict:
+    generate_corpus(tmp, files=files, records=records, kind='news', syndicated=syndicated)
+    report = {}
+    with S3Stub(tmp) as stub:
+        for name, args in [('off', []), ('drop', ['--dedup', 'drop'])]:
+            run = run_processor('news', tmp, stub, threads, extra_args + args)
+            results = read_lines(os.path.join(tmp, 'news.out'))
+            os.remove(os.path.join(tmp, 'news.out'))
+            report[name] = {'records_per_second': run['records_per_second'], 'results': len(results),
+                            'distinct_titles': len({r['title'] for r in results})}
+    report['copies'] = report['off']['results'] - report['off']['distinct_titles']
+    report['dropped'] = report['off']['results'] - report['drop']['results']
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure the near-duplicate filter against the news pipeline')
+    parser.add_argument('-n', '--articles', help='Articles through the filter (default=2000)', type=int, default=2000)
+    parser.add_argument('-w', '--words', help='Words per article (default=800)', type=int, default=800)
+    parser.add_argument('-f', '--files', help='WARC files of the pipeline corpus (default=2, 0 skips the pipeline)',
+                        type=int, default=2)
+    parser.add_argument('-r', '--records', help='Response records per file (default=100)', type=int, default=100)
+    parser.add_argument('-s', '--syndicated', help='Fraction of republished articles (default=0.3)', type=float,
+                        default=0.3)
+    parser.add_argument('-t', '--threads', help='Worker processes (default=4)', type=int, default=4)
+    parser.add_argument('--main-args', help='Extra arguments passed to src/main.py', default='')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    report = {'cpus': os.cpu_count(), 'filter': filter_throughput(args.articles, args.words),
+              'index': index_bytes(20000)}
+    if args.files > 0:
+        with tempfile.TemporaryDirectory() as tmp:
+            report['pipeline'] = pipeline(args.files, args.records, args.syndicated, args.threads,
+                                          shlex.split(args.main_args), tmp)
+    print(json.dumps(report, indent=2))
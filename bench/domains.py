@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from src.storage.storage import StorageDescriptor, StorageObject
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Writes files of uri-only results.  Half of the domains come from a heavy-tailed distribution (the heavy hitters) and
+# half are spread uniformly over `domains` distinct domains (the long tail that makes exact counting expensive).
+def write_inputs(directory: str, files: int, records: int, domains: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    paths = []
+    for f in range(files):
+        path = os.path.join(directory, f'uris-{f}.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}'))
+        batch = []
+        for i in range(records):
+            domain = int(rng.paretovariate(1.0)) if rng.random() < 0.5 else rng.randint(1, domains)
+            batch.append({'uri': f'https://site{domain}.example.com/{i}'})
+            if len(batch) == 10000:
+                storage_object.append_results(batch)
+                batch = []
+        storage_object.append_results(batch)
+        storage_object.close_and_flush()
+        paths.append(path)
+    return paths
+
+
+# Runs uri_distribution.py in a child process and reports its wall time and peak RSS
+def run_distribution(paths: List[str], args: List[str]) -> Dict:
+    begin = time.time()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'projects/news/uri_distribution.py'), '-i'] +
+                            paths + args, env=dict(os.environ, PYTHONPATH=REPO_ROOT), stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    output = proc.stdout.read().decode('utf-8').splitlines()
+    # wait4() reports the peak RSS of this child alone (the process doing the merge)
+    _, status, usage = os.wait4(proc.pid, 0)
+    return {'args': ' '.join(args), 'seconds': round(time.time() - begin, 2), 'status': status,
+            'peak_rss_mb': round(usage.ru_maxrss / 1024, 1), 'top': output[:5]}
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare exact and approximate domain distributions')
+    parser.add_argument('-f', '--files', help='Input files (default=4)', type=int, default=4)
+    parser.add_argument('-r', '--records', help='Results per file (default=250000)', type=int, default=250000)
+    parser.add_argument('-d', '--domains', help='Distinct domains (default=1000000)', type=int, default=1000000)
+    parser.add_argument('-w', '--workers', help='Workers (default=number of CPUs)', default=str(os.cpu_count()))
+    parser.add_argument('-a', '--approximate', help='Sketch capacity (default=1000)', default='1000')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = write_inputs(tmp, args.files, args.records, args.domains)
+        for extra in [['-w', args.workers, '-a', args.approximate, '-k', '5'], ['-w', args.workers, '-k', '5']]:
+            print(json.dumps(run_distribution(inputs, extra)))
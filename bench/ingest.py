@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.s3stub import S3Stub
+from bench.warcgen import generate_corpus
+from src.ingestion.composite import CompositeIngestor
+from src.main import ingestor_factories
+
+
+# Ingests every record of the index with `ingestors` WarcIngestors over parts of it, without processing them
+def ingest(index: str, ingestors: int, mode: str) -> Dict:
+    begin = time.time()
+    ingestor = CompositeIngestor(ingestor_factories('warc-index', index, ingestors), mode)
+    records = sum(1 for _ in ingestor)
+    wall = time.time() - begin
+    return {'records': records, 'seconds': round(wall, 2), 'records_per_second': round(records / wall, 1)}
+
+
+def run(files: int, records: int, median_size: int, latency: float, ranged: bool, ingestors: List[int],
+        modes: List[str]) -> Dict:
+    report = {'cpus': os.cpu_count(), 'files': files, 'records': records, 'median_size': median_size,
+              'latency': latency, 'ranged': ranged}
+    with tempfile.TemporaryDirectory() as tmp:
+        index = generate_corpus(tmp, files=files, records=records, median_size=median_size, ranged=ranged)
+        with S3Stub(tmp, latency=latency) as stub:
+            # Inherited by the ingestor processes
+            os.environ.update(S3_ENDPOINT_URL=stub.endpoint_url, AWS_ACCESS_KEY_ID='bench',
+                              AWS_SECRET_ACCESS_KEY='bench')
+            for mode in modes:
+                for n in ingestors:
+                    report[f'{mode}_{n}'] = ingest(index, n, mode)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure ingest throughput with several WARC ingestors')
+    parser.add_argument('-f', '--files', help='WARC files (default=8)', type=int, default=8)
+    parser.add_argument('-r', '--records', help='Response records per file (default=100)', type=int, default=100)
+    parser.add_argument('-m', '--median-size', help='Median page size in bytes (default=30000)', type=int,
+                        default=30000)
+    parser.add_argument('--latency', help='Seconds of latency the stub adds to every GET (default=0.05)', type=float,
+                        default=0.05)
+    parser.add_argument('--ranged', help='One index line (and GET) per record', action='store_true', default=False)
+    parser.add_argument('-n', '--ingestors', help='Comma-separated numbers of ingestors (default=1,2,4)',
+                        default='1,2,4')
+    parser.add_argument('--modes', help='Comma-separated ingest modes (default=thread,process)',
+                        default='thread,process')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.files, args.records, args.median_size, args.latency, args.ranged,
+                         [int(n) for n in args.ingestors.split(',')], args.modes.split(',')), indent=2))
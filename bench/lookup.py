@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.s3stub import S3Stub
+from bench.storage_formats import news_results
+from src.storage.reader import lookup, read_results
+from src.storage.storage import StorageDescriptor, StorageObject
+from src.storage.uri_index import index_path
+
+
+def write(output: str, results: List[Dict], uri_index: bool) -> float:
+    begin = time.time()
+    storage_object = StorageObject(StorageDescriptor(output, uri_index=uri_index))
+    for i in range(0, len(results), 100):
+        storage_object.append_results(results[i:i + 100])
+    storage_object.close_and_flush()
+    return round(time.time() - begin, 3)
+
+
+# The full scan a point lookup took without an index
+def scan(path: str, uri: str) -> List[Dict]:
+    return [r for r in read_results(path, workers=1) if r['uri'] == uri]
+
+
+def timed_lookups(path: str, uris: List[str]) -> Dict:
+    latencies = []
+    for uri in uris:
+        begin = time.time()
+        found = lookup(path, uri)
+        latencies.append(time.time() - begin)
+        assert len(found) == 1 and found[0]['uri'] == uri
+    latencies.sort()
+    return {'lookups': len(uris), 'first_ms': round(latencies[-1] * 1000, 2),
+            'median_ms': round(latencies[len(latencies) // 2] * 1000, 2)}
+
+
+# Writes `count` news results with and without a URI index, then compares a full scan for one URI with indexed lookups
+# of `lookups` random URIs, from a local file and from the S3 stub
+def run(count: int, median_size: int, lookups: int, latency: float) -> Dict:
+    rng = random.Random(1)
+    results = news_results(rng, count, median_size)
+    uris = [r['uri'] for r in rng.sample(results, lookups)]
+    report = {'cpus': os.cpu_count(), 'results': count, 'median_size': median_size, 'latency': latency}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'news.json')
+        report['write_seconds'] = write(f'file://{path}', results, False)
+        os.remove(path)
+        report['write_indexed_seconds'] = write(f'file://{path}', results, True)
+        report['output_mb'] = round(os.path.getsize(path) / (1024 * 1024), 1)
+        report['index_kb'] = round(os.path.getsize(index_path(path)) / 1024, 1)
+        begin = time.time()
+        scan(path, uris[0])
+        report['local_scan_seconds'] = round(time.time() - begin, 3)
+        report['local'] = timed_lookups(path, uris)
+
+        with S3Stub(tmp, latency=latency) as stub:
+            os.environ.update(S3_ENDPOINT_URL=stub.endpoint_url, AWS_ACCESS_KEY_ID='bench',
+                              AWS_SECRET_ACCESS_KEY='bench')
+            os.makedirs(os.path.join(tmp, 'bench'), exist_ok=True)
+            remote = 's3://us-east-1.bench/output/news.json'
+            write(remote, results, True)
+            requests = stub.requests
+            report['s3'] = timed_lookups(remote, uris)
+            report['s3']['requests_per_lookup'] = round((stub.requests - requests) / lookups, 2)
+            begin = time.time()
+            scan(remote, uris[0])
+            report['s3_scan_seconds'] = round(time.time() - begin, 3)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare point lookups through the URI index with full scans')
+    parser.add_argument('-n', '--results', help='News results (default=20000)', type=int, default=20000)
+    parser.add_argument('-m', '--median-size', help='Median text size in bytes (default=4000)', type=int,
+                        default=4000)
+    parser.add_argument('-l', '--lookups', help='Indexed lookups (default=200)', type=int, default=200)
+    parser.add_argument('--latency', help='Seconds of latency the stub adds to every GET (default=0)', type=float,
+                        default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.results, args.median_size, args.lookups, args.latency), indent=2))
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.storage_formats import news_results
+from src.storage.partitioned import PartitionedStorageObject
+from src.storage.reader import expand_paths, read_results
+from src.storage.storage import StorageDescriptor, StorageObject
+
+DAY = 86400
+# 2021-03-01T00:00:00Z
+BEGIN = 1614556800
+
+
+def timed(fn) -> float:
+    begin = time.time()
+    fn()
+    return round(time.time() - begin, 3)
+
+
+def write(storage_object, results: List[Dict]):
+    for i in range(0, len(results), 100):
+        storage_object.append_results(results[i:i + 100])
+    storage_object.close_and_flush()
+
+
+def load(path: str) -> Dict:
+    with open(path) as fd:
+        return json.load(fd)
+
+
+# Writes `count` news results spread over `days` days (in crawl order, with a fraction of stragglers from earlier days)
+# as a single file and partitioned by date, then reads the results of one week from both.  A straggler for a partition
+# that is not open suspends another, so stragglers make for more (and smaller) parts.
+def run(count: int, days: int, median_size: int, stragglers: float, max_open_partitions: int, workers: int) -> Dict:
+    rng = random.Random(1)
+    results = news_results(rng, count, median_size)
+    for i, r in enumerate(results):
+        day = i * days // count
+        if rng.random() < stragglers:
+            day = rng.randint(0, day)
+        r['ts'] = float(BEGIN + day * DAY + rng.randint(0, DAY - 1))
+    since, until = BEGIN + 7 * DAY, BEGIN + 14 * DAY
+    report = {'cpus': os.cpu_count(), 'results': count, 'days': days, 'stragglers': stragglers,
+              'max_open_partitions': max_open_partitions, 'query': 'days 7-13', 'workers': workers}
+    with tempfile.TemporaryDirectory() as tmp:
+        single = os.path.join(tmp, 'single.json')
+        partitioned = os.path.join(tmp, 'news.json')
+        for name, storage_object in [('single', StorageObject(StorageDescriptor(f'file://{single}'))),
+                                     ('partitioned', PartitionedStorageObject(
+                                         StorageDescriptor(f'file://{partitioned}', partitioned=True,
+                                                           max_open_partitions=max_open_partitions)))]:
+            report[f'{name}_write_seconds'] = timed(lambda: write(storage_object, results))
+        manifest = os.path.join(tmp, 'news.manifest.json')
+        partitions = load(manifest)['partitions']
+        report['partitions'] = len(partitions)
+        report['parts'] = sum(len(load(p['manifest'])['parts']) for p in partitions)
+        report['single_mb'] = round(os.path.getsize(single) / (1024 * 1024), 1)
+        report['partitioned_read_mb'] = round(sum(os.path.getsize(p[len('file://'):])
+                                                  for p in expand_paths([manifest], since, until)) / (1024 * 1024), 1)
+
+        def scan():
+            week = [r for r in read_results(single, fields=['uri', 'ts'], workers=workers) if since <= r['ts'] < until]
+            report['scan_results'] = len(week)
+
+        def query():
+            week = [r for r in read_results(manifest, fields=['uri', 'ts'], workers=workers, since=since, until=until)
+                    if since <= r['ts'] < until]
+            report['query_results'] = len(week)
+
+        report['scan_seconds'] = timed(scan)
+        report['query_seconds'] = timed(query)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare a one-week query on date-partitioned and single-file output')
+    parser.add_argument('-n', '--results', help='News results (default=20000)', type=int, default=20000)
+    parser.add_argument('-d', '--days', help='Days the results are spread over (default=60)', type=int, default=60)
+    parser.add_argument('-m', '--median-size', help='Median text size in bytes (default=4000)', type=int,
+                        default=4000)
+    parser.add_argument('-s', '--stragglers', help='Fraction of results from an earlier day (default=0.01)',
+                        type=float, default=0.01)
+    parser.add_argument('-o', '--max-open-partitions', help='Partitions open at a time (default=8)', type=int,
+                        default=8)
+    parser.add_argument('-w', '--workers', help='Reader workers (default=1)', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.results, args.days, args.median_size, args.stragglers, args.max_open_partitions,
+                         args.workers), indent=2))
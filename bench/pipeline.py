@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from bench.s3stub import S3Stub
+from bench.warcgen import generate_corpus
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, 'bench', 'results')
+
+# Processor -> kind of page it expects
+PROCESSORS = {
+    'copy': 'news',
+    'news': 'news',
+    'rottentomatoes': 'rottentomatoes',
+}
+
+# Metrics reported as-is from the final stats line of src/main.py
+STAGE_LATENCIES = ['download_seconds', 'ingest_wait_seconds', 'warc_parse_seconds', 'admission_wait_seconds',
+                   'process_seconds', 'flush_seconds', 'storage_close_seconds']
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as fd:
+            return [int(p) for p in fd.read().split()]
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return []
+
+
+def _rss(pid: int) -> int:
+    try:
+        with open(f'/proc/{pid}/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return 0
+
+
+# Sums the RSS of a process and all of its descendants (the manager, pool workers and downloaders)
+def tree_rss(pid: int) -> int:
+    total = 0
+    pending = [pid]
+    while pending:
+        p = pending.pop()
+        total += _rss(p)
+        pending += _children(p)
+    return total
+
+
+class RSSSampler:
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, tree_rss(self.pid))
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self) -> int:
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+
+def _last_stats(output: str) -> Dict:
+    stats = {}
+    for line in output.splitlines():
+        match = re.search(r' stats (\{.*\})$', line)
+        if match:
+            stats = json.loads(match.group(1))
+    return stats
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return 'unknown'
+
+
+# Runs src/main.py against the corpus served by the stub and summarizes throughput, memory and per-stage time.
+# `processor` may be several processors joined with '+' (e.g. news+copy), which are run in a single pass.
+def run_processor(processor: str, workdir: str, stub: S3Stub, threads: int, extra_args: List[str],
+                  upload: bool = False) -> Dict:
+    if upload:
+        outputs = [f's3://us-east-1.bench/output/{name}.txt' for name in processor.split('+')]
+    else:
+        outputs = [f'file://{os.path.join(workdir, name + ".out")}' for name in processor.split('+')]
+    env = dict(os.environ, S3_ENDPOINT_URL=stub.endpoint_url, AWS_ACCESS_KEY_ID='bench',
+               AWS_SECRET_ACCESS_KEY='bench', PYTHONPATH=REPO_ROOT)
+    cmd = [sys.executable, '-m', 'src.main', '-I', 'warc-index', '-i', os.path.join(workdir, 'index.txt'),
+           '-o', ','.join(outputs), '-p', processor.replace('+', ','), '-t', str(threads), '--stats-interval', '0'] + extra_args
+    requests_before, bytes_before = stub.requests, stub.bytes_sent
+    begin = time.time()
+    proc = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    sampler = RSSSampler(proc.pid)
+    sampler.start()
+    output_text = proc.communicate()[0].decode('utf-8', errors='replace')
+    wall = time.time() - begin
+    peak_rss = sampler.stop()
+    if proc.returncode != 0:
+        raise Exception(f'{processor} run failed ({proc.returncode}):\n{output_text[-4000:]}')
+    stats = _last_stats(output_text)
+    counters = stats.get('counters', {})
+    latency = stats.get('latency', {})
+    records = counters.get('records_completed_total', 0)
+    return {
+        'processor': processor,
+        'wall_seconds': round(wall, 3),
+        'records': records,
+        'records_per_second': round(records / wall, 2),
+        'bytes_per_second': round(counters.get('download_bytes_total', 0) / wall, 1),
+        'peak_rss_mb': round(peak_rss / (1024 * 1024), 1),
+        's3_requests': stub.requests - requests_before,
+        's3_bytes': stub.bytes_sent - bytes_before,
+        'errors': counters.get('task_errors_total', 0) + sum(v for k, v in counters.items()
+                                                              if k.startswith('process_errors_total')),
+        'stages': {k: v for k, v in latency.items() if k.split('{')[0] in STAGE_LATENCIES},
+    }
+
+
+def run(processors: List[str], files: int, records: int, median_size: int, languages: List[str], threads: int,
+        extra_args: List[str], latency: float = 0.0, upload: bool = False, workdir: Optional[str] = None) -> Dict:
+    results = {
+        'revision': _git_revision(),
+        'timestamp': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'config': {'files': files, 'records': records, 'median_size': median_size, 'languages': languages,
+                   'threads': threads, 'main_args': extra_args, 'latency': latency, 'upload': upload},
+        'runs': []
+    }
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for processor in processors:
+            corpus = os.path.join(tmp, processor)
+            generate_corpus(corpus, files=files, records=records, kind=PROCESSORS[processor.split('+')[0]],
+                            languages=languages,
+                            median_size=median_size)
+            os.makedirs(os.path.join(corpus, 'bench'), exist_ok=True)
+            with S3Stub(corpus, latency=latency) as stub:
+                run = run_processor(processor, corpus, stub, threads, extra_args, upload)
+            print(format_run(run), flush=True)
+            results['runs'].append(run)
+    return results
+
+
+def format_run(run: Dict) -> str:
+    stages = ', '.join(f'{k}={v["sum"]:.2f}s' for k, v in sorted(run['stages'].items()))
+    return f'{run["processor"]:>15}: {run["records"]} records in {run["wall_seconds"]:.1f}s ' \
+           f'({run["records_per_second"]:.1f} rec/s, {run["bytes_per_second"] / (1024 * 1024):.2f} MB/s), ' \
+           f'peak RSS {run["peak_rss_mb"]:.0f} MB, {run.get("s3_bytes", 0) / (1024 * 1024):.1f} MB from S3, ' \
+           f'{run["errors"]} errors; {stages}'
+
+
+def save(results: Dict, directory: str = RESULTS_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{results["timestamp"].replace(":", "")}-{results["revision"]}.json')
+    with open(path, 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+    return path
+
+
+# Prints the relative change of each headline number against a previous result file
+def compare(baseline: Dict, current: Dict) -> str:
+    lines = [f'{baseline["revision"]} -> {current["revision"]}']
+    previous = {r['processor']: r for r in baseline['runs']}
+    for run in current['runs']:
+        before = previous.get(run['processor'])
+        if before is None:
+            continue
+        for metric in ['records_per_second', 'bytes_per_second', 'peak_rss_mb', 'wall_seconds']:
+            if before[metric] == 0:
+                continue
+            change = (run[metric] - before[metric]) / before[metric] * 100
+            lines.append(f'{run["processor"]:>15} {metric:>20}: {before[metric]:>12} -> {run[metric]:>12} '
+                         f'({change:+.1f}%)')
+    return '\n'.join(lines)
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Run the ingest, process and storage pipeline against a synthetic '
+                                                 'corpus served by a local S3 stub')
+    parser.add_argument('-p', '--processors', help=f'Comma-separated processors, where news+copy runs both in one '
+                                                   f'pass (default={",".join(PROCESSORS)})',
+                        default=','.join(PROCESSORS))
+    parser.add_argument('-f', '--files', help='WARC files per corpus (default=4)', type=int, default=4)
+    parser.add_argument('-r', '--records', help='Response records per file (default=250)', type=int, default=250)
+    parser.add_argument('-m', '--median-size', help='Median page size in bytes (default=30000)', type=int,
+                        default=30000)
+    parser.add_argument('-l', '--languages', help='Comma-separated page languages (default=en,de,fr)',
+                        default='en,de,fr')
+    parser.add_argument('-t', '--threads', help='Worker processes (default=4)', type=int, default=4)
+    parser.add_argument('--latency', help='Seconds of latency the stub adds to every GET (default=0)', type=float,
+                        default=0.0)
+    parser.add_argument('--upload', help='Write the output to the stub instead of a local file',
+                        action='store_true', default=False)
+    parser.add_argument('--main-args', help='Extra arguments passed to src/main.py', default='')
+    parser.add_argument('--compare', help='Previous result file to compare against', default=None)
+    parser.add_argument('--no-save', help=f'Do not write the results to {RESULTS_DIR}', action='store_true',
+                        default=False)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    results = run(args.processors.split(','), args.files, args.records, args.median_size, args.languages.split(','),
+                  args.threads, shlex.split(args.main_args), args.latency, args.upload)
+    if not args.no_save:
+        print(f'Saved results to {save(results)}')
+    if args.compare is not None:
+        with open(args.compare) as fd:
+            print(compare(json.load(fd), results))
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.btcgen import write_blocks
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def output_mb(path: str) -> float:
+    paths = [p for p in [path, f'{path}.addrs', f'{path}.groups'] if os.path.exists(p)]
+    return round(sum(os.path.getsize(p) for p in paths) / (1024 * 1024), 1)
+
+
+# Runs raw2txn.py on the blocks with each output format and worker count, and reports wall time and output size
+def run(blocks: int, transactions: int, workers: List[int]) -> Dict:
+    report = {'cpus': os.cpu_count(), 'blocks': blocks, 'transactions': transactions}
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = write_blocks(os.path.join(tmp, 'blocks.json'), blocks, transactions)
+        report['input_mb'] = round(os.path.getsize(input_path) / (1024 * 1024), 1)
+        for output_format in ['text', 'binary']:
+            for w in workers:
+                output_path = os.path.join(tmp, f'txns-{output_format}-{w}')
+                begin = time.time()
+                subprocess.check_call([sys.executable, os.path.join(REPO_ROOT, 'projects/btc/raw2txn.py'), '-i',
+                                       input_path, '-o', output_path, '-w', str(w), '-f', output_format],
+                                      env=dict(os.environ, PYTHONPATH=REPO_ROOT))
+                report[f'{output_format}_workers_{w}_seconds'] = round(time.time() - begin, 2)
+                report[f'{output_format}_workers_{w}_mb'] = output_mb(output_path)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Time raw2txn.py with each output format and worker count')
+    parser.add_argument('-b', '--blocks', help='Blocks (default=200)', type=int, default=200)
+    parser.add_argument('-t', '--transactions', help='Transactions per block (default=500)', type=int, default=500)
+    parser.add_argument('-w', '--workers', help='Comma-separated worker counts (default=1,2,4,8)', default='1,2,4,8')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.blocks, args.transactions, [int(w) for w in args.workers.split(',')]), indent=2))
@@ -0,0 +1,76 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+from bench.btcgen import write_blocks
+from bench.storage_formats import news_results
+from src.storage.reader import read_results
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+# The loop the project scripts used before src/storage/reader.py
+def legacy_read(path: str) -> int:
+    rows = 0
+    with open(path) as fd:
+        while True:
+            line = fd.readline()
+            if line == '':
+                break
+            json.loads(gzip.decompress(base64.b64decode(line)))
+            rows += 1
+    return rows
+
+
+def block_size(payload: Dict) -> int:
+    return len(json.loads(payload['content'])['blocks'][0]['tx'])
+
+
+def timed(fn) -> float:
+    begin = time.time()
+    fn()
+    return round(time.time() - begin, 3)
+
+
+def run(news: int, blocks: int, workers: List[int], chunk_mb: float) -> Dict:
+    chunk_bytes = int(chunk_mb * 1024 * 1024)
+    report = {'cpus': os.cpu_count(), 'chunk_mb': chunk_mb}
+    with tempfile.TemporaryDirectory() as tmp:
+        news_path = os.path.join(tmp, 'news.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{news_path}'))
+        storage_object.append_results(news_results(random.Random(1), news, 4000))
+        storage_object.close_and_flush()
+        btc_path = write_blocks(os.path.join(tmp, 'btc.json'), blocks)
+        report['news_mb'] = round(os.path.getsize(news_path) / (1024 * 1024), 1)
+        report['btc_mb'] = round(os.path.getsize(btc_path) / (1024 * 1024), 1)
+
+        report['news_legacy_seconds'] = timed(lambda: legacy_read(news_path))
+        report['btc_legacy_seconds'] = timed(lambda: [json.loads(json.loads(gzip.decompress(base64.b64decode(line)))
+                                                                 ['content']) for line in open(btc_path)])
+        for w in workers:
+            report[f'news_uri_workers_{w}_seconds'] = timed(
+                lambda: sum(1 for _ in read_results(news_path, fields=['uri'], workers=w, chunk_bytes=chunk_bytes)))
+            report[f'btc_blocks_workers_{w}_seconds'] = timed(
+                lambda: sum(read_results(btc_path, fields=['content'], transform=block_size, workers=w,
+                                         chunk_bytes=chunk_bytes)))
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare the shared reader with the legacy single-threaded loop')
+    parser.add_argument('-n', '--news', help='News results (default=20000)', type=int, default=20000)
+    parser.add_argument('-b', '--blocks', help='BTC blocks (default=200)', type=int, default=200)
+    parser.add_argument('-w', '--workers', help='Comma-separated worker counts (default=1,2,4,8)', default='1,2,4,8')
+    parser.add_argument('-c', '--chunk-mb', help='Chunk size in MB (default=8)', type=float, default=8)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.news, args.blocks, [int(w) for w in args.workers.split(',')], args.chunk_mb),
+                     indent=2))
@@ -0,0 +1,122 @@
+import argparse
+import functools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import List
+
+import numpy
+
+from projects.rottentomatoes.analyze import aggregated_deltas, formatted_ts, linear_regression_2d, recomputed_deltas, \
+    report
+from projects.rottentomatoes.load_rt import connect
+
+# Schema created by projects/rottentomatoes/process_rt.sh
+CREATE_TABLE = 'create table rt(ts bigint, name varchar, critic smallint, numCritic smallint, audience smallint, ' \
+               'numAudience smallint)'
+
+
+# Writes `movies` movies with 1 to 2 * `snapshots` snapshots each, whose scores drift by a few points between crawls
+def write_db(path: str, movies: int, snapshots: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute(CREATE_TABLE)
+    rows = []
+    for m in range(movies):
+        critic, audience = rng.randint(0, 100), rng.randint(0, 100)
+        ts = 1577836800 + rng.randint(0, 10 ** 7)
+        for _ in range(rng.randint(1, 2 * snapshots)):
+            rows.append((ts, f'movie_{m:07d}', critic, rng.randint(1, 400), audience, rng.randint(1, 50000)))
+            ts += rng.randint(1, 30) * 86400
+            critic = min(100, max(0, critic + rng.randint(-3, 3)))
+            audience = min(100, max(0, audience + rng.randint(-3, 3)))
+        if len(rows) >= 100000:
+            conn.executemany('insert into rt values (?, ?, ?, ?, ?, ?)', rows)
+            rows = []
+    conn.executemany('insert into rt values (?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def add_point(points, point):
+    points[0].append(point[0])
+    points[1].append(point[1])
+    return points
+
+
+# The per-movie loop analyze.py used before grouped_deltas(), with audience scores read from the audience column (the
+# old get_audience_point() read numCritic)
+def legacy_report(conn: sqlite3.Connection, critics: bool, audience: bool, threshold: float,
+                  delta_func: str = 'slope') -> List[str]:
+    query = '''
+    select group_concat(ts || ';' || critic || ';' || numCritic || ';' || audience  || ';' || numAudience, ','),
+           name
+           from rt
+           group by name order by name, ts asc
+    '''
+    lines = []
+    for row in conn.execute(query):
+        scores = sorted(row[0].split(','), key=lambda x: float(x.split(';')[0]))
+        name = row[1]
+        for label, column, enabled in [('critics', 1, critics), ('audience', 3, audience)]:
+            if not enabled:
+                continue
+            points = functools.reduce(
+                lambda p, score: add_point(p, (float(score.split(';')[0]), float(score.split(';')[column]))), scores,
+                ([], []))
+            slope, y_int = linear_regression_2d(points)
+            value = max(points[1]) - min(points[1])
+            if (delta_func == 'slope' and numpy.abs(slope) > threshold) or \
+                    (delta_func == 'minmax' and value > threshold):
+                lines.append(f'{name} ({label}): minmax={value} slope={slope} ts={formatted_ts(points)}')
+    return lines
+
+
+def timed(fn):
+    begin = time.time()
+    result = fn()
+    return round(time.time() - begin, 2), result
+
+
+def run(movies: int, snapshots: int, threshold: float, delta_func: str) -> dict:
+    report_ = {'movies': movies, 'snapshots': snapshots, 'threshold': threshold, 'delta_func': delta_func}
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(write_db(os.path.join(tmp, 'movies.db'), movies, snapshots))
+        report_['rows'] = conn.execute('select count(*) from rt').fetchone()[0]
+        report_['legacy_seconds'], legacy = timed(lambda: legacy_report(conn, True, True, threshold, delta_func))
+        report_['grouped_seconds'], grouped = timed(lambda: list(report(conn, True, True, threshold, delta_func)))
+        report_['lines'] = len(grouped)
+        # Slopes are computed differently, so they may differ in the last digits
+        report_['same_movies'] = [line.split(' slope=')[0] for line in legacy] == \
+                                 [line.split(' slope=')[0] for line in grouped]
+        conn.close()
+
+        # Aggregates built once from the whole DB (as load_rt.py does for a DB loaded without them)
+        report_['aggregates_build_seconds'], conn = timed(lambda: connect(os.path.join(tmp, 'movies.db')))
+        report_['aggregated_seconds'], aggregated = timed(
+            lambda: list(report(conn, True, True, threshold, delta_func)))
+        report_['aggregated_same_movies'] = [line.split(' slope=')[0] for line in aggregated] == \
+                                            [line.split(' slope=')[0] for line in grouped]
+        # Deltas alone, without reading the history of the printed movies
+        report_['recomputed_deltas_seconds'], _ = timed(lambda: recomputed_deltas(conn, ['critics', 'audience']))
+        report_['aggregated_deltas_seconds'], _ = timed(lambda: aggregated_deltas(conn, ['critics', 'audience']))
+        conn.close()
+    return report_
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare the grouped analysis with the per-movie loop')
+    parser.add_argument('-m', '--movies', help='Movies (default=100000)', type=int, default=100000)
+    parser.add_argument('-s', '--snapshots', help='Average snapshots per movie (default=10)', type=int, default=10)
+    parser.add_argument('-t', '--threshold', help='Threshold (default=10)', type=float, default=10)
+    parser.add_argument('-D', '--delta-func', help='Delta function (default=minmax)', default='minmax')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.movies, args.snapshots, args.threshold, args.delta_func), indent=2))
@@ -0,0 +1,101 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from typing import Dict, List
+
+from projects.rottentomatoes.load_rt import connect, load, row_from_result, CREATE_TABLE, FIELDS
+from src.processors.rottentomatoes import RottenTomatoesProcessor
+from src.storage.reader import read_results
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+# Writes `files` rottentomatoes processor outputs of `rows` results each: snapshots of `movies` movies, with a few
+# errors mixed in
+def write_results(directory: str, files: int, rows: int, movies: int, output_format: str, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    paths = []
+    extension = '.parquet' if output_format == 'parquet' else '.json'
+    for f in range(files):
+        path = os.path.join(directory, f'results.{f}{extension}')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', output_format,
+                                                         RottenTomatoesProcessor.schema))
+        batch = []
+        for i in range(rows):
+            if rng.random() < 0.01:
+                batch.append({'error': 'Error processing: https://www.rottentomatoes.com/m/x', 'reason': 'None'})
+            else:
+                batch.append({'uri': f'https://www.rottentomatoes.com/m/movie_{rng.randrange(movies)}',
+                              'ts': 1577836800 + f * 86400 + i, 'criticScore': f'{rng.randint(0, 100)}%',
+                              'criticNum': rng.randint(1, 400), 'audienceScore': f'{rng.randint(0, 100)}%',
+                              'audienceNum': rng.randint(1, 50000)})
+            if len(batch) == 10000:
+                storage_object.append_results(batch)
+                batch = []
+        storage_object.append_results(batch)
+        storage_object.close_and_flush()
+        paths.append(path)
+    return paths
+
+
+# What process_rt.sh did: one autocommitted insert per row
+def row_by_row(db: str, path: str, rows: int) -> int:
+    conn = sqlite3.connect(db, isolation_level=None)
+    conn.execute(CREATE_TABLE)
+    inserted = 0
+    for row in read_results(path, fields=FIELDS, transform=row_from_result, workers=1):
+        if row is not None:
+            conn.execute('insert into rt values (?, ?, ?, ?, ?, ?)', row)
+            inserted += 1
+            if inserted == rows:
+                break
+    conn.close()
+    return inserted
+
+
+def run(files: int, rows: int, movies: int, output_format: str, workers: int, baseline_rows: int) -> Dict:
+    report = {'cpus': os.cpu_count(), 'files': files, 'rows_per_file': rows, 'format': output_format}
+    with tempfile.TemporaryDirectory() as tmp:
+        begin = time.time()
+        paths = write_results(tmp, files, rows, movies, output_format)
+        report['generate_seconds'] = round(time.time() - begin, 1)
+
+        begin = time.time()
+        inserted = row_by_row(os.path.join(tmp, 'baseline.db'), paths[0], baseline_rows)
+        report['row_by_row_rows_per_second'] = round(inserted / (time.time() - begin))
+
+        db = os.path.join(tmp, 'movies.db')
+        conn = connect(db)
+        begin = time.time()
+        # All but the last file in the first load (index built at the end), then the last one incrementally
+        totals = load(conn, paths[:-1], workers)
+        report['initial_load_rows'] = totals['rows']
+        report['initial_load_seconds'] = round(time.time() - begin, 1)
+        report['initial_load_rows_per_second'] = round(totals['rows'] / (time.time() - begin))
+        begin = time.time()
+        totals = load(conn, paths, workers)
+        report['incremental_load_rows'] = totals['rows']
+        report['incremental_load_rows_per_second'] = round(totals['rows'] / (time.time() - begin))
+        conn.close()
+        report['db_mb'] = round(os.path.getsize(db) / (1024 * 1024), 1)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure the rt loader against row-by-row inserts')
+    parser.add_argument('-f', '--files', help='Processor output files (default=5)', type=int, default=5)
+    parser.add_argument('-r', '--rows', help='Results per file (default=2000000)', type=int, default=2000000)
+    parser.add_argument('-m', '--movies', help='Distinct movies (default=500000)', type=int, default=500000)
+    parser.add_argument('--format', help='Format of the processor output (default=parquet)', default='parquet')
+    parser.add_argument('-w', '--workers', help='Loader workers (default=number of CPUs)', type=int, default=None)
+    parser.add_argument('--baseline-rows', help='Rows to insert one by one (default=20000)', type=int, default=20000)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.files, args.rows, args.movies, args.format, args.workers, args.baseline_rows),
+                     indent=2))
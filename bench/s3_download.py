@@ -0,0 +1,121 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing.pool import ThreadPool
+from typing import Dict, List
+
+from bench.s3stub import S3Stub
+from bench.warcgen import generate_corpus
+from src.ingestion.warc import DownloadPolicy, WarcCacheEntry, download_warc_files, warc_file_from_line
+from src.storage.s3 import get_s3_credentials, get_s3_connection
+from src.util.logging import Logger
+from src.util.s3helpers import get_warc_s3_key
+
+logger = Logger()
+
+
+# What get_local_warc_file() did for every file: read the credentials, connect and check the bucket
+def legacy_get_local_warc_file(key: str, offset: int, length: int, bucket: str):
+    aws_access_key_id, aws_secret_access_key = get_s3_credentials()
+    bucket_conn = get_s3_connection(aws_access_key_id, aws_secret_access_key).get_bucket(bucket)
+    local_path = f'/tmp/{uuid.uuid4()}'
+    k = get_warc_s3_key(key, offset, length, bucket=bucket_conn)
+    with open(local_path, 'wb') as fp:
+        k.get_file(fp)
+    return open(local_path, 'rb'), local_path
+
+
+# ...and download_warc_files(), which started a new ThreadPool for every batch, only added a batch to the cache once
+# its slowest file was downloaded, and polled a full cache every 10s (here, the consumer keeps up, so it never polls)
+def legacy_download(bucket: str, lines: List[str], cache: List[WarcCacheEntry], max_cache_len: int,
+                    room: threading.Event):
+    while len(lines) > 0:
+        warc_files = []
+        while max_cache_len - len(cache) > len(warc_files) and len(lines) > 0:
+            warc_files.append(warc_file_from_line(lines.pop(0)))
+        if len(warc_files) > 0:
+            with ThreadPool(len(warc_files)) as pool:
+                results = pool.starmap(legacy_get_local_warc_file,
+                                       [(f.key, f.offset, f.length, bucket) for f in warc_files])
+            for warc_file, (fp, path) in zip(warc_files, results):
+                cache.append(WarcCacheEntry(warc_file, fp, path))
+        else:
+            room.wait(10)
+            room.clear()
+
+
+# Downloads every entry of the index into a cache of `max_cache_len` files, which is drained as fast as possible.  The
+# mode is one of legacy, unhedged or hedged.
+def run_downloads(index: str, stub: S3Stub, mode: str, max_cache_len: int) -> Dict:
+    with open(index) as fd:
+        lines = fd.readlines()
+    cache: List[WarcCacheEntry] = []
+    room = threading.Event()
+    requests, connections = stub.requests, stub.connections
+    begin = time.time()
+    if mode == 'legacy':
+        thread = threading.Thread(target=legacy_download, args=('commoncrawl', lines, cache, max_cache_len, room))
+    else:
+        policy = DownloadPolicy(hedge_percentile=95 if mode == 'hedged' else 0)
+        thread = threading.Thread(target=download_warc_files,
+                                  args=('commoncrawl', io.StringIO(''.join(lines)), cache, max_cache_len,
+                                        threading.Condition(), logger, None, room, policy))
+    thread.start()
+    files = 0
+    while thread.is_alive() or len(cache) > 0:
+        if len(cache) == 0:
+            time.sleep(0.001)
+            continue
+        entry = cache.pop(0)
+        room.set()
+        entry.warc_fp.close()
+        os.remove(entry.local_path)
+        files += 1
+    thread.join()
+    wall = time.time() - begin
+    return {'files': files, 'seconds': round(wall, 2), 'files_per_second': round(files / wall, 1),
+            'requests': stub.requests - requests, 'requests_per_second': round((stub.requests - requests) / wall, 1),
+            'connections': stub.connections - connections}
+
+
+def run(files: int, records: int, latency: float, straggler_rate: float, straggler_latency: float,
+        max_cache_len: int, modes: List[str]) -> Dict:
+    report = {'cpus': os.cpu_count(), 'index_lines': files * records, 'latency': latency,
+              'straggler_rate': straggler_rate, 'straggler_latency': straggler_latency}
+    with tempfile.TemporaryDirectory() as tmp:
+        index = generate_corpus(tmp, files=files, records=records, median_size=2000, ranged=True)
+        with S3Stub(tmp, latency=latency, straggler_rate=straggler_rate, straggler_latency=straggler_latency,
+                    seed=1) as stub:
+            os.environ.update(S3_ENDPOINT_URL=stub.endpoint_url, AWS_ACCESS_KEY_ID='bench',
+                              AWS_SECRET_ACCESS_KEY='bench')
+            for mode in modes:
+                report[mode] = run_downloads(index, stub, mode, max_cache_len)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure S3 requests/s of the WARC downloader on a ranged index')
+    parser.add_argument('-f', '--files', help='WARC files (default=4)', type=int, default=4)
+    parser.add_argument('-r', '--records', help='Records per file, each one an index line (default=500)', type=int,
+                        default=500)
+    parser.add_argument('--latency', help='Seconds of latency the stub adds to every GET (default=0)', type=float,
+                        default=0.0)
+    parser.add_argument('--straggler-rate', help='Fraction of GETs that are stragglers (default=0)', type=float,
+                        default=0.0)
+    parser.add_argument('--straggler-latency', help='Extra seconds added to stragglers (default=0)', type=float,
+                        default=0.0)
+    parser.add_argument('--modes', help='Comma-separated downloaders: legacy, unhedged, hedged '
+                                        '(default=legacy,unhedged,hedged)', default='legacy,unhedged,hedged')
+    parser.add_argument('-c', '--cache', help='Files in the download cache (default=16)', type=int, default=16)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.files, args.records, args.latency, args.straggler_rate, args.straggler_latency,
+                         args.cache, args.modes.split(',')), indent=2))
@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import urlparse, unquote
+
+CHUNK_SIZE = 1024 * 1024
+
+
+# Minimal S3 stand-in serving <root>/<bucket>/<key> over path-style HTTP.  It supports what the crawler uses (HEAD
+# bucket, ranged GET and PUT of objects), keeps connections alive, and can inject latency: every object GET waits
+# `latency` seconds, and a `straggler_rate` fraction of them wait another `straggler_latency` seconds.  Point the
+# crawler at it by setting S3_ENDPOINT_URL to S3Stub.endpoint_url.
+class S3Stub:
+    def __init__(self, root: str, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 straggler_rate: float = 0.0, straggler_latency: float = 0.0, seed: Optional[int] = None):
+        self.root = root
+        self.latency = latency
+        self.straggler_rate = straggler_rate
+        self.straggler_latency = straggler_latency
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.bytes_sent = 0
+        self.server = ThreadingHTTPServer((host, port), _handler(self))
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def endpoint_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'S3Stub':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _delay(self) -> float:
+        with self.lock:
+            straggler = self.rng.random() < self.straggler_rate
+        return self.latency + (self.straggler_latency if straggler else 0.0)
+
+    def _count(self, sent: int = 0):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += sent
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def _handler(stub: S3Stub):
+    class S3StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body are separate writes, which Nagle's algorithm would hold up for a delayed ACK (~40ms)
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            super().setup()
+            with stub.lock:
+                stub.connections += 1
+
+        def _split_path(self):
+            path = unquote(urlparse(self.path).path).lstrip('/')
+            bucket, _, key = path.partition('/')
+            return bucket, key
+
+        def _send(self, status: int, body: bytes = b'', headers: dict = None):
+            self.send_response(status)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+            stub._count(len(body))
+
+        def _not_found(self, code: str):
+            body = f'<?xml version="1.0" encoding="UTF-8"?><Error><Code>{code}</Code></Error>'.encode('utf-8')
+            self._send(404, body, {'Content-Type': 'application/xml'})
+
+        def _get(self):
+            bucket, key = self._split_path()
+            bucket_path = os.path.join(stub.root, bucket)
+            if not os.path.isdir(bucket_path):
+                return self._not_found('NoSuchBucket')
+            if key == '':
+                body = f'<?xml version="1.0" encoding="UTF-8"?><ListBucketResult><Name>{bucket}</Name>' \
+                       f'<IsTruncated>false</IsTruncated></ListBucketResult>'.encode('utf-8')
+                return self._send(200, body, {'Content-Type': 'application/xml'})
+            path = os.path.join(bucket_path, key)
+            if not os.path.isfile(path):
+                return self._not_found('NoSuchKey')
+            size = os.path.getsize(path)
+            start, end, status = 0, size - 1, 200
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+                status = 206
+            time.sleep(stub._delay())
+            length = end - start + 1
+            self.send_response(status)
+            self.send_header('Content-Length', str(length))
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('ETag', f'"{size:x}-{int(os.path.getmtime(path))}"')
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if self.command == 'HEAD':
+                return stub._count()
+            with open(path, 'rb') as fd:
+                fd.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = fd.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            stub._count(length)
+
+        def do_GET(self):
+            self._get()
+
+        def do_HEAD(self):
+            self._get()
+
+        def do_PUT(self):
+            bucket, key = self._split_path()
+            path = os.path.join(stub.root, bucket, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            remaining = int(self.headers.get('Content-Length', 0))
+            md5 = hashlib.md5()
+            with open(path, 'wb') as fd:
+                while remaining > 0:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    md5.update(chunk)
+                    fd.write(chunk)
+                    remaining -= len(chunk)
+            self._send(200, headers={'ETag': f'"{md5.hexdigest()}"'})
+
+        def log_message(self, format, *args):
+            pass
+
+    return S3StubHandler
+
+
+# Copies a local file into the stub's tree, as if it had been uploaded
+def put_object(root: str, bucket: str, key: str, local_path: str):
+    path = os.path.join(root, bucket, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    shutil.copyfile(local_path, path)
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Serve a directory as a local S3 stand-in')
+    parser.add_argument('-r', '--root', help='Directory containing one sub-directory per bucket', required=True)
+    parser.add_argument('-p', '--port', help='Port (default=9000)', type=int, default=9000)
+    parser.add_argument('--latency', help='Seconds added to every GET (default=0)', type=float, default=0.0)
+    parser.add_argument('--straggler-rate', help='Fraction of GETs that are stragglers (default=0)', type=float,
+                        default=0.0)
+    parser.add_argument('--straggler-latency', help='Extra seconds added to stragglers (default=0)', type=float,
+                        default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    s3_stub = S3Stub(args.root, port=args.port, latency=args.latency, straggler_rate=args.straggler_rate,
+                     straggler_latency=args.straggler_latency)
+    print(f'S3_ENDPOINT_URL={s3_stub.endpoint_url}')
+    s3_stub.server.serve_forever()
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from multiprocessing import forkserver
+from multiprocessing.managers import SyncManager
+from typing import Dict, List, Union
+
+from src.main import get_processor, preload_modules, worker_pool
+from src.processors.types import Record
+
+
+# Memory of the calling process in bytes: resident, proportional (shared pages split between the processes sharing them)
+# and private (unique to it)
+def process_memory(pid: Union[int, str] = 'self') -> Dict:
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as fd:
+            for line in fd:
+                name, value = line.split(':', 1)
+                if value.strip().endswith('kB'):
+                    memory[name] = int(value.split()[0]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        return {'rss': 0, 'pss': 0, 'private': 0}
+    return {'rss': memory['Rss'], 'pss': memory['Pss'],
+            'private': memory.get('Private_Clean', 0) + memory.get('Private_Dirty', 0)}
+
+
+# Runs the processors on the record in a worker, as src/main.py:do_process() does, and reports when the results were
+# ready and what the worker had loaded by then.  Workers wait for each other, so each gets one record.
+def first_result(task) -> Dict:
+    processors, record, barrier = task
+    results = []
+    for processor in processors:
+        get_processor(processor)(results, threading.Lock()).process(record)
+    done = time.time()
+    stats = dict(process_memory(), done=done, results=len(results), modules=len(sys.modules))
+    barrier.wait()
+    return stats
+
+
+# A page the processors produce results for.  The generator is imported here, so the workers do not load warcio.
+def page(processors: List[str], median_size: int) -> Record:
+    from bench.pipeline import PROCESSORS
+    from bench.warcgen import news_page, rottentomatoes_page
+
+    rng = random.Random(1)
+    if PROCESSORS[processors[0]] == 'rottentomatoes':
+        return Record('https://www.rottentomatoes.com/m/bench', 1614556800.0,
+                      rottentomatoes_page(rng, 'en', median_size))
+    return Record('https://www.example.com/2021/03/01/bench.html', 1614556800.0, news_page(rng, 'en', median_size))
+
+
+def median(values: List[float]) -> float:
+    return sorted(values)[len(values) // 2]
+
+
+# Starts a pool of `workers` workers and gives each one record to process.  Time to first result is from creating the
+# pool (including starting the fork server) to the first worker's results, and all workers from there to the last's.
+def run_pool(start_method: str, processors: List[str], workers: int, record: Record, preload: List[str]) -> Dict:
+    with SyncManager() as manager:
+        barrier = manager.Barrier(workers)
+        begin = time.time()
+        with worker_pool(start_method, workers, preload) as p:
+            stats = p.map(first_result, [(processors, record, barrier)] * workers, chunksize=1)
+    done = [s['done'] - begin for s in stats]
+    mb = 1024 * 1024
+    report = {
+        'first_result_seconds': round(min(done), 3),
+        'all_workers_seconds': round(max(done), 3),
+        'worker_rss_mb': round(median([s['rss'] for s in stats]) / mb, 1),
+        'worker_pss_mb': round(median([s['pss'] for s in stats]) / mb, 1),
+        'worker_private_mb': round(median([s['private'] for s in stats]) / mb, 1),
+        'workers_pss_mb': round(sum(s['pss'] for s in stats) / mb, 1),
+        'worker_modules': median([s['modules'] for s in stats]),
+    }
+    if start_method == 'forkserver':
+        report['forkserver_rss_mb'] = round(process_memory(forkserver._forkserver._forkserver_pid)['rss'] / mb, 1)
+    return report
+
+
+# The fork server is started once per process, with the preload of the first forkserver pool, so spawn runs first and
+# forkserver once
+def run(processors: List[str], workers: int, median_size: int) -> Dict:
+    record = page(processors, median_size)
+    preload = preload_modules(processors)
+    report = {'cpus': os.cpu_count(), 'processors': processors, 'workers': workers, 'preload': preload}
+    for start_method in ['spawn', 'forkserver']:
+        report[start_method] = run_pool(start_method, processors, workers, record, preload)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare how fast spawned and forked pool workers produce their first '
+                                                 'results, and their memory')
+    parser.add_argument('-p', '--processors', help='Comma-separated processors each worker runs (default=news)',
+                        default='news')
+    parser.add_argument('-t', '--threads', help='Worker processes (default=16)', type=int, default=16)
+    parser.add_argument('-m', '--median-size', help='Page size in bytes (default=20000)', type=int, default=20000)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.processors.split(','), args.threads, args.median_size), indent=2))
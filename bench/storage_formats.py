@@ -0,0 +1,96 @@
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+from typing import Dict, List
+
+import pyarrow.parquet as pq
+
+from bench.warcgen import WORDS, paragraph, sentence, page_size
+from src.processors.news import NewsProcessor
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+# Results shaped like the news processor's output
+def news_results(rng: random.Random, count: int, median_size: int) -> List[Dict]:
+    results = []
+    for i in range(count):
+        words = WORDS[rng.choice(list(WORDS))]
+        size = page_size(rng, median_size, 0.8)
+        text = []
+        length = 0
+        while length < size:
+            p = paragraph(rng, words)
+            text.append(p)
+            length += len(p)
+        results.append({'uri': f'https://news{rng.randint(0, 200)}.example.com/story-{i}.html',
+                        'ts': 1614556800.0 + i, 'title': sentence(rng, words), 'text': '\n\n'.join(text)})
+    return results
+
+
+def write(path: str, output_format: str, results: List[Dict], row_group_size: int, compression: str) -> float:
+    begin = time.time()
+    storage_object = StorageObject(StorageDescriptor(f'file://{path}', output_format, NewsProcessor.schema,
+                                                     row_group_size, compression))
+    for i in range(0, len(results), 100):
+        storage_object.append_results(results[i:i + 100])
+    storage_object.close_and_flush()
+    return time.time() - begin
+
+
+def read_line(path: str, columns: List[str]) -> int:
+    rows = 0
+    with open(path) as fd:
+        for line in fd:
+            payload = json.loads(gzip.decompress(base64.b64decode(line)))
+            _ = [payload.get(c) for c in columns]
+            rows += 1
+    return rows
+
+
+def read_parquet(path: str, columns: List[str]) -> int:
+    return pq.read_table(path, columns=columns).num_rows
+
+
+def timed(fn, *args) -> float:
+    begin = time.time()
+    fn(*args)
+    return time.time() - begin
+
+
+def run(records: int, median_size: int, row_group_size: int, compression: str, columns: List[str]) -> Dict:
+    results = news_results(random.Random(1), records, median_size)
+    report = {'records': records, 'columns': columns}
+    with tempfile.TemporaryDirectory() as tmp:
+        line_path = os.path.join(tmp, 'news.txt')
+        parquet_path = os.path.join(tmp, 'news.parquet')
+        report['line_write_seconds'] = round(write(line_path, 'line', results, row_group_size, compression), 3)
+        report['parquet_write_seconds'] = round(write(parquet_path, 'parquet', results, row_group_size, compression),
+                                                3)
+        report['line_bytes'] = os.path.getsize(line_path)
+        report['parquet_bytes'] = os.path.getsize(parquet_path)
+        report['line_read_seconds'] = round(timed(read_line, line_path, columns), 3)
+        report['parquet_read_seconds'] = round(timed(read_parquet, parquet_path, columns), 3)
+    report['read_speedup'] = round(report['line_read_seconds'] / max(report['parquet_read_seconds'], 1e-6), 1)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Compare column reads of the line and parquet output formats')
+    parser.add_argument('-r', '--records', help='Number of news results (default=20000)', type=int, default=20000)
+    parser.add_argument('-m', '--median-size', help='Median article size in bytes (default=4000)', type=int,
+                        default=4000)
+    parser.add_argument('--row-group-size', help='Rows per row group (default=10000)', type=int, default=10000)
+    parser.add_argument('--compression', help='Parquet compression codec (default=snappy)', default='snappy')
+    parser.add_argument('-c', '--columns', help='Comma-separated columns to read (default=uri,ts)', default='uri,ts')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.records, args.median_size, args.row_group_size, args.compression,
+                         args.columns.split(',')), indent=2))
@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from multiprocessing import get_context
+from typing import Dict, List
+
+from src.processors.types import Record
+from src.util.transport import RecordRing, receive
+
+
+# What the copy processor does with a record, minus the results: turn the task back into a Record with its content
+def copy_task(record) -> int:
+    return len(receive(record).content)
+
+
+# Pages of log-normal size around `median_size`, mostly ASCII with some multi-byte characters (as in the warcgen
+# corpus)
+def pages(rng: random.Random, count: int, median_size: int) -> List[str]:
+    words = ['news', 'über', 'report', 'élection', 'market', 'weather', 'city', 'sport']
+    result = []
+    for _ in range(count):
+        size = int(rng.lognormvariate(0, 0.6) * median_size)
+        text = ' '.join(rng.choice(words) for _ in range(64))
+        result.append('<html><body>' + text * (size // len(text) + 1) + '</body></html>')
+    return result
+
+
+# Submits `records` records to a spawn pool of `threads` workers, with at most `threads` in flight as in src/main.py
+def run_transport(transport: str, contents: List[str], records: int, threads: int, shm_mb: float) -> Dict:
+    semaphore = threading.Semaphore(threads)
+    done = []
+
+    def callback(value):
+        done.append(value)
+        semaphore.release()
+
+    ring = RecordRing(int(shm_mb * 1024 * 1024)) if transport == 'shm' else None
+    with get_context('spawn').Pool(threads) as p:
+        # Warm up the workers, so the spawn time is not counted
+        p.map(len, [''] * threads)
+        begin, cpu = time.time(), time.process_time()
+        for i in range(records):
+            record = Record(f'https://example.com/{i}', 1614556800.0, contents[i % len(contents)])
+            semaphore.acquire()
+            if ring is not None:
+                record = ring.put(record)
+            p.apply_async(copy_task, (record,), callback=callback)
+        for _ in range(threads):
+            semaphore.acquire()
+        wall, cpu = time.time() - begin, time.process_time() - cpu
+    if ring is not None:
+        ring.close()
+    payload = sum(done)
+    return {'records_per_second': round(records / wall, 1), 'mb_per_second': round(payload / wall / 2 ** 20, 1),
+            'parent_cpu_seconds': round(cpu, 2), 'wall_seconds': round(wall, 2)}
+
+
+def run(records: int, median_size: int, threads: int, shm_mb: float) -> Dict:
+    contents = pages(random.Random(1), 64, median_size)
+    report = {'cpus': os.cpu_count(), 'records': records, 'median_size': median_size, 'threads': threads}
+    for transport in ['pickle', 'shm']:
+        report[transport] = run_transport(transport, contents, records, threads, shm_mb)
+    return report
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Measure the cost of getting records to the pool workers')
+    parser.add_argument('-r', '--records', help='Records (default=5000)', type=int, default=5000)
+    parser.add_argument('-m', '--median-size', help='Median page size in bytes (default=300000)', type=int,
+                        default=300000)
+    parser.add_argument('-t', '--threads', help='Worker processes (default=4)', type=int, default=4)
+    parser.add_argument('--shm-mb', help='Size of the shared memory ring (default=256)', type=float, default=256)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(json.dumps(run(args.records, args.median_size, args.threads, args.shm_mb), indent=2))
@@ -0,0 +1,191 @@
+import argparse
+import io
+import math
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+# Small per-language vocabularies.  The text is gibberish, but it has realistic word lengths, stop words and
+# non-ASCII characters, which is what the parsers care about.
+WORDS = {
+    'en': 'the of and to in is that for it as was with be by on not he this are or his from at which but have an they '
+          'government market election report city police company officials said year people percent president week '
+          'according statement economy court health minister workers investors analysts season team coach'.split(),
+    'de': 'der die und in den von zu das mit sich des auf für ist im dem nicht ein eine als auch es an werden aus er '
+          'hat dass sie nach wird bei einer um am sind noch wie Regierung Markt Wahl Bericht Stadt Polizei Unternehmen '
+          'Beamte sagte Jahr Menschen Prozent Präsident Woche Wirtschaft Gericht Gesundheit Minister Arbeiter'.split(),
+    'fr': 'le de la et les des en un du une que est pour qui dans par plus pas au sur se ne ce il sont avec ou son '
+          'gouvernement marché élection rapport ville police entreprise responsables déclaré année personnes pour '
+          'cent président semaine économie tribunal santé ministre travailleurs investisseurs équipe'.split(),
+    'es': 'de la que el en y a los del se las por un para con no una su al lo como más pero sus le ya o este sí '
+          'gobierno mercado elección informe ciudad policía empresa funcionarios dijo año personas por ciento '
+          'presidente semana economía tribunal salud ministro trabajadores inversores equipo temporada'.split(),
+    'ru': 'и в не на я что он с как а то все она так его но да ты к у же вы за бы по только ее мне было вот '
+          'правительство рынок выборы доклад город полиция компания чиновники заявил год люди процентов президент '
+          'неделя экономика суд здоровье министр рабочие инвесторы команда'.split(),
+}
+
+PAGE_KINDS = ['news', 'rottentomatoes']
+
+
+def sentence(rng: random.Random, words: List[str]) -> str:
+    text = ' '.join(rng.choice(words) for _ in range(rng.randint(6, 24)))
+    return text[0].upper() + text[1:] + '.'
+
+
+def paragraph(rng: random.Random, words: List[str]) -> str:
+    return ' '.join(sentence(rng, words) for _ in range(rng.randint(2, 7)))
+
+
+def boilerplate(rng: random.Random, words: List[str]) -> str:
+    links = ''.join(f'<li><a href="/section/{i}">{rng.choice(words).title()}</a></li>'
+                    for i in range(rng.randint(5, 15)))
+    return f'<nav><ul>{links}</ul></nav><script>var cfg = {{"ads": true, "id": {rng.randint(0, 10 ** 9)}}};</script>'
+
+
+# With probability `syndicated`, the page republishes one of the earlier `articles` (lang, title, paragraphs) under its
+# own URI, author and boilerplate, with one of its paragraphs rewritten.  Every other page's article is added to them.
+def news_page(rng: random.Random, lang: str, size: int, articles: List[Tuple[str, str, List[str]]] = None,
+              syndicated: float = 0.0) -> str:
+    original = None
+    # Only draws when syndicating, so the corpora without syndicated pages stay the same
+    if syndicated > 0 and articles and rng.random() < syndicated:
+        original = rng.choice(articles)
+        lang = original[0]
+    words = WORDS[lang]
+    title = original[1] if original is not None else sentence(rng, words)[:-1]
+    head = f'<head><meta charset="utf-8"><title>{title}</title><meta property="og:title" content="{title}">' \
+           f'<meta name="author" content="{rng.choice(words).title()} {rng.choice(words).title()}"></head>'
+    if original is not None:
+        paragraphs = list(original[2])
+        paragraphs[rng.randrange(len(paragraphs))] = paragraph(rng, words)
+    else:
+        paragraphs = []
+        length = len(head)
+        while length < size:
+            paragraphs.append(paragraph(rng, words))
+            length += len(paragraphs[-1]) + 7
+        if articles is not None and syndicated > 0:
+            articles.append((lang, title, paragraphs))
+    body = [f'<article><h1>{title}</h1>'] + [f'<p>{p}</p>' for p in paragraphs] + ['</article>']
+    return f'<!DOCTYPE html><html lang="{lang}">{head}<body>{boilerplate(rng, words)}{"".join(body)}' \
+           f'<footer>{sentence(rng, words)}</footer></body></html>'
+
+
+def rottentomatoes_page(rng: random.Random, lang: str, size: int) -> str:
+    words = WORDS[lang]
+    title = ' '.join(rng.choice(words) for _ in range(rng.randint(1, 4))).title()
+    scores = f'<span class="meter-value superPageFontColor">{rng.randint(0, 100)}%</span>' \
+             f'<div class="audience-score meter"><span class="superPageFontColor">{rng.randint(0, 100)}%</span></div>'
+    body = [f'<h1 class="mop-ratings-wrap__title">{title}</h1>', scores]
+    length = 0
+    while length < size:
+        review = f'<div class="review_text">{paragraph(rng, words)}</div>'
+        body.append(review)
+        length += len(review)
+    return f'<!DOCTYPE html><html lang="{lang}"><head><title>{title} - Rotten Tomatoes</title></head><body>' \
+           f'{boilerplate(rng, words)}{"".join(body)}</body></html>'
+
+
+def page_uri(rng: random.Random, kind: str, i: int) -> str:
+    if kind == 'rottentomatoes':
+        return f'https://www.rottentomatoes.com/m/movie_{i}'
+    return f'https://news{rng.randint(0, 200)}.example.com/{rng.randint(2015, 2022)}/story-{i}.html'
+
+
+# Page sizes are log-normal around the median, which matches the long tail seen in real crawls
+def page_size(rng: random.Random, median: int, sigma: float) -> int:
+    return max(256, int(rng.lognormvariate(math.log(median), sigma)))
+
+
+# Writes one WARC file where every record is its own gzip member (like Common Crawl) and returns the (offset, length)
+# of each response record.  Each response is preceded by a request record with probability non_response, which the
+# ingestor has to filter out.
+def write_warc(path: str, rng: random.Random, records: int, kind: str, languages: List[str], median_size: int,
+               sigma: float, non_response: float, first_id: int = 0, syndicated: float = 0.0,
+               articles: List[Tuple[str, str, List[str]]] = None) -> List[Tuple[int, int]]:
+    entries = []
+    date = datetime(2021, 3, 1) + timedelta(seconds=rng.randint(0, 86400 * 28))
+    with open(path, 'wb') as fp:
+        writer = WARCWriter(fp, gzip=True)
+        writer.write_record(writer.create_warc_record('', 'warcinfo', payload=io.BytesIO(b'software: bench/warcgen'),
+                                                      warc_content_type='application/warc-fields'))
+        for i in range(first_id, first_id + records):
+            uri = page_uri(rng, kind, i)
+            warc_date = (date + timedelta(seconds=i)).strftime('%Y-%m-%dT%H:%M:%SZ')
+            if rng.random() < non_response:
+                request = f'GET / HTTP/1.1\r\nHost: {uri.split("/")[2]}\r\n\r\n'.encode('utf-8')
+                writer.write_record(writer.create_warc_record(uri, 'request', payload=io.BytesIO(request),
+                                                              warc_content_type='application/http; msgtype=request',
+                                                              warc_headers_dict={'WARC-Date': warc_date}))
+            lang = rng.choice(languages)
+            size = page_size(rng, median_size, sigma)
+            html = news_page(rng, lang, size, articles, syndicated) if kind == 'news' else \
+                rottentomatoes_page(rng, lang, size)
+            payload = html.encode('utf-8')
+            http_headers = StatusAndHeaders('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                                                       ('Content-Length', str(len(payload)))], protocol='HTTP/1.1')
+            offset = fp.tell()
+            writer.write_record(writer.create_warc_record(uri, 'response', payload=io.BytesIO(payload),
+                                                          http_headers=http_headers,
+                                                          warc_headers_dict={'WARC-Date': warc_date}))
+            entries.append((offset, fp.tell() - offset))
+    return entries
+
+
+# Generates a corpus under <directory>/<bucket>/<prefix> (the layout served by bench/s3stub.py) and writes the
+# ingestor index to <directory>/index.txt.  With ranged=True, the index has one "key offset length" line per response
+# record instead of one line per file.  A `syndicated` fraction of the news pages republish earlier articles (see
+# news_page()).
+def generate_corpus(directory: str, files: int = 4, records: int = 250, kind: str = 'news',
+                    languages: List[str] = ('en',), median_size: int = 30000, sigma: float = 0.8,
+                    non_response: float = 0.5, seed: int = 1, bucket: str = 'commoncrawl',
+                    prefix: str = 'bench/CC-NEWS', ranged: bool = False, syndicated: float = 0.0) -> str:
+    rng = random.Random(seed)
+    articles = []
+    os.makedirs(os.path.join(directory, bucket, prefix), exist_ok=True)
+    index_path = os.path.join(directory, 'index.txt')
+    with open(index_path, 'w') as index:
+        for f in range(files):
+            key = f'{prefix}/CC-NEWS-{20210301000000 + f * 100:014d}-{f:05d}.warc.gz'
+            entries = write_warc(os.path.join(directory, bucket, key), rng, records, kind, list(languages),
+                                 median_size, sigma, non_response, first_id=f * records, syndicated=syndicated,
+                                 articles=articles)
+            if ranged:
+                for offset, length in entries:
+                    index.write(f'{key} {offset} {length}\n')
+            else:
+                index.write(f'{key}\n')
+    return index_path
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Generate a synthetic WARC corpus and ingestor index')
+    parser.add_argument('-o', '--output', help='Output directory', required=True)
+    parser.add_argument('-f', '--files', help='Number of WARC files (default=4)', type=int, default=4)
+    parser.add_argument('-r', '--records', help='Response records per file (default=250)', type=int, default=250)
+    parser.add_argument('-k', '--kind', help=f'Page kind: {", ".join(PAGE_KINDS)} (default=news)', default='news')
+    parser.add_argument('-l', '--languages', help=f'Comma-separated languages from {",".join(WORDS)} (default=en)',
+                        default='en')
+    parser.add_argument('-m', '--median-size', help='Median page size in bytes (default=30000)', type=int,
+                        default=30000)
+    parser.add_argument('-s', '--sigma', help='Log-normal sigma of the page size (default=0.8)', type=float,
+                        default=0.8)
+    parser.add_argument('-n', '--non-response', help='Probability of a request record before each response '
+                                                     '(default=0.5)', type=float, default=0.5)
+    parser.add_argument('--syndicated', help='Fraction of news pages republishing an earlier article (default=0)',
+                        type=float, default=0.0)
+    parser.add_argument('--ranged', help='Write one index line per record', action='store_true', default=False)
+    parser.add_argument('--seed', help='Random seed (default=1)', type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(generate_corpus(args.output, args.files, args.records, args.kind, args.languages.split(','),
+                          args.median_size, args.sigma, args.non_response, args.seed, ranged=args.ranged,
+                          syndicated=args.syndicated))
@@ -1,25 +1,49 @@
 import argparse
-import base64
-import gzip
-import json
-import re
-from typing import Tuple, Any, Iterable, Dict, Set, List, Callable
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+from array import array
+from typing import Tuple, Any, Iterable, Iterator, Dict, List
 
 from typing.io import TextIO
 
+from src.storage.reader import read_results, loads
 from src.util.logging import Logger
 
 logger = Logger()
 
+# (input addresses, [(output address, amount)], fee)
+Transaction = Tuple[List[str], List[Tuple[str, float]], Any]
 
-def get_file_type_and_path(path: str) -> Tuple[str, str]:
-    type_re = re.compile('(s3|file)://(.*)')
-    match_type = type_re.match(path)
-    if match_type:
-        file_type = match_type.group(1)
-        path = match_type.group(2)
-        return file_type, path
-    return None
+# Binary output records (40 bytes, little-endian): block and idx as int32, then the group and output address IDs, the
+# amount and the fee (in satoshi) as int64
+TXN_FIELDS = [('block', 'i'), ('idx', 'i'), ('group', 'q'), ('out', 'q'), ('amount', 'q'), ('fee', 'q')]
+TXN_RECORD = struct.Struct('<' + ''.join(t for _, t in TXN_FIELDS))
+
+WRITE_BYTES = 1024 * 1024
+
+
+# The copy processor stores each raw block as a JSON string, which is parsed in the reader's workers
+def block_from_result(payload: Dict) -> Any:
+    return loads(payload['content'])
+
+
+# Parses the blocks of a result and extracts their transactions, as [(block index, [transaction])], in the reader's
+# workers, so only addresses and amounts are sent back.  Transactions without spendable input addresses (e.g.
+# OP_RETURN) are dropped.
+def transactions_from_result(payload: Dict) -> List[Tuple[int, List[Transaction]]]:
+    blocks = []
+    for block in block_from_result(payload)['blocks']:
+        txns = []
+        for txn in block['tx']:
+            addrs, value = process_inputs(txn['inputs'])
+            if len(addrs) == 0:
+                continue
+            txns.append((addrs, process_outputs(txn['out']), txn['fee']))
+        blocks.append((block['block_index'], txns))
+    return blocks
 
 
 class RawInput(Iterable):
@@ -29,25 +53,12 @@ class RawInput(Iterable):
     def __iter__(self):
         return self.iter()
 
-    def __init__(self, input_file):
+    def __init__(self, input_file, workers: int = None, transform=block_from_result):
         self.input_file = input_file
-        file_type, path = get_file_type_and_path(input_file)
-        if file_type == 's3':
-            # Todo: implement
-            pass
-        elif file_type == 'file':
-            self.fd = open(path, 'r')
-        else:
-            raise Exception('Invalid input file format')
+        self.blocks = read_results(input_file, fields=['content'], transform=transform, workers=workers)
 
     def __next__(self) -> Any:
-        line = self.fd.readline()
-        if line == '':
-            raise StopIteration()
-        decoded_line = base64.b64decode(bytes(line, 'utf-8'))
-        decompressed_line = gzip.decompress(decoded_line).decode('utf-8')
-        payload = json.loads(decompressed_line)
-        return json.loads(payload['content'])
+        return next(self.blocks)
 
 
 class Output:
@@ -58,54 +69,271 @@ class Output:
     def append(self, block: int, idx: int, group_addr: str, out_addr: str, amount: float, fee: float):
         self.fd.write(f'{block} {idx} {group_addr} {out_addr} {amount} {fee}\n')
 
-    def footer(self, writer: Callable[[TextIO], None]):
+    def transaction(self, addr_group: 'AddressGroup', block: int, idx: int, group: int,
+                    results: List[Tuple[str, float]], fee: float):
+        group_addr = addr_group.address(group)
+        for out_addr, amount in results:
+            self.append(block, idx, group_addr, out_addr, amount, fee)
+
+    def footer(self, addr_group: 'AddressGroup'):
         self.fd.write('FOOTER\n')
-        writer(self.fd)
+        addr_group.write(self.fd)
+
+    def close(self):
+        self.fd.close()
+
+
+# Fixed-width records (TXN_RECORD) with addresses as IDs.  <output>.addrs lists the address of every ID, one per line,
+# and <output>.groups holds the final group ID of every address ID as an int64 array.  See load_transactions().
+class BinaryOutput:
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self.fd = open(self.output_file, 'wb')
+        self.buffer = bytearray()
+
+    def transaction(self, addr_group: 'AddressGroup', block: int, idx: int, group: int,
+                    results: List[Tuple[str, float]], fee: float):
+        for out_addr, amount in results:
+            self.buffer += TXN_RECORD.pack(block, idx, group, addr_group.id(out_addr), int(amount), int(fee))
+        if len(self.buffer) >= WRITE_BYTES:
+            self.flush()
+
+    def flush(self):
+        self.fd.write(self.buffer)
+        self.buffer = bytearray()
+
+    def footer(self, addr_group: 'AddressGroup'):
+        groups = array('q')
+        with open(f'{self.output_file}.addrs', 'w') as addrs_fd, open(f'{self.output_file}.groups', 'wb') as groups_fd:
+            for i, addr in addr_group.addresses():
+                addrs_fd.write(f'{addr}\n')
+                groups.append(addr_group.find(i))
+                if len(groups) * groups.itemsize >= WRITE_BYTES:
+                    groups.tofile(groups_fd)
+                    groups = array('q')
+            groups.tofile(groups_fd)
 
     def close(self):
+        self.flush()
         self.fd.close()
 
 
+OUTPUT_FORMATS = {'text': Output, 'binary': BinaryOutput}
+
+
+# Maps binary output into numpy arrays: a record array of transactions (with the TXN_FIELDS fields), and the final
+# group ID of every address ID
+def load_transactions(output_file: str) -> Tuple[Any, Any]:
+    import numpy
+    txns = numpy.memmap(output_file, dtype=[(f, f'<{t}') for f, t in TXN_FIELDS], mode='r')
+    groups = numpy.memmap(f'{output_file}.groups', dtype='<i8', mode='r')
+    return txns, groups
+
+
 # We assume all in addresses are owned by the same entity, so organize them
-# as an address group
+# as an address group.  Groups are the connected components of the "spent together" graph, kept in a union-find (path
+# compression and union by size).  Each address is interned to an integer ID on first sight, and the forest is stored
+# in flat arrays indexed by ID, so an address costs one dict entry plus 16 bytes, rather than set memberships.
 class AddressGroup:
     def __init__(self):
-        self.addrs: Dict[str, Set] = {}
-        self.reverse: Dict[str, str] = {}
+        self.ids: Dict[str, int] = {}
+        self.addrs: List[str] = []
+        self.parent = array('q')
+        self.size = array('q')
+
+    def __len__(self) -> int:
+        return len(self.addrs)
+
+    def id(self, addr: str) -> int:
+        i = self.ids.get(addr)
+        if i is None:
+            i = self.ids[addr] = len(self.addrs)
+            self.addrs.append(addr)
+            self.parent.append(i)
+            self.size.append(1)
+        return i
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            # Path halving: point every other node on the path at its grandparent
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Merges the groups of a and b, and returns the root of the merged group
+    def union(self, a: int, b: int) -> int:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        size = self.size
+        if size[a] < size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        size[a] += size[b]
+        return a
 
     def add(self, addrs=[]):
-        found = False
-        for addr in addrs:
-            if addr in self.reverse:
-                group_addr = self.reverse[addr]
-                found = True
-                self.addrs[group_addr] = self.addrs[group_addr].union(set(addrs))
-                break
-        if found is False:
-            self.addrs[addrs[0]] = set(addrs)
-            group_addr = addrs[0]
-        for addr in addrs:
-            self.reverse[addr] = group_addr
+        root = self.id(addrs[0])
+        for addr in addrs[1:]:
+            root = self.union(root, self.id(addr))
+
+    def address(self, i: int) -> str:
+        return self.addrs[i]
+
+    # (id, address) for every address, in ID order
+    def addresses(self) -> Iterator[Tuple[int, str]]:
+        return enumerate(self.addrs)
 
     def group_addr(self, addr):
-        if addr in self.reverse:
-            return self.reverse[addr]
-        self.reverse[addr] = addr
-        self.addrs[addr] = set([addr])
-        return addr
+        return self.address(self.find(self.id(addr)))
 
     def write(self, fd: TextIO):
-        for k in self.reverse:
-            fd.write(f'{k} {self.reverse[k]}\n')
+        for i, addr in self.addresses():
+            fd.write(f'{addr} {self.address(self.find(i))}\n')
+
+    def close(self):
+        pass
+
+
+# Growable array of int64 in a memory-mapped file.  Pages that have been touched count towards the RSS until release()
+# drops them from this process (they stay in the page cache, and are written back by the kernel).
+class MappedArray:
+    def __init__(self, path: str, capacity: int = 1 << 16):
+        self.fd = open(path, 'w+b')
+        self.length = 0
+        self._map(capacity)
+
+    def _map(self, capacity: int):
+        self.fd.truncate(capacity * 8)
+        self.mmap = mmap.mmap(self.fd.fileno(), capacity * 8)
+        self.view = memoryview(self.mmap).cast('q')
+        self.capacity = capacity
+
+    def _unmap(self):
+        self.view.release()
+        self.mmap.close()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, i: int) -> int:
+        return self.view[i]
+
+    def __setitem__(self, i: int, value: int):
+        self.view[i] = value
+
+    def append(self, value: int):
+        if self.length == self.capacity:
+            self._unmap()
+            self._map(self.capacity * 2)
+        self.view[self.length] = value
+        self.length += 1
+
+    def release(self):
+        if hasattr(self.mmap, 'madvise'):
+            self.mmap.madvise(mmap.MADV_DONTNEED)
+
+    def close(self):
+        self._unmap()
+        self.fd.close()
+
+
+# Address groups for more addresses than fit in memory.  The union-find arrays are memory-mapped files, and the
+# address <-> ID index is an SQLite table, in `directory` (a temporary directory by default).  Memory use is kept to
+# about `memory_mb`: SQLite's page cache and the caches of recently used addresses get half of it, and the mapped
+# pages touched by the union-find are dropped from the RSS whenever they could have reached the other half.  Groups
+# (and so the output) are the same as with AddressGroup.
+class DiskAddressGroup(AddressGroup):
+    # Upper bound on the mapped pages a transaction touches (appends and find() paths)
+    PAGES_PER_ADD = 16
+    # Rough size of a cached address
+    CACHE_ENTRY_BYTES = 256
+
+    def __init__(self, memory_mb: int, directory: str = None):
+        super().__init__()
+        self.tmp = tempfile.TemporaryDirectory(dir=directory)
+        budget = memory_mb * 1024 * 1024
+        self.cache_entries = max(1, budget // 8 // self.CACHE_ENTRY_BYTES)
+        self.release_every = max(1, budget // 2 // (mmap.PAGESIZE * self.PAGES_PER_ADD))
+        self.adds = 0
+        self.parent = MappedArray(os.path.join(self.tmp.name, 'parent'))
+        self.size = MappedArray(os.path.join(self.tmp.name, 'size'))
+        self.db = sqlite3.connect(os.path.join(self.tmp.name, 'addrs.db'))
+        self.db.execute('PRAGMA journal_mode = OFF')
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute(f'PRAGMA cache_size = -{budget // 4 // 1024}')
+        self.db.execute('CREATE TABLE addrs (id INTEGER PRIMARY KEY, addr TEXT NOT NULL UNIQUE)')
+        # Caches of recently used addresses, which are emptied when full
+        self.names: Dict[int, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def id(self, addr: str) -> int:
+        i = self.ids.get(addr)
+        if i is not None:
+            return i
+        row = self.db.execute('SELECT id FROM addrs WHERE addr = ?', (addr,)).fetchone()
+        if row is not None:
+            i = row[0]
+        else:
+            i = len(self.parent)
+            self.db.execute('INSERT INTO addrs VALUES (?, ?)', (i, addr))
+            self.parent.append(i)
+            self.size.append(1)
+        if len(self.ids) >= self.cache_entries:
+            self.ids.clear()
+        self.ids[addr] = i
+        return i
+
+    def address(self, i: int) -> str:
+        addr = self.names.get(i)
+        if addr is None:
+            addr = self.db.execute('SELECT addr FROM addrs WHERE id = ?', (i,)).fetchone()[0]
+            if len(self.names) >= self.cache_entries:
+                self.names.clear()
+            self.names[i] = addr
+        return addr
+
+    def _tick(self):
+        self.adds += 1
+        if self.adds % self.release_every == 0:
+            self.parent.release()
+            self.size.release()
+
+    def add(self, addrs=[]):
+        super().add(addrs)
+        self._tick()
+
+    def addresses(self) -> Iterator[Tuple[int, str]]:
+        self.db.commit()
+        for i, addr in self.db.execute('SELECT id, addr FROM addrs ORDER BY id'):
+            self._tick()
+            yield i, addr
+
+    def close(self):
+        self.db.close()
+        self.parent.close()
+        self.size.close()
+        self.tmp.cleanup()
 
 
 def parse():
     parser = argparse.ArgumentParser(description='')
-    parser.add_argument('-i', '--input', help='Input path (e.g. s3://<bucket>/<path> or file://<path>) containing a '
-                                              'compressed, b64 encoded BTC block per line',
+    parser.add_argument('-i', '--input', help='Input path (e.g. s3://<region>.<bucket>/<path>, file://<path> or a '
+                                              'manifest) containing a compressed, b64 encoded BTC block per line',
                         required=True)
     parser.add_argument('-o', '--output', help='Output path (e.g. s3://<bucket>/<path> or file://<path>)',
                         required=False)
+    parser.add_argument('-w', '--workers', help='Processes decoding the input (default=number of CPUs)', type=int,
+                        default=None)
+    parser.add_argument('-f', '--format', help=f'Output format, one of {list(OUTPUT_FORMATS)} (default=text)',
+                        choices=list(OUTPUT_FORMATS), default='text')
+    parser.add_argument('-m', '--memory-mb', help='Cluster addresses on disk, using about this much memory (default='
+                                                  'cluster in memory)', type=int, default=None)
+    parser.add_argument('--cluster-dir', help='Directory for the on-disk clustering files (default=system temporary '
+                                              'directory)', default=None)
     return parser.parse_args()
 
 
@@ -141,31 +369,34 @@ def process_outputs(outputs: List[Dict]) -> List[Tuple[str, float]]:
     return results
 
 
-def main():
-    args = parse()
-    raw_input = RawInput(args.input)
-    output = Output(args.output)
-    addr_group = AddressGroup()
-
-    for block_input in raw_input:
+# Clusters the transactions (from transactions_from_result()) in order and writes them, followed by the footer
+def process_transactions(inputs: Iterable[List[Tuple[int, List[Transaction]]]], output, addr_group: AddressGroup):
+    for blocks in inputs:
         i = 0
-        for block in block_input['blocks']:
-            block_index = block['block_index']
-            for txn in block['tx']:
-                fee = txn['fee']
-                addrs, value = process_inputs(txn['inputs'])
-                # Skip where there are no valid input addresses (e.g. OP_RETURN)
-                if len(addrs) == 0:
-                    continue
+        for block_index, txns in blocks:
+            for addrs, results, fee in txns:
                 addr_group.add(addrs)
-                group_addr = addr_group.group_addr(addrs[0])
-                results = process_outputs(txn['out'])
-                if results is not None and group_addr is not None and fee is not None:
-                    for result in results:
-                        output.append(block_index, i, group_addr, result[0], result[1], fee)
+                group = addr_group.find(addr_group.id(addrs[0]))
+                if results is not None and fee is not None:
+                    output.transaction(addr_group, block_index, i, group, results, fee)
                 i += 1
-    output.footer(addr_group.write)
+    output.footer(addr_group)
+
+
+def main():
+    args = parse()
+    raw_input = RawInput(args.input, args.workers, transform=transactions_from_result)
+    output = OUTPUT_FORMATS[args.format](args.output)
+    if args.memory_mb is not None:
+        addr_group = DiskAddressGroup(args.memory_mb, args.cluster_dir)
+    else:
+        addr_group = AddressGroup()
+
+    # Blocks are decoded in the reader's workers and come back in order; clustering depends on the order, so it runs
+    # here
+    process_transactions(raw_input, output, addr_group)
     output.close()
+    addr_group.close()
 
 
 if __name__ == '__main__':
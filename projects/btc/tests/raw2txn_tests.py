@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from projects.btc.raw2txn import AddressGroup, DiskAddressGroup, BinaryOutput, Output, load_transactions, \
+    process_transactions, transactions_from_result
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Clusters a transaction graph in a child process, and prints how far (in MB) it pushed the peak RSS past startup.
+# ru_maxrss is inherited from the forking parent on Linux, so the high-water mark of the process' own memory is used.
+CLUSTER_SCRIPT = '''
+import json, sys
+from projects.btc.raw2txn import AddressGroup, DiskAddressGroup
+from projects.btc.tests.raw2txn_tests import transactions
+def peak_kb():
+    return int([l for l in open('/proc/self/status') if l.startswith('VmHWM:')][0].split()[1])
+before = peak_kb()
+memory_mb = int(sys.argv[1])
+addr_group = DiskAddressGroup(memory_mb) if memory_mb > 0 else AddressGroup()
+for txn in transactions(int(sys.argv[2])):
+    addr_group.add(txn)
+    addr_group.group_addr(txn[0])
+addr_group.write(open('/dev/null', 'w'))
+print(json.dumps((peak_kb() - before) / 1024))
+'''
+
+
+# Input addresses of `count` transactions, mostly spending recently seen addresses
+def transactions(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    seen = 0
+    for _ in range(count):
+        txn = []
+        for _ in range(rng.randint(1, 3)):
+            if seen > 0 and rng.random() < 0.5:
+                txn.append(f'addr{seen - min(int(rng.paretovariate(0.8)), seen):032d}')
+            else:
+                txn.append(f'addr{seen:032d}')
+                seen += 1
+        yield txn
+
+
+def groups(addr_group: AddressGroup) -> set:
+    members = {}
+    for line in io.StringIO(write(addr_group)):
+        addr, group = line.split()
+        members.setdefault(group, set()).add(addr)
+    return {frozenset(m) for m in members.values()}
+
+
+def write(addr_group: AddressGroup) -> str:
+    fd = io.StringIO()
+    addr_group.write(fd)
+    return fd.getvalue()
+
+
+class AddressGroupTests(unittest.TestCase):
+    def test_merges_existing_groups(self):
+        addr_group = AddressGroup()
+        addr_group.add(['a', 'b'])
+        addr_group.add(['c', 'd'])
+        addr_group.add(['e'])
+        self.assertNotEqual(addr_group.group_addr('a'), addr_group.group_addr('c'))
+        # A transaction spending from both groups joins them
+        addr_group.add(['b', 'x', 'd'])
+        self.assertEqual(groups(addr_group), {frozenset('abcdx'), frozenset('e')})
+        self.assertEqual(len(addr_group), 6)
+        for addr in 'abcdx':
+            self.assertEqual(addr_group.group_addr(addr), addr_group.group_addr('a'))
+        self.assertIn(addr_group.group_addr('a'), 'abcdx')
+
+    def test_unknown_address_is_its_own_group(self):
+        addr_group = AddressGroup()
+        self.assertEqual(addr_group.group_addr('z'), 'z')
+        self.assertEqual(write(addr_group), 'z z\n')
+
+    def test_matches_connected_components(self):
+        rng = random.Random(1)
+        txns = [[f'addr{rng.randint(0, 2000)}' for _ in range(rng.randint(1, 3))] for _ in range(1500)]
+        addr_group = AddressGroup()
+        for txn in txns:
+            addr_group.add(txn)
+        # Reference components, by repeatedly merging overlapping sets
+        components = []
+        for txn in txns:
+            merged = set(txn)
+            for component in [c for c in components if c & merged]:
+                components.remove(component)
+                merged |= component
+            components.append(merged)
+        self.assertEqual(groups(addr_group), {frozenset(c) for c in components})
+        # Union by size keeps the trees shallow
+        depths = []
+        for i in range(len(addr_group)):
+            depth = 0
+            while addr_group.parent[i] != i:
+                i = addr_group.parent[i]
+                depth += 1
+            depths.append(depth)
+        self.assertLessEqual(max(depths), 11)
+
+
+class DiskAddressGroupTests(unittest.TestCase):
+    def test_matches_address_group(self):
+        addr_group, disk_group = AddressGroup(), DiskAddressGroup(1)
+        try:
+            for txn in transactions(20000):
+                addr_group.add(txn)
+                disk_group.add(txn)
+                self.assertEqual(addr_group.group_addr(txn[0]), disk_group.group_addr(txn[0]))
+            self.assertEqual(len(addr_group), len(disk_group))
+            self.assertEqual(write(addr_group), write(disk_group))
+        finally:
+            disk_group.close()
+
+    def _peak_rss_mb(self, memory_mb: int, count: int) -> float:
+        output = subprocess.check_output([sys.executable, '-c', CLUSTER_SCRIPT, str(memory_mb), str(count)],
+                                         env=dict(os.environ, PYTHONPATH=REPO_ROOT))
+        return json.loads(output)
+
+    @unittest.skipUnless(os.path.exists('/proc/self/status'), 'needs /proc to measure peak RSS')
+    def test_peak_rss(self):
+        count = 150000
+        in_memory = self._peak_rss_mb(0, count)
+        on_disk = self._peak_rss_mb(16, count)
+        # Some slack for SQLite's own allocations and the interpreter
+        self.assertLess(on_disk, 16 + 8)
+        self.assertGreater(in_memory, 2 * on_disk)
+
+
+def txn(inputs, outputs, fee=1000):
+    return {'fee': fee, 'inputs': [{'prev_out': {'value': v, 'addr': a}} for a, v in inputs],
+            'out': [{'value': v, 'addr': a} for a, v in outputs]}
+
+
+BLOCKS = {'blocks': [
+    {'block_index': 7, 'tx': [{'fee': 0, 'inputs': [{'prev_out': {'value': 0}}], 'out': [{'value': 625, 'addr': 'm'}]},
+                              txn([('a', 5), ('b', 5)], [('c', 4), ('d', 5)]),
+                              {'fee': 0, 'inputs': [{'prev_out': {'value': 3}}], 'out': [{'value': 3}]},
+                              txn([('c', 4), ('e', 1)], [('a', 4)], fee=500)]},
+    {'block_index': 8, 'tx': [txn([('e', 1), ('b', 2)], [('f', 2), ('g', 0)])]}]}
+
+
+class OutputTests(unittest.TestCase):
+    def test_transactions_from_result(self):
+        blocks = transactions_from_result({'content': json.dumps(BLOCKS)})
+        self.assertEqual(blocks, [
+            (7, [(['COINBASE'], [('m', 625)], 0), (['a', 'b'], [('c', 4), ('d', 5)], 1000),
+                 (['c', 'e'], [('a', 4)], 500)]),
+            (8, [(['e', 'b'], [('f', 2)], 1000)])])
+
+    def test_binary_matches_text(self):
+        blocks = transactions_from_result({'content': json.dumps(BLOCKS)})
+        with tempfile.TemporaryDirectory() as tmp:
+            text, binary = Output(os.path.join(tmp, 'txns.txt')), BinaryOutput(os.path.join(tmp, 'txns'))
+            process_transactions([blocks], text, AddressGroup())
+            process_transactions([blocks], binary, AddressGroup())
+            text.close()
+            binary.close()
+            body, footer = open(text.output_file).read().split('FOOTER\n')
+            self.assertEqual(body.splitlines()[:2], ['7 0 COINBASE m 625 0', '7 1 a c 4 1000'])
+            txns, groups = load_transactions(binary.output_file)
+            addrs = open(f'{binary.output_file}.addrs').read().splitlines()
+            self.assertEqual(os.path.getsize(binary.output_file), 40 * len(txns))
+            self.assertEqual([' '.join(str(v) for v in (t['block'], t['idx'], addrs[t['group']], addrs[t['out']],
+                                                        t['amount'], t['fee'])) for t in txns], body.splitlines())
+            final = {addr: addrs[group] for addr, group in zip(addrs, groups)}
+            for line in footer.splitlines():
+                addr, group = line.split()
+                self.assertEqual(final[addr], group)
+            # Output addresses that never spend are their own group
+            self.assertEqual(final['f'], 'f')
+            self.assertEqual(len({final[a] for a in 'abce'}), 1)
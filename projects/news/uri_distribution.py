@@ -1,47 +1,84 @@
 import argparse
-import base64
-import gzip
-import json
 import re
+import sys
+from collections import Counter
+from functools import partial
+from typing import Dict, Iterator, Optional, List
+
+from src.storage.reader import map_results
+from src.util.sketch import SpaceSaving
 
 
 def parse():
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-i', '--input',
-                        help='Input file containing entries processed by the main crawlthethings processor',
-                        required=True)
+                        help='Input files (or manifests) containing entries processed by the main crawlthethings '
+                             'processor', required=True, nargs='+')
+    parser.add_argument('-w', '--workers', help='Processes decoding the input (default=number of CPUs)', type=int,
+                        default=None)
+    parser.add_argument('-a', '--approximate', help='Count the top domains in fixed memory with a Space-Saving sketch '
+                                                    'of this many domains (default=exact counts)', type=int,
+                        default=None)
+    parser.add_argument('-k', '--top', help='Only output the top K domains (default=all)', type=int, default=None)
     return parser.parse_args()
 
 
-def main(input_file: str):
-    distribution = {}
-    with open(input_file) as f:
-        while True:
-            line = f.readline()
-            if line != '':
-                decoded = base64.b64decode(line)
-                decompressed = gzip.decompress(decoded)
-                payload = json.loads(decompressed)
-                if 'uri' in payload:
-                    result = re.search(r'https?:\/\/([^\ /]*)', payload['uri'])
-                    if result is not None and result.group(1):
-                        domain = result.group(1)
-                        if domain not in distribution:
-                            distribution[domain] = 0
-                        distribution[domain] += 1
-                    else:
-                        raise Exception(f"Could not extract domain from {payload['uri']}")
-            else:
-                break
+def get_domain(uri: str) -> str:
+    result = re.search(r'https?:\/\/([^\ /]*)', uri)
+    if result is not None and result.group(1):
+        return result.group(1)
+    raise Exception(f"Could not extract domain from {uri}")
+
+
+def domains(payloads: Iterator[Dict]) -> Iterator[str]:
+    for payload in payloads:
+        if payload['uri'] is not None:
+            yield get_domain(payload['uri'])
+
+
+# Map steps, run by the reader's workers on each chunk of the input
+def count_domains(payloads: Iterator[Dict]) -> Counter:
+    return Counter(domains(payloads))
+
+
+def summarize_domains(payloads: Iterator[Dict], capacity: int) -> SpaceSaving:
+    summary = SpaceSaving(capacity)
+    for domain in domains(payloads):
+        summary.offer(domain)
+    return summary
+
+
+def exact_distribution(inputs: List[str], workers: int = None) -> List[tuple]:
+    distribution = Counter()
+    for partial_counts in map_results(inputs, count_domains, fields=['uri'], workers=workers):
+        distribution.update(partial_counts)
     sorted = []
     for k in distribution:
         sorted.append((k, distribution[k]))
     sorted.sort(key=lambda x: x[1], reverse=True)
+    return sorted
+
+
+def approximate_distribution(inputs: List[str], capacity: int, workers: int = None) -> SpaceSaving:
+    summary = SpaceSaving(capacity)
+    for partial_summary in map_results(inputs, partial(summarize_domains, capacity=capacity), fields=['uri'],
+                                       workers=workers):
+        summary.merge(partial_summary)
+    return summary
+
 
-    for elm in sorted:
-        print(f'{elm[0]}: {elm[1]}')
+def main(inputs: List[str], workers: int = None, approximate: Optional[int] = None, top: Optional[int] = None):
+    if approximate is None:
+        for elm in exact_distribution(inputs, workers)[:top]:
+            print(f'{elm[0]}: {elm[1]}')
+        return
+    summary = approximate_distribution(inputs, approximate, workers)
+    print(f'Approximate counts over {summary.total} URIs: counts overestimate by at most the error shown, which is '
+          f'at most {summary.error_bound():.1f}', file=sys.stderr)
+    for domain, count, error in summary.top(top):
+        print(f'{domain}: {count} (error <= {error})')
 
 
 if __name__ == '__main__':
     args = parse()
-    main(args.input)
+    main(args.input, args.workers, args.approximate, args.top)
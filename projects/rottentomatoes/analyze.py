@@ -1,8 +1,7 @@
 import argparse
 import sys
 import sqlite3
-from typing import Tuple, List
-import functools
+from typing import Iterator, Tuple, List
 import time
 
 import numpy
@@ -15,6 +14,8 @@ def parse():
     parser.add_argument('-a','--audience', help='Consider audience scores', action='store_true', default=False)
     parser.add_argument('-t','--threshold', help='Numeric threshold', required=True, type=float)
     parser.add_argument('-D','--delta-func', help='Delta function (slope or minmax)', default="slope")
+    parser.add_argument('-R', '--recompute', help='Recompute from every snapshot, instead of using the aggregates '
+                                                  'kept by load_rt.py', action='store_true', default=False)
 
     args = parser.parse_args()
 
@@ -24,20 +25,112 @@ def parse():
     return args
 
 
-def get_critic_point(score: str) -> Tuple[float, float]:
-    score_ary = score.split(';')
-    return float(score_ary[0]), float(score_ary[1])
+# Score column of each label
+SCORES = {'critics': 'critic', 'audience': 'audience'}
 
+# Snapshots with a NULL column are left out, as they were by the group_concat() query this replaced
+COMPLETE = 'ts is not null and critic is not null and numCritic is not null and audience is not null ' \
+           'and numAudience is not null'
 
-def get_audience_point(score: str) -> Tuple[float, float]:
-    score_ary = score.split(';')
-    return float(score_ary[0]), float(score_ary[2])
 
-
-def add_point(points: Tuple[List[float], List[float]], point: Tuple[float, float]) -> Tuple[List[float], List[float]]:
-    points[0].append(point[0])
-    points[1].append(point[1])
-    return points
+# Reads every snapshot as numpy arrays sorted by movie and then ts: (names, ts, critic, audience)
+def load_scores(conn: sqlite3.Connection) -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    query = f'''
+    select name, ts, critic, audience
+           from rt
+           where {COMPLETE}
+           order by name, ts asc
+    '''
+    rows = conn.execute(query).fetchall()
+    names = numpy.array([row[0] for row in rows], dtype=object)
+    values = numpy.array([row[1:] for row in rows], dtype=numpy.float64).reshape(-1, 3)
+    return names, values[:, 0], values[:, 1], values[:, 2]
+
+
+# Index of the first snapshot of each movie in the sorted arrays
+def group_starts(names: numpy.ndarray) -> numpy.ndarray:
+    if len(names) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    return numpy.concatenate([[0], numpy.flatnonzero(names[1:] != names[:-1]) + 1])
+
+
+# Least-squares slope of y against x, and max(y) - min(y), for all groups at once.  The slope is the closed form of
+# what linear_regression_2d() gets from numpy.linalg.lstsq(), computed on centered values so that large timestamps do
+# not cancel out.  When all of a group's x are equal (e.g. a single snapshot), lstsq returns the minimum-norm solution,
+# whose slope is mean(x) * mean(y) / (mean(x)^2 + 1).
+def grouped_deltas(x: numpy.ndarray, y: numpy.ndarray, starts: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    if len(starts) == 0:
+        return numpy.zeros(0), numpy.zeros(0)
+    counts = numpy.diff(numpy.append(starts, len(x)))
+    mean_x = numpy.add.reduceat(x, starts) / counts
+    mean_y = numpy.add.reduceat(y, starts) / counts
+    dx = x - numpy.repeat(mean_x, counts)
+    dy = y - numpy.repeat(mean_y, counts)
+    sxx = numpy.add.reduceat(dx * dx, starts)
+    sxy = numpy.add.reduceat(dx * dy, starts)
+    degenerate = sxx == 0
+    slopes = numpy.where(degenerate, mean_x * mean_y / (mean_x * mean_x + 1), sxy / numpy.where(degenerate, 1, sxx))
+    minmax = numpy.maximum.reduceat(y, starts) - numpy.minimum.reduceat(y, starts)
+    return slopes, minmax
+
+
+def has_aggregates(conn: sqlite3.Connection) -> bool:
+    return conn.execute("select 1 from sqlite_master where type = 'table' and name = 'rt_agg'").fetchone() is not None
+
+
+# Per-movie sums kept by load_rt.py for one score column, sorted by name: (names, n, x0, sx, sy, sxy, sxx, ymin,
+# ymax), where x is measured from the movie's x0 (see load_rt.py)
+def load_aggregates(conn: sqlite3.Connection, score: str) -> Tuple[numpy.ndarray, ...]:
+    rows = conn.execute('select name, n, x0, sx, sy, sxy, sxx, ymin, ymax from rt_agg where score = ? order by name',
+                        (score,)).fetchall()
+    names = numpy.array([row[0] for row in rows], dtype=object)
+    values = numpy.array([row[1:] for row in rows], dtype=numpy.float64).reshape(-1, 8)
+    return (names,) + tuple(values.T)
+
+
+# Slope and max - min of every movie from its sums, with the same closed form (and the same minimum-norm slope for
+# degenerate movies) as grouped_deltas()
+def aggregate_deltas(n: numpy.ndarray, x0: numpy.ndarray, sx: numpy.ndarray, sy: numpy.ndarray, sxy: numpy.ndarray,
+                     sxx: numpy.ndarray, ymin: numpy.ndarray,
+                     ymax: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    cxx = sxx - sx * sx / n
+    cxy = sxy - sx * sy / n
+    degenerate = cxx == 0
+    mean_x = x0 + sx / n
+    mean_y = sy / n
+    slopes = numpy.where(degenerate, mean_x * mean_y / (mean_x * mean_x + 1), cxy / numpy.where(degenerate, 1, cxx))
+    return slopes, ymax - ymin
+
+
+# (movie names, {label: (slopes, minmax)}, points(movie, label)) from every snapshot
+def recomputed_deltas(conn: sqlite3.Connection, labels: List[str]):
+    names, ts, critic_scores, audience_scores = load_scores(conn)
+    scores = {'critics': critic_scores, 'audience': audience_scores}
+    starts = group_starts(names)
+    ends = numpy.append(starts[1:], len(names))
+
+    def points(movie: int, label: str) -> Tuple[List[float], List[float]]:
+        start, end = starts[movie], ends[movie]
+        return ts[start:end].tolist(), scores[label][start:end].tolist()
+
+    return names[starts], {label: grouped_deltas(ts, scores[label], starts) for label in labels}, points
+
+
+# The same from the aggregates, in O(movies).  Only the snapshots of the movies that are printed are read, through the
+# (name, ts) index.
+def aggregated_deltas(conn: sqlite3.Connection, labels: List[str]):
+    names = numpy.array([], dtype=object)
+    deltas = {}
+    for label in labels:
+        names, *sums = load_aggregates(conn, SCORES[label])
+        deltas[label] = aggregate_deltas(*sums)
+
+    def points(movie: int, label: str) -> Tuple[List[float], List[float]]:
+        rows = conn.execute(f'select ts, {SCORES[label]} from rt where name = ? and {COMPLETE} order by ts asc',
+                            (names[movie],)).fetchall()
+        return [float(row[0]) for row in rows], [float(row[1]) for row in rows]
+
+    return names, deltas, points
 
 
 def linear_regression_2d(points: Tuple[List[float], List[float]]) -> Tuple[float, float]:
@@ -55,44 +148,43 @@ def formatted_ts(points: Tuple[List[float], List[float]]) -> List[Tuple[str, flo
     return list(zip(formatted_ts, points[1]))
 
 
+# Lines for the movies whose critic and/or audience scores moved by more than the threshold, by name.  The aggregates
+# kept by load_rt.py are used when the DB has them, unless `recompute` is set.
+def report(conn: sqlite3.Connection, critics: bool, audience: bool, threshold: float, delta_func: str = 'slope',
+           recompute: bool = False) -> Iterator[str]:
+    labels = [label for label, enabled in [('critics', critics), ('audience', audience)] if enabled]
+    if recompute or not has_aggregates(conn):
+        names, deltas, points = recomputed_deltas(conn, labels)
+    else:
+        names, deltas, points = aggregated_deltas(conn, labels)
+
+    selected = []
+    printed = numpy.zeros(len(names), dtype=bool)
+    for label in labels:
+        slopes, minmax = deltas[label]
+        if delta_func == 'slope':
+            matches = numpy.abs(slopes) > threshold
+        elif delta_func == 'minmax':
+            matches = minmax > threshold
+        else:
+            matches = numpy.zeros(len(names), dtype=bool)
+        selected.append((label, slopes, minmax, matches))
+        printed |= matches
+
+    # Only the movies that are printed are turned back into Python values
+    for movie in numpy.flatnonzero(printed):
+        for label, slopes, minmax, matches in selected:
+            if matches[movie]:
+                yield f'{names[movie]} ({label}): minmax={float(minmax[movie])} slope={slopes[movie]} ' \
+                      f'ts={formatted_ts(points(movie, label))}'
+
+
 def main():
     args = parse()
 
-    query = '''
-    select group_concat(ts || ';' || critic || ';' || numCritic || ';' || audience  || ';' || numAudience, ','), 
-           name 
-           from rt 
-           group by name order by name, ts asc
-    '''
-
     conn = sqlite3.connect(args.db)
-    cur = conn.cursor()
-    for row in cur.execute(query):
-        scores=row[0].split(',')
-        scores=sorted(scores, key=lambda x: float(x.split(';')[0]))
-        name=row[1]
-
-        if args.critics:
-            critic_ts = functools.reduce(lambda points, score: add_point(points, get_critic_point(score)), scores, ([],[]))
-            slope, y_int = linear_regression_2d(critic_ts)
-            value = max(critic_ts[1]) - min(critic_ts[1])
-            if args.delta_func == 'slope':
-                if numpy.abs(slope) > args.threshold:
-                    print(f'{name} (critics): minmax={value} slope={slope} ts={formatted_ts(critic_ts)}')
-            elif args.delta_func == 'minmax':
-                if value > args.threshold:
-                    print(f'{name} (critics): minmax={value} slope={slope} ts={formatted_ts(critic_ts)}')
-
-        if args.audience:
-            audience_ts = functools.reduce(lambda points, score: add_point(points, get_audience_point(score)), scores, ([],[]))
-            slope, y_int = linear_regression_2d(audience_ts)
-            value = max(audience_ts[1]) - min(audience_ts[1])
-            if args.delta_func == 'slope':
-                if numpy.abs(slope) > args.threshold:
-                    print(f'{name} (audience): minmax={value} slope={slope} ts={formatted_ts(audience_ts)}')
-            elif args.delta_func == 'minmax':
-                if value > args.threshold:
-                    print(f'{name} (audience): minmax={value} slope={slope} ts={formatted_ts(audience_ts)}')
+    for line in report(conn, args.critics, args.audience, args.threshold, args.delta_func, args.recompute):
+        print(line)
 
 
 if __name__ == '__main__':
@@ -1,7 +0,0 @@
-{
-    gsub("%", "", $3); 
-    gsub("%", "", $4); 
-    if($3~/^[0-9]+$/ && $4~/^[0-9]+$/) {
-        print "insert into rt values("$1",'"$2"',"$3","$4',"$5","$6");"
-    }
-}
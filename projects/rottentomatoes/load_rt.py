@@ -0,0 +1,188 @@
+import argparse
+import re
+import sqlite3
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from src.storage.reader import expand_paths, read_results
+from src.util.logging import Logger
+
+logger = Logger()
+
+# Schema of the table analyze.py reads (see process_rt.sh for the original)
+CREATE_TABLE = 'create table if not exists rt(ts bigint, name varchar, critic smallint, numCritic smallint, ' \
+               'audience smallint, numAudience smallint)'
+CREATE_INDEX = 'create index if not exists rt_name_ts on rt(name, ts)'
+# Files that have been loaded, so that loading the same output again only adds new files
+CREATE_FILES = 'create table if not exists rt_files(path varchar primary key, rows integer, skipped integer, ' \
+               'loaded_at double)'
+# New rows are staged here, so that they can be added to the aggregates before being moved to rt
+CREATE_STAGING = 'create temp table if not exists rt_new as select * from rt where 0'
+INSERT = 'insert into rt_new values (?, ?, ?, ?, ?, ?)'
+
+# Per-movie sums for the regression of each score column against ts (see analyze.py), so that a load only has to add
+# the new snapshots.  x is measured from x0, the first ts seen for the movie, which keeps sxx (sum of x * x) far from
+# the magnitude where the subtraction in the slope would cancel out, and keeps x exactly 0 when all snapshots share a
+# ts.
+CREATE_AGGREGATES = 'create table if not exists rt_agg(name varchar, score varchar, n integer, x0 bigint, ' \
+                    'sx double, sy double, sxy double, sxx double, ymin double, ymax double, ' \
+                    'primary key (name, score))'
+SCORES = ['critic', 'audience']
+
+# Adds the rows of `source` to the aggregates of `score`.  The sums of movies that already have aggregates are shifted
+# from the new x0 to the existing one (x - x0 = x - new_x0 + (new_x0 - x0)).
+UPDATE_AGGREGATES = '''
+insert into rt_agg
+select name, '{score}', count(*), x0, sum(x), sum({score}), sum(x * {score}), sum(x * x), min({score}), max({score})
+       from (select name, {score}, min(ts) over movie as x0, (ts - min(ts) over movie) * 1.0 as x
+                    from {source} window movie as (partition by name))
+       where true
+       group by name
+on conflict (name, score) do update set
+       n = n + excluded.n,
+       sx = sx + excluded.sx + excluded.n * (excluded.x0 - x0),
+       sy = sy + excluded.sy,
+       sxy = sxy + excluded.sxy + (excluded.x0 - x0) * excluded.sy,
+       sxx = sxx + excluded.sxx + 2.0 * (excluded.x0 - x0) * excluded.sx
+             + excluded.n * (excluded.x0 - x0) * (excluded.x0 - x0),
+       ymin = min(ymin, excluded.ymin),
+       ymax = max(ymax, excluded.ymax)
+'''
+
+# Rows analyze.py considers (see analyze.py:COMPLETE)
+COMPLETE_ROWS = '(select * from rt where ts is not null and critic is not null and numCritic is not null and ' \
+                'audience is not null and numAudience is not null)'
+
+FIELDS = ['uri', 'ts', 'criticScore', 'criticNum', 'audienceScore', 'audienceNum']
+
+DEFAULT_BATCH_SIZE = 50000
+
+MOVIE_URI = re.compile(r'https?://(www\.)?rottentomatoes.com/m/([^/]*)/?')
+
+Row = Tuple[int, str, int, int, int, int]
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Load rottentomatoes processor output into the rt table')
+    parser.add_argument('-d', '--db', help='SQLite DB to load (created if needed)', required=True)
+    parser.add_argument('-i', '--input', help='Output files (or manifests) of the rottentomatoes processor',
+                        required=True, nargs='+')
+    parser.add_argument('-w', '--workers', help='Processes decoding the input (default=number of CPUs)', type=int,
+                        default=None)
+    parser.add_argument('-b', '--batch-size', help=f'Rows per executemany() (default={DEFAULT_BATCH_SIZE})',
+                        type=int, default=DEFAULT_BATCH_SIZE)
+    return parser.parse_args()
+
+
+# https://www.rottentomatoes.com/m/<name>[/...][?...] -> <name>[...], as process_rt.sh's sed and awk did
+def movie_name(uri: str) -> str:
+    match = MOVIE_URI.search(uri)
+    if match is not None:
+        uri = uri[:match.start()] + match.group(2) + uri[match.end():]
+    return uri.split('?', 1)[0]
+
+
+# Scores are stored as e.g. '85%' or '85', and as 'None' (or None) when the page has none
+def score(value) -> Optional[int]:
+    if type(value) is int:
+        return value
+    if value is None:
+        return None
+    value = value.rstrip('%')
+    return int(value) if value.isdigit() else None
+
+
+# Turns a processor result into an rt row, or None when it is an error or has a missing score (run in the reader's
+# workers)
+def row_from_result(payload: Dict) -> Optional[Row]:
+    uri, ts = payload.get('uri'), payload.get('ts')
+    if uri is None or ts is None:
+        return None
+    critic, num_critic = score(payload.get('criticScore')), score(payload.get('criticNum'))
+    audience, num_audience = score(payload.get('audienceScore')), score(payload.get('audienceNum'))
+    if critic is None or num_critic is None or audience is None or num_audience is None:
+        return None
+    return int(ts), movie_name(uri), critic, num_critic, audience, num_audience
+
+
+def batches(rows: Iterator[Optional[Row]], batch_size: int, skipped: List[int]) -> Iterator[List[Row]]:
+    batch = []
+    for row in rows:
+        if row is None:
+            skipped[0] += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def connect(db: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db)
+    conn.execute('pragma journal_mode = wal')
+    conn.execute('pragma synchronous = normal')
+    conn.execute('pragma cache_size = -65536')
+    conn.execute(CREATE_TABLE)
+    conn.execute(CREATE_FILES)
+    conn.execute(CREATE_STAGING)
+    if conn.execute("select 1 from sqlite_master where type = 'table' and name = 'rt_agg'").fetchone() is None:
+        conn.execute(CREATE_AGGREGATES)
+        # Snapshots loaded before the aggregates existed (analyze.py also needs the index to read their history)
+        conn.execute(CREATE_INDEX)
+        update_aggregates(conn, COMPLETE_ROWS)
+    conn.commit()
+    return conn
+
+
+def update_aggregates(conn: sqlite3.Connection, source: str):
+    for score in SCORES:
+        conn.execute(UPDATE_AGGREGATES.format(score=score, source=source))
+
+
+# Loads every file that is not in rt_files yet.  Each file is loaded in one transaction, together with its rt_files
+# entry and the aggregates update, so an interrupted load is picked up again from the first file that did not finish.
+# When rt starts out empty, the (name, ts) index is built once at the end instead of being updated by every insert.
+def load(conn: sqlite3.Connection, paths: List[str], workers: int = None,
+         batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    loaded = {row[0] for row in conn.execute('select path from rt_files')}
+    if conn.execute('select 1 from rt limit 1').fetchone() is None:
+        conn.execute('drop index if exists rt_name_ts')
+    else:
+        conn.execute(CREATE_INDEX)
+    totals = {'files': 0, 'rows': 0, 'skipped': 0}
+    for path in expand_paths(paths):
+        if path in loaded:
+            logger.info(f'Skipping {path}, which is already loaded')
+            continue
+        begin = time.time()
+        rows, skipped = 0, [0]
+        with conn:
+            conn.execute('delete from rt_new')
+            results = read_results(path, fields=FIELDS, transform=row_from_result, workers=workers)
+            for batch in batches(results, batch_size, skipped):
+                conn.executemany(INSERT, batch)
+                rows += len(batch)
+            update_aggregates(conn, 'rt_new')
+            conn.execute('insert into rt select * from rt_new')
+            conn.execute('insert into rt_files values (?, ?, ?, ?)', (path, rows, skipped[0], time.time()))
+        logger.info(f'Loaded {rows} rows ({skipped[0]} skipped) from {path} in {time.time() - begin:.1f}s')
+        totals['files'] += 1
+        totals['rows'] += rows
+        totals['skipped'] += skipped[0]
+    conn.execute(CREATE_INDEX)
+    conn.commit()
+    return totals
+
+
+def main():
+    args = parse()
+    conn = connect(args.db)
+    totals = load(conn, args.input, args.workers, args.batch_size)
+    logger.info(f'Loaded {totals["rows"]} rows ({totals["skipped"]} skipped) from {totals["files"]} files')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
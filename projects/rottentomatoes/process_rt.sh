@@ -9,16 +9,4 @@ if [[ $? != "0"]; then
     exit 1
 fi
 
-for prefix in 0 1 2 3 4 5 6 7 8 9 a b c d e f; do
-    cat ${OUTDIR}/results.${prefix}*.json | jq -r '.[]' | \
-        jq -r '[(.ts|tostring),.uri, .criticScore, .numCritic, .audienceScore, .numAudience] | join(",")' | \
-        sed -E 's/https?:\/\/(www\.)?rottentomatoes.com\/m\/([^\/]*)\/?/\2/'  | \
-        awk -F, '{split($2,ary,"?"); print $1","ary[1]","$3","$4","$5","$6;}' | \
-        grep -v null >> ${OUTDIR}/movies.csv
-done
-
-echo "create table rt(ts bigint, name varchar, critic smallint, numCritic smallint, audience smallint, numAudience smallint);" | sqlite3 ${OUTDIR}/movies.db
-
-cat ${OUTDIR}/movies.csv | awk -F, -f ${BASEDIR}/projects/rottentomatoes/insert_stmt.awk | sqlite3 ${OUTDIR}/movies.db
-
-
+pipenv run python3 ${BASEDIR}/projects/rottentomatoes/load_rt.py -d ${OUTDIR}/movies.db -i ${OUTDIR}/results.*.json
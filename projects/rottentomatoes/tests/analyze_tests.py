@@ -0,0 +1,67 @@
+import random
+import re
+import sqlite3
+import unittest
+
+import numpy
+
+from projects.rottentomatoes.analyze import grouped_deltas, group_starts, linear_regression_2d, load_scores, report
+
+
+class GroupedDeltasTests(unittest.TestCase):
+    def test_matches_lstsq(self):
+        rng = random.Random(1)
+        groups = []
+        for g in range(300):
+            ts = 1577836800 + rng.randint(0, 10 ** 7)
+            n = rng.choice([1, 1, 2, 3, 10, 50])
+            points = ([], [])
+            for _ in range(n):
+                points[0].append(float(ts))
+                points[1].append(float(rng.randint(0, 100)))
+                # Some movies have every snapshot at the same ts
+                ts += 0 if g % 7 == 0 else rng.randint(1, 30) * 86400
+            groups.append(points)
+        x = numpy.array([v for points in groups for v in points[0]])
+        y = numpy.array([v for points in groups for v in points[1]])
+        starts = numpy.cumsum([0] + [len(points[0]) for points in groups[:-1]])
+        slopes, minmax = grouped_deltas(x, y, starts)
+        for i, points in enumerate(groups):
+            slope, _ = linear_regression_2d(points)
+            self.assertAlmostEqual(slopes[i], slope, delta=1e-9 * max(1.0, abs(slope)))
+            self.assertEqual(minmax[i], max(points[1]) - min(points[1]))
+
+    def test_group_starts(self):
+        self.assertEqual(group_starts(numpy.array(['a', 'a', 'b', 'c', 'c'], dtype=object)).tolist(), [0, 2, 3])
+        self.assertEqual(group_starts(numpy.array([], dtype=object)).tolist(), [])
+
+
+class ReportTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(':memory:')
+        self.conn.execute('create table rt(ts bigint, name varchar, critic smallint, numCritic smallint, '
+                          'audience smallint, numAudience smallint)')
+        self.conn.executemany('insert into rt values (?, ?, ?, ?, ?, ?)', [
+            (1600086400, 'b', 50, 10, 70, 100), (1600000000, 'b', 40, 9, 75, 90), (1600172800, 'b', 60, 11, 60, 80),
+            (1600000000, 'a', 90, 300, 80, 5000), (1600086400, 'a', 91, 301, 80, 5100),
+            (1600000000, 'c', 10, 1, None, 1)])
+
+    def test_load_scores(self):
+        names, ts, critic, audience = load_scores(self.conn)
+        self.assertEqual(names.tolist(), ['a', 'a', 'b', 'b', 'b'])
+        self.assertEqual(ts.tolist(), [1600000000, 1600086400, 1600000000, 1600086400, 1600172800])
+        self.assertEqual(audience.tolist(), [80, 80, 75, 70, 60])
+
+    def test_minmax(self):
+        lines = list(report(self.conn, True, True, 5, 'minmax'))
+        self.assertEqual([line.split(':')[0] for line in lines], ['b (critics)', 'b (audience)'])
+        self.assertTrue(lines[0].startswith('b (critics): minmax=20.0 slope='))
+        # Audience scores come from the audience column
+        self.assertTrue(lines[1].startswith('b (audience): minmax=15.0 slope='))
+        self.assertEqual(re.findall(r', (\d+\.\d+)\)', lines[1]), ['75.0', '70.0', '60.0'])
+
+    def test_slope(self):
+        lines = list(report(self.conn, True, False, 1e-5, 'slope'))
+        self.assertEqual([line.split(':')[0] for line in lines], ['a (critics)', 'b (critics)'])
+        slope = float(lines[1].split('slope=')[1].split(' ')[0])
+        self.assertAlmostEqual(slope, 10 / 86400)
@@ -0,0 +1,133 @@
+import os
+import random
+import sqlite3
+import tempfile
+import unittest
+
+from projects.rottentomatoes.analyze import report
+from projects.rottentomatoes.load_rt import connect, load, movie_name, row_from_result, CREATE_TABLE
+from src.processors.rottentomatoes import RottenTomatoesProcessor
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+def result(name: str, ts: int, critic='85%', audience='90%', uri_suffix: str = ''):
+    return {'uri': f'https://www.rottentomatoes.com/m/{name}{uri_suffix}', 'ts': ts, 'criticScore': critic,
+            'criticNum': 100, 'audienceScore': audience, 'audienceNum': 2000}
+
+
+class RowTests(unittest.TestCase):
+    def test_movie_name(self):
+        self.assertEqual(movie_name('https://www.rottentomatoes.com/m/the_matrix'), 'the_matrix')
+        self.assertEqual(movie_name('http://rottentomatoes.com/m/the_matrix/?page=2'), 'the_matrix')
+
+    def test_row_from_result(self):
+        self.assertEqual(row_from_result(result('a', 1614556800.5)), (1614556800, 'a', 85, 100, 90, 2000))
+        self.assertEqual(row_from_result(result('a', 1, critic=85, audience='90')), (1, 'a', 85, 100, 90, 2000))
+        self.assertIsNone(row_from_result(result('a', 1, audience='None')))
+        self.assertIsNone(row_from_result(result('a', 1, critic=None)))
+        self.assertIsNone(row_from_result({'error': 'Error processing: x', 'reason': 'y'}))
+
+
+class LoadTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.conn = connect(os.path.join(self.tmp.name, 'movies.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def _write(self, name: str, output_format: str, results):
+        path = os.path.join(self.tmp.name, name)
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', output_format,
+                                                         RottenTomatoesProcessor.schema))
+        storage_object.append_results(results)
+        storage_object.close_and_flush()
+        return path
+
+    def test_incremental_load(self):
+        first = self._write('results.0.json', 'line', [result('a', 1), result('b', 2), {'error': 'x'}])
+        totals = load(self.conn, [first], workers=1, batch_size=1)
+        self.assertEqual(totals, {'files': 1, 'rows': 2, 'skipped': 1})
+        self.assertEqual(self.conn.execute('select name from sqlite_master where type = "index" and '
+                                           'tbl_name = "rt"').fetchall(), [('rt_name_ts',)])
+
+        # Parquet output, with a score that is null in the file
+        second = self._write('results.1.parquet', 'parquet',
+                             [result('a', 3, critic='70'), dict(result('c', 4), audienceNum='n/a')])
+        totals = load(self.conn, [first, second], workers=1)
+        self.assertEqual(totals, {'files': 1, 'rows': 1, 'skipped': 1})
+        self.assertEqual(self.conn.execute('select * from rt order by name, ts').fetchall(),
+                         [(1, 'a', 85, 100, 90, 2000), (3, 'a', 70, 100, 90, 2000), (2, 'b', 85, 100, 90, 2000)])
+        self.assertEqual(load(self.conn, [first, second], workers=1), {'files': 0, 'rows': 0, 'skipped': 0})
+        self.assertEqual(self.conn.execute('select count(*) from rt_files').fetchone()[0], 2)
+
+
+class AggregatesTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, 'movies.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name: str, results):
+        path = os.path.join(self.tmp.name, name)
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}'))
+        storage_object.append_results(results)
+        storage_object.close_and_flush()
+        return path
+
+    # Crawls that revisit movies, not in ts order, including movies with one snapshot and with every snapshot at the
+    # same ts
+    def _crawls(self, files: int):
+        rng = random.Random(1)
+        crawls = []
+        for f in range(files):
+            results = []
+            for m in range(60):
+                if rng.random() < 0.5:
+                    ts = 1577836800 + rng.randint(0, 10 ** 7) if m % 10 else 1600000000
+                    results.append(result(f'movie_{m}', ts, critic=str(rng.randint(0, 100)),
+                                          audience=f'{rng.randint(0, 100)}%'))
+            crawls.append(self._write(f'results.{f}.json', results))
+        return crawls
+
+    def _assertSameReport(self, conn: sqlite3.Connection, delta_func: str, threshold: float):
+        aggregated = list(report(conn, True, True, threshold, delta_func))
+        recomputed = list(report(conn, True, True, threshold, delta_func, recompute=True))
+        self.assertGreater(len(recomputed), 0)
+        self.assertEqual(len(aggregated), len(recomputed))
+        for a, r in zip(aggregated, recomputed):
+            a_head, a_rest = a.split(' slope=')
+            r_head, r_rest = r.split(' slope=')
+            self.assertEqual(a_head, r_head)
+            a_slope, r_slope = float(a_rest.split(' ')[0]), float(r_rest.split(' ')[0])
+            self.assertAlmostEqual(a_slope, r_slope, delta=1e-9 * abs(r_slope))
+            self.assertEqual(a_rest.split(' ', 1)[1], r_rest.split(' ', 1)[1])
+
+    def test_incremental_matches_recompute(self):
+        conn = connect(self.db)
+        for path in self._crawls(6):
+            load(conn, [path], workers=1)
+        self.assertEqual(conn.execute('select count(*) from rt_agg').fetchone()[0],
+                         2 * conn.execute('select count(distinct name) from rt').fetchone()[0])
+        self._assertSameReport(conn, 'minmax', 20)
+        self._assertSameReport(conn, 'slope', 1e-6)
+        conn.close()
+
+    def test_built_for_existing_db(self):
+        conn = sqlite3.connect(self.db)
+        conn.execute(CREATE_TABLE)
+        conn.executemany('insert into rt values (?, ?, ?, ?, ?, ?)',
+                         [(1600000000, 'a', 50, 1, 60, 1), (1600086400, 'a', 55, 1, None, 1),
+                          (1600172800, 'a', 70, 1, 65, 1), (1600000000, 'b', 10, 1, 10, 1)])
+        conn.commit()
+        conn.close()
+        conn = connect(self.db)
+        self.assertEqual(conn.execute("select n, ymin, ymax from rt_agg where name = 'a' and score = 'critic'")
+                         .fetchone(), (2, 50, 70))
+        self._assertSameReport(conn, 'minmax', 1)
+        load(conn, self._crawls(2), workers=1)
+        self._assertSameReport(conn, 'slope', 1e-6)
+        conn.close()
@@ -0,0 +1,120 @@
+import queue
+import threading
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Optional
+
+from src.ingestion.ingestor import Ingestor
+from src.processors.types import Record
+from src.util.logging import Logger
+from src.util.metrics import metrics, Histogram
+
+logger = Logger()
+
+INGEST_MODES = ['thread', 'process']
+
+# Seconds to wait on the queue before checking whether an ingestor process died without saying so
+POLL_INTERVAL = 1.0
+
+
+# Sent by each ingestor once it is exhausted (or failed), with the metrics it recorded when it ran in another process
+class _Done:
+    def __init__(self, index: int, error: Optional[str] = None, counters: Dict = None,
+                 histograms: Dict[object, Histogram] = None):
+        self.index = index
+        self.error = error
+        self.counters = counters or {}
+        self.histograms = histograms or {}
+
+
+def _drain(factory: Callable[[], Ingestor], index: int, records, snapshot_metrics: bool):
+    error = None
+    try:
+        for record in factory():
+            records.put(record)
+    except Exception as e:
+        error = str(e)
+    if snapshot_metrics:
+        with metrics.lock:
+            counters, histograms = dict(metrics.counters), dict(metrics.histograms)
+        records.put(_Done(index, error, counters, histograms))
+    else:
+        records.put(_Done(index, error))
+
+
+# Runs several ingestors in parallel and merges their records into one stream, in whatever order they arrive, so that
+# a single processor pool can be fed by e.g. a WarcIngestor per partition of the index.  Each ingestor is created by
+# its factory in its own thread (mode='thread', for ingestors that mostly wait on the network) or spawned process
+# (mode='process', for ingestors that are bound by parsing; the factories must then be picklable, e.g. a
+# functools.partial of a class).  Ingestors stay single-threaded: each one is only ever used by the thread or process
+# that created it.
+#
+# At most `queue_size` records are buffered, so a fast ingestor waits for the pool rather than filling up memory.  An
+# ingestor that fails is logged and does not stop the others.
+class CompositeIngestor(Ingestor):
+    def __init__(self, factories: List[Callable[[], Ingestor]], mode: str = 'thread', queue_size: int = 64):
+        if mode not in INGEST_MODES:
+            raise Exception(f'Unknown ingest mode: {mode}')
+        self.remaining = set(range(len(factories)))
+        self.failed = 0
+        if mode == 'thread':
+            self.records = queue.Queue(queue_size)
+            self.workers = [threading.Thread(target=_drain, args=(factory, i, self.records, False), daemon=True)
+                            for i, factory in enumerate(factories)]
+        else:
+            context = get_context('spawn')
+            self.records = context.Queue(queue_size)
+            self.workers = [context.Process(target=_drain, args=(factory, i, self.records, True), daemon=True)
+                            for i, factory in enumerate(factories)]
+        # Ingestor processes found dead before they said they were done (see _check_workers)
+        self.dead = set()
+        metrics.gauge('ingestors_running', lambda: len(self.remaining))
+        for worker in self.workers:
+            worker.start()
+
+    def _done(self, done: _Done):
+        self.remaining.discard(done.index)
+        if done.error is not None:
+            self.failed += 1
+            metrics.inc('ingestor_errors_total')
+            logger.error(f'Ingestor {done.index} failed: {done.error}')
+        with metrics.lock:
+            for key, value in done.counters.items():
+                metrics.counters[key] = metrics.counters.get(key, 0) + value
+            for key, histogram in done.histograms.items():
+                merged = metrics.histograms.setdefault(key, Histogram(histogram.buckets))
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+
+    # A process that was already dead the last time the queue was empty cannot have anything left in it, so it
+    # crashed (e.g. it was killed) before it could send _Done
+    def _check_workers(self):
+        for index in list(self.remaining):
+            worker = self.workers[index]
+            if isinstance(worker, threading.Thread) or worker.is_alive():
+                continue
+            if index in self.dead:
+                self._done(_Done(index, f'exited with {worker.exitcode}'))
+            else:
+                self.dead.add(index)
+
+    def next(self) -> Record:
+        while len(self.remaining) > 0:
+            try:
+                item = self.records.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                self._check_workers()
+                continue
+            if isinstance(item, _Done):
+                self._done(item)
+                continue
+            return item
+        for worker in self.workers:
+            worker.join()
+        raise StopIteration
+
+    # Stops the ingestor processes (threads cannot be stopped, but are daemons) when the records are not all consumed
+    def close(self):
+        for worker in self.workers:
+            if not isinstance(worker, threading.Thread) and worker.is_alive():
+                worker.terminate()
@@ -4,11 +4,22 @@ from src.ingestion.ingestor import Ingestor
 from src.processors.types import Record
 
 
+# Ingests one or more (comma-separated) CSV files with uri and ts columns, in order
 class CSVIngestor(Ingestor):
     def __init__(self, csvfile: str) -> Record:
-        csvfile_fd = open(csvfile, newline='')
-        self.csvreader = csv.DictReader(csvfile_fd)
+        self.csvfiles = csvfile.split(',')
+        self.csvreader = None
 
     def next(self) -> Record:
-        entry = self.csvreader.__next__()
-        return Record(entry['uri'], entry['ts'], entry)
\ No newline at end of file
+        while True:
+            if self.csvreader is None:
+                if len(self.csvfiles) == 0:
+                    raise StopIteration
+                csvfile_fd = open(self.csvfiles.pop(0), newline='')
+                self.csvreader = csv.DictReader(csvfile_fd)
+            try:
+                entry = self.csvreader.__next__()
+            except StopIteration:
+                self.csvreader = None
+                continue
+            return Record(entry['uri'], entry['ts'], entry)
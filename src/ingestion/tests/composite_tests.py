@@ -0,0 +1,60 @@
+import functools
+import os
+import tempfile
+import unittest
+
+from src.ingestion.composite import CompositeIngestor
+from src.ingestion.csv import CSVIngestor
+from src.main import ingestor_factories
+
+
+def failing_ingestor():
+    raise Exception('no such index')
+
+
+class CompositeIngestorTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.paths = []
+        for f in range(3):
+            path = os.path.join(self.tmp.name, f'{f}.csv')
+            with open(path, 'w') as fd:
+                fd.write('uri,ts\n' + ''.join(f'https://{f}.com/{i},{i}\n' for i in range(50 * (f + 1))))
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _uris(self, mode: str, factories) -> list:
+        return sorted(record.uri for record in CompositeIngestor(factories, mode, queue_size=4))
+
+    def _expected(self) -> list:
+        return sorted(f'https://{f}.com/{i}' for f in range(3) for i in range(50 * (f + 1)))
+
+    def test_threads(self):
+        factories = [functools.partial(CSVIngestor, path) for path in self.paths]
+        self.assertEqual(self._uris('thread', factories), self._expected())
+
+    def test_processes(self):
+        factories = [functools.partial(CSVIngestor, path) for path in self.paths]
+        self.assertEqual(self._uris('process', factories), self._expected())
+
+    def test_failed_ingestor(self):
+        for mode in ['thread', 'process']:
+            ingestor = CompositeIngestor([failing_ingestor, functools.partial(CSVIngestor, self.paths[0])], mode)
+            self.assertEqual(len(list(ingestor)), 50)
+            self.assertEqual(ingestor.failed, 1)
+
+    def test_factories(self):
+        btc = [f.args[0] for f in ingestor_factories('btc', 'http://btc/block,10,19', 3)]
+        self.assertEqual(btc, ['http://btc/block,10,12', 'http://btc/block,13,15', 'http://btc/block,16,19'])
+        self.assertEqual(len(ingestor_factories('btc', 'http://btc/block,1,2', 4)), 2)
+        csv = [f.args[0] for f in ingestor_factories('csv-file', ','.join(self.paths), 2)]
+        self.assertEqual(csv, [f'{self.paths[0]},{self.paths[2]}', self.paths[1]])
+
+        index = os.path.join(self.tmp.name, 'index.txt')
+        with open(index, 'w') as fd:
+            fd.write(''.join(f'crawl-data/{i}.warc.gz\n' for i in range(5)))
+        warc = [f.args[1] for f in ingestor_factories('warc-index', index, 2)]
+        self.assertEqual(warc, [[f'crawl-data/{i}.warc.gz\n' for i in [0, 2, 4]],
+                                [f'crawl-data/{i}.warc.gz\n' for i in [1, 3]]])
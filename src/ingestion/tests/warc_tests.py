@@ -1,13 +1,21 @@
+import io
 import os
 import random
+import tempfile
+import threading
+import time
 import unittest
 from multiprocessing.managers import SyncManager
+from multiprocessing.pool import ThreadPool
 from typing import List
 from unittest.mock import patch
 
 from typing.io import IO, TextIO
 
-from src.ingestion.warc import WarcIngestor, WarcFile
+from src.ingestion.warc import WarcIngestor, WarcFile, DownloadPolicy, LatencyWindow, download_warc_files, \
+    get_warc_bucket
+from src.util.logging import Logger
+from src.util.metrics import metrics
 
 
 class MockHeaders:
@@ -160,3 +168,100 @@ class BasicWarcTests(unittest.TestCase):
             self.assertTrue(ingestor.next().content == '{"third": 3}')
         with self.assertRaises(StopIteration):
             ingestor.next()
+
+
+    @patch('src.ingestion.warc.download_warc_files')
+    def test_cache_gauge_sums_ingestors(self, mock_download_warc_files):
+        mock_download_warc_files.return_value = None
+        ingestors = [TestWarcIngestor(), TestWarcIngestor()]
+        ingestors[0].warc_file_cache.extend([None, None])
+        ingestors[1].warc_file_cache.append(None)
+        self.assertEqual(metrics.snapshot()['gauges']['warc_cache_files'], 3)
+        ingestors[0].warc_file_cache.clear()
+        self.assertEqual(metrics.snapshot()['gauges']['warc_cache_files'], 1)
+
+
+class WarcBucketTests(unittest.TestCase):
+    @patch('src.ingestion.warc.default_s3_connector')
+    def test_bucket_per_thread(self, mock_connector):
+        os.environ['AWS_ACCESS_KEY_ID'] = 'foo'
+        os.environ['AWS_SECRET_ACCESS_KEY'] = 'bar'
+        mock_connector.side_effect = mock_s3_connector_fn
+        self.assertEqual(get_warc_bucket('foo'), 'foo')
+        self.assertEqual(get_warc_bucket('foo'), 'foo')
+        self.assertEqual(mock_connector.call_count, 1)
+        # Both threads of the pool take a task (and only then fetch more)
+        barrier = threading.Barrier(2)
+        with ThreadPool(2) as pool:
+            pool.map(lambda _: (barrier.wait(), get_warc_bucket('foo')), range(8), chunksize=1)
+        # One more connection for each thread of the pool
+        self.assertEqual(mock_connector.call_count, 3)
+
+
+class WarcDownloadsTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # Stands in for get_local_warc_file(): the first request for a key in `slow` takes a second, and requests for a key
+    # in `failing` fail `failing[key]` times
+    def _fake_download(self, slow=(), failing=None):
+        failing = failing or {}
+
+        def _download(key, offset, length, bucket, logger, verify=False, timeout=None):
+            with self.lock:
+                self.calls[key] = self.calls.get(key, 0) + 1
+                call = self.calls[key]
+            if call <= failing.get(key, 0):
+                raise Exception(f'{key} failed')
+            time.sleep(1.0 if key in slow and call == 1 else 0.01)
+            path = os.path.join(self.tmp.name, f'{key}.{call}')
+            with open(path, 'wb') as fp:
+                fp.write(key.encode('utf-8'))
+            return open(path, 'rb'), path
+
+        return _download
+
+    def _download(self, fake, files: int, policy: DownloadPolicy) -> List[str]:
+        cache = []
+        lines = io.StringIO(''.join(f'file-{i}\n' for i in range(files)))
+        with patch('src.ingestion.warc.get_local_warc_file', fake):
+            download_warc_files('foo', lines, cache, 64, threading.Condition(), Logger(), policy=policy)
+        for entry in cache:
+            entry.warc_fp.close()
+        return [entry.warc_file.key for entry in cache]
+
+    def test_files_are_cached_as_they_complete(self):
+        keys = self._download(self._fake_download(slow={'file-3'}), 20, DownloadPolicy(hedge_percentile=0))
+        self.assertEqual(sorted(keys), sorted(f'file-{i}' for i in range(20)))
+        self.assertEqual(keys[-1], 'file-3')
+
+    def test_hedges_stragglers(self):
+        begin = time.time()
+        keys = self._download(self._fake_download(slow={'file-30'}), 40, DownloadPolicy(hedge_min_samples=10))
+        self.assertLess(time.time() - begin, 0.9)
+        self.assertEqual(sorted(keys), sorted(f'file-{i}' for i in range(40)))
+        self.assertEqual(self.calls['file-30'], 2)
+        # The request that lost deletes its file once it completes
+        time.sleep(1.0)
+        self.assertEqual(len(os.listdir(self.tmp.name)), 40)
+
+    def test_retries(self):
+        keys = self._download(self._fake_download(failing={'file-1': 2, 'file-2': 3}), 4, DownloadPolicy())
+        self.assertEqual(sorted(keys), ['file-0', 'file-1', 'file-3'])
+        self.assertEqual((self.calls['file-1'], self.calls['file-2']), (3, 3))
+
+
+class LatencyWindowTests(unittest.TestCase):
+    def test_percentile(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(95))
+        for i in range(200):
+            window.add(float(i))
+        self.assertEqual(window.percentile(50), 150.0)
+        self.assertEqual(window.percentile(100), 199.0)
+        self.assertIsNone(window.percentile(50, min_samples=101))
@@ -1,15 +1,19 @@
+import functools
+import io
 import os
 import re
 import shutil
 import threading
 import time
 import uuid
+import weakref
 from datetime import datetime
 from multiprocessing.managers import SyncManager
 from multiprocessing.pool import ThreadPool
-from typing import Tuple, List
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
 
-import boto
+from boto.s3.bucket import Bucket
 from boto.s3.key import Key
 from typing.io import BinaryIO, IO, TextIO
 from warcio import ArchiveIterator
@@ -19,8 +23,10 @@ from warcio.recompressor import Recompressor
 
 from src.ingestion.ingestor import Ingestor
 from src.processors.types import Record
-from src.storage.s3 import get_s3_credentials
+from src.storage.s3 import get_s3_credentials, get_s3_connection
 from src.util.logging import Logger
+from src.util.metrics import metrics
+from src.util.profiling import profiled
 from src.util.s3helpers import get_warc_s3_key
 
 
@@ -65,7 +71,8 @@ def warc_file_from_line(line: str) -> WarcFile:
     line_ary = line.strip().split(" ")
 
     if len(line_ary) == 3:
-        return WarcFile(line_ary[0], int(line_ary[1]), int(line_ary[1]) + int(line_ary[2]))
+        # HTTP ranges are inclusive, so the last byte of the record is offset + length - 1
+        return WarcFile(line_ary[0], int(line_ary[1]), int(line_ary[1]) + int(line_ary[2]) - 1)
     elif len(line_ary) == 2:
         return WarcFile(line_ary[0], int(line_ary[1]), -1)
     elif len(line_ary) == 1:
@@ -75,7 +82,7 @@ def warc_file_from_line(line: str) -> WarcFile:
 
 
 def default_s3_connector(aws_access_key_id: str, aws_secret_access_key: str):
-    return boto.connect_s3(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+    return get_s3_connection(aws_access_key_id, aws_secret_access_key)
 
 
 def default_archive_iterator(fp: IO):
@@ -108,15 +115,37 @@ def recompress_warc_file(from_path: str, to_path: str):
     recompressor.recompress()
 
 
-def get_local_warc_file(key: str, offset: int, length: int, bucket: str, logger: Logger, verify: bool = False) -> Tuple[
-    BinaryIO, str]:
-    aws_access_key_id, aws_secret_access_key = get_s3_credentials()
-    conn = default_s3_connector(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-    bucket_conn = conn.get_bucket(bucket)
+_download_thread = threading.local()
+
+
+# Bucket handle of the calling (download) thread, which is created once per thread.  boto keeps the connections of an
+# S3Connection alive and reuses them, so each download thread keeps its connection open, instead of reading the
+# credentials, connecting and checking the bucket with an extra request for every file.  With a `timeout`, the
+# connection's socket operations give up after that many seconds.
+def get_warc_bucket(bucket: str, timeout: float = None) -> Bucket:
+    buckets = getattr(_download_thread, 'buckets', None)
+    if buckets is None:
+        buckets = _download_thread.buckets = {}
+    if (bucket, timeout) not in buckets:
+        aws_access_key_id, aws_secret_access_key = get_s3_credentials()
+        conn = default_s3_connector(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+        if timeout is not None and hasattr(conn, 'http_connection_kwargs'):
+            conn.http_connection_kwargs['timeout'] = timeout
+        buckets[(bucket, timeout)] = conn.get_bucket(bucket)
+        metrics.inc('s3_connections_total')
+    return buckets[(bucket, timeout)]
+
+
+def get_local_warc_file(key: str, offset: int, length: int, bucket: str, logger: Logger, verify: bool = False,
+                        timeout: float = None) -> Tuple[BinaryIO, str]:
+    bucket_conn = get_warc_bucket(bucket, timeout)
     local_filename = str(uuid.uuid4())
     local_path = f'/tmp/{local_filename}'
     k = get_warc_s3_key(key, offset, length, bucket=bucket_conn)
-    download_warc_file(k, local_path)
+    with metrics.timer('download_seconds'):
+        download_warc_file(k, local_path)
+    metrics.inc('download_files_total')
+    metrics.inc('download_bytes_total', os.path.getsize(local_path))
     logger.info(f'Downloaded {local_filename}...')
     if verify:
         if not check_warc_file(local_path):
@@ -130,50 +159,196 @@ def get_local_warc_file(key: str, offset: int, length: int, bucket: str, logger:
     return open(local_path, 'rb'), local_path
 
 
-def download_warc_files(bucket: str, index_fp: TextIO, cache: List[WarcCacheEntry], max_cache_len: int,
-                        files_downloading: threading.Condition, logger: Logger):
-    while True:
-        warc_files = []
+# How the WARC files are downloaded.  A download still running past the `hedge_percentile` of recent download latencies
+# (once there are `hedge_min_samples` of them) is hedged: a second request for the same file is sent, on another
+# connection, and whichever finishes first is used.  Each request's socket waits at most `request_timeout` seconds
+# (default: boto's), and a file is given up on after `attempts` failed requests.
+class DownloadPolicy:
+    def __init__(self, hedge_percentile: float = 95.0, request_timeout: float = None, attempts: int = 3,
+                 hedge_min_samples: int = 20):
+        self.hedge_percentile = hedge_percentile
+        self.request_timeout = request_timeout
+        self.attempts = attempts
+        self.hedge_min_samples = hedge_min_samples
+
+
+# Latencies of the most recent downloads
+class LatencyWindow:
+    def __init__(self, size: int = 256):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.samples) < max(1, min_samples):
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# A file being downloaded, by one request or (once hedged) two
+class _Download:
+    def __init__(self, warc_file: WarcFile):
+        self.warc_file = warc_file
+        self.started = 0.0
+        self.running = 0
+        self.attempts = 0
+        self.hedged = False
+        self.done = False
+
+
+# Downloads the files of an index into the cache.  Every file is a task of its own, and is appended to the cache as
+# soon as it is downloaded, so a slow request only holds up its own file.
+class WarcDownloads:
+    def __init__(self, bucket: str, cache: List[WarcCacheEntry], max_cache_len: int,
+                 files_downloading: threading.Condition, logger: Logger, download_limit: Callable[[], int] = None,
+                 wake: threading.Event = None, policy: DownloadPolicy = None):
+        self.bucket = bucket
+        self.cache = cache
+        self.max_cache_len = max_cache_len
+        self.files_downloading = files_downloading
+        self.logger = logger
+        self.download_limit = download_limit
+        # Set whenever a request completes, and by the ingestor when it takes a file out of the cache
+        self.wake = wake if wake is not None else threading.Event()
+        self.policy = policy if policy is not None else DownloadPolicy()
+        self.latencies = LatencyWindow()
+        self.pending: List[_Download] = []
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def hedge_after(self) -> Optional[float]:
+        if not self.policy.hedge_percentile:
+            return None
+        return self.latencies.percentile(self.policy.hedge_percentile, self.policy.hedge_min_samples)
+
+    def run(self, index_fp: TextIO):
+        # Twice the cache, so hedges do not wait for a thread
+        pool = ThreadPool(2 * self.max_cache_len)
         eof = False
+        while not eof or len(self.pending) > 0:
+            with self.lock:
+                timeout = self._check_pending(pool)
+                limit = self.max_cache_len if self.download_limit is None else max(1, self.download_limit())
+                while not eof and len(self.cache) + len(self.pending) < self.max_cache_len and self.running < limit:
+                    line = index_fp.readline()
+                    if line == '':
+                        eof = True
+                        break
+                    download = _Download(warc_file_from_line(line))
+                    self.pending.append(download)
+                    self._start(pool, download)
+            self.wake.wait(timeout)
+            self.wake.clear()
+        # Requests that lost to their hedge finish (and delete their file) in the background
+        pool.close()
+        index_fp.close()
+        with self.files_downloading:
+            self.files_downloading.notify()
+
+    # Retries (or gives up on) the files whose requests all failed and hedges the slow ones.  Returns how long to wait
+    # until the next download is due to be hedged.
+    def _check_pending(self, pool: ThreadPool) -> float:
+        now = time.time()
+        hedge_after = self.hedge_after()
+        timeout = 10.0
+        for download in list(self.pending):
+            if download.running == 0:
+                if download.attempts < self.policy.attempts:
+                    metrics.inc('download_retries_total')
+                    self._start(pool, download)
+                else:
+                    self.logger.error(f'Giving up on {download.warc_file.key} after {download.attempts} attempts')
+                    metrics.inc('download_failures_total')
+                    self.pending.remove(download)
+            elif hedge_after is not None and not download.hedged:
+                due = download.started + hedge_after - now
+                if due <= 0:
+                    self.logger.warning(f'Hedging {download.warc_file.key} after {now - download.started:.2f}s')
+                    metrics.inc('download_hedges_total')
+                    self._start(pool, download, hedge=True)
+                else:
+                    timeout = min(timeout, due)
+        return timeout
+
+    def _start(self, pool: ThreadPool, download: _Download, hedge: bool = False):
+        began = time.time()
+        if hedge:
+            download.hedged = True
+        else:
+            download.started = began
+        download.running += 1
+        download.attempts += 1
+        self.running += 1
+        warc_file = download.warc_file
+        pool.apply_async(profiled(get_local_warc_file, 'downloader'),
+                         (warc_file.key, warc_file.offset, warc_file.length, self.bucket, self.logger, False,
+                          self.policy.request_timeout),
+                         callback=functools.partial(self._finished, download, began, hedge),
+                         error_callback=functools.partial(self._failed, download))
+
+    # Callbacks, which are run by the pool's result thread
+    def _finished(self, download: _Download, began: float, hedge: bool, result: Tuple[BinaryIO, str]):
+        warc_fp, local_path = result
+        with self.lock:
+            self.running -= 1
+            download.running -= 1
+            lost = download.done
+            if not lost:
+                download.done = True
+                self.pending.remove(download)
+                self.latencies.add(time.time() - began)
+                self.cache.append(WarcCacheEntry(download.warc_file, warc_fp, local_path))
+                if hedge:
+                    metrics.inc('download_hedge_wins_total')
+        if lost:
+            # The other request got there first
+            warc_fp.close()
+            os.remove(local_path)
+        else:
+            with self.files_downloading:
+                self.files_downloading.notify()
+        self.wake.set()
+
+    def _failed(self, download: _Download, e: Exception):
+        with self.lock:
+            self.running -= 1
+            download.running -= 1
+        self.logger.error(f'Error downloading {download.warc_file.key}: {str(e)}')
+        metrics.inc('download_errors_total')
+        self.wake.set()
+
+
+# Keeps the cache filled with up to `max_cache_len` downloaded files, with at most download_limit() (default: as many as
+# there is room for) downloads at a time (see WarcDownloads).  The download threads live as long as the index is being
+# read, so each one keeps its S3 connection (see get_warc_bucket()).  Once the cache is full, waits for `cache_room` to
+# be set by the ingestor (or polls every 10 seconds without one).
+def download_warc_files(bucket: str, index_fp: TextIO, cache: List[WarcCacheEntry], max_cache_len: int,
+                        files_downloading: threading.Condition, logger: Logger,
+                        download_limit: Callable[[], int] = None, cache_room: threading.Event = None,
+                        policy: DownloadPolicy = None):
+    WarcDownloads(bucket, cache, max_cache_len, files_downloading, logger, download_limit, cache_room,
+                  policy).run(index_fp)
+
+
+# The live ingestors, whose caches the warc_cache_files gauge sums (several run in one process under a
+# CompositeIngestor in thread mode)
+_ingestors = weakref.WeakSet()
+_ingestors_lock = threading.Lock()
+
 
-        # If we have room in the cache, get the index lines and derive the S3 keys
-        logger.info(f'Found room for {max_cache_len - len(cache)} files in the cache')
-        while max_cache_len - len(cache) > len(warc_files):
-            line = index_fp.readline()
-            if line == '':
-                eof = True
-                break
-            warc_file = warc_file_from_line(line)
-            warc_files.append(warc_file)
-
-        # If we have keys to process, download the files, otherwise, go to sleep
-        if len(warc_files) > 0:
-            with ThreadPool(len(warc_files)) as pool:
-                results = pool.starmap(get_local_warc_file,
-                                       map(lambda x: (x.key, x.offset, x.length, bucket, logger), warc_files))
-
-            logger.info(f'Downloaded {len(warc_files)} WARC files...')
-            zipped_results = zip(warc_files, results)
-            # ToDo(KMG): The appends need to be protected by a lock
-            for result in zipped_results:
-                cache.append(WarcCacheEntry(result[0], result[1][0], result[1][1]))
-            with files_downloading:
-                logger.info(f'Notifying main thread. Cache size: {len(cache)}')
-                files_downloading.notify()
-        elif not eof:
-            time.sleep(10)
-
-        if eof:
-            index_fp.close()
-            with files_downloading:
-                files_downloading.notify()
-            break
+def cached_warc_files() -> int:
+    with _ingestors_lock:
+        return sum(len(ingestor.warc_file_cache) for ingestor in _ingestors)
 
 
+# Without a manager, the download thread is signalled with a plain threading.Condition, which is all that is needed when
+# the ingestor is only used by the process that created it
 class WarcIngestor(Ingestor):
     def __init__(self, bucket: str, input_fp: TextIO, archive_iterator_fn=default_archive_iterator,
-                 manager: SyncManager = SyncManager(),
-                 keep_local_files=False):
+                 manager: SyncManager = None,
+                 keep_local_files=False, download_limit: Callable[[], int] = None, policy: DownloadPolicy = None):
         self.logger = Logger()
         self.bucket = bucket
         self.index_fp = input_fp
@@ -185,26 +360,41 @@ class WarcIngestor(Ingestor):
         self.keep_local_files = keep_local_files
 
         self.manager = manager
-        self.files_downloading = self.manager.Condition()
+        self.files_downloading = self.manager.Condition() if self.manager is not None else threading.Condition()
         self.warc_file_cache: List[WarcCacheEntry] = []
+        self.cache_room = threading.Event()
 
-        self.download_thread = threading.Thread(target=download_warc_files,
+        with _ingestors_lock:
+            _ingestors.add(self)
+        metrics.gauge('warc_cache_files', cached_warc_files)
+
+        self.download_thread = threading.Thread(target=profiled(download_warc_files, 'downloader'),
                                                 args=(self.bucket, self.index_fp, self.warc_file_cache, 16,
-                                                      self.files_downloading, self.logger))
+                                                      self.files_downloading, self.logger, download_limit,
+                                                      self.cache_room, policy))
         self.download_thread.start()
 
-    def _get_local_warc_file(self):
+    def _wait_for_warc_file(self):
         while len(self.warc_file_cache) == 0 and not self.index_fp.closed:
             self.logger.info(f'WARC file cache size: {len(self.warc_file_cache)}')
             with self.files_downloading:
+                # The downloader notifies under the lock, so checking again here cannot miss it
+                if len(self.warc_file_cache) > 0 or self.index_fp.closed:
+                    break
                 self.logger.info('Waiting for index files to download...')
                 self.files_downloading.wait(timeout=10)
                 self.logger.info('Wait timed-out...')
 
+    def _get_local_warc_file(self):
+        # Time spent here means ingestion is bound by S3 downloads
+        with metrics.timer('ingest_wait_seconds'):
+            self._wait_for_warc_file()
+
         self.logger.info(f'Have {len(self.warc_file_cache)} cached WARC files...')
         if len(self.warc_file_cache) > 0:
             self.logger.info('Popping next index file...')
             entry = self.warc_file_cache.pop(0)
+            self.cache_room.set()
             return entry.warc_file, entry.warc_fp, entry.local_path
         else:
             raise StopIteration
@@ -229,13 +419,18 @@ class WarcIngestor(Ingestor):
             self._get_next_index_line()
         while parsed_record is None:
             try:
+                begin = time.time()
                 record = self.archive_iterator.__next__()
                 if record.rec_type == 'response':
                     parsed_record = Record(record.rec_headers.get_header('WARC-Target-URI'), self.curr_ts,
                                            record.content_stream().read())
+                    metrics.observe('warc_parse_seconds', time.time() - begin)
+                else:
+                    metrics.inc('records_filtered_total')
             except ArchiveLoadFailed as e:
                 # ToDo(KMG): Should we mark or log this?
                 self.logger.warning(f'Archive load failed: {str(e)}')
+                metrics.inc('archive_load_failures_total')
                 continue
             except StopIteration:
                 # This means we hit the current EOF, so must fetch the next index file
@@ -250,3 +445,8 @@ class WarcIngestor(Ingestor):
                 raise e
 
         return parsed_record
+
+
+# A WarcIngestor over some of the lines of an index (see src/ingestion/composite.py)
+def warc_ingestor_for_lines(bucket: str, lines: List[str], policy: DownloadPolicy = None) -> WarcIngestor:
+    return WarcIngestor(bucket, io.StringIO(''.join(lines)), policy=policy)
@@ -1,87 +1,491 @@
 import argparse
-import base64
-import gzip
-import json
+import functools
+import importlib
+import importlib.util
+import os
 import threading
+import time
 from multiprocessing import get_context
 from multiprocessing.managers import SyncManager
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple, Type, Union, TYPE_CHECKING
 
-from src.ingestion.btc import BTCIngestor
+from src.ingestion.composite import CompositeIngestor, INGEST_MODES
 from src.ingestion.csv import CSVIngestor
-from src.ingestion.warc import WarcIngestor
-from src.processors.copy import CopyProcessor
-from src.processors.news import NewsProcessor
-from src.processors.rottentomatoes import RottenTomatoesProcessor
+from src.ingestion.ingestor import Ingestor
+from src.processors.processor import Processor
 from src.processors.types import Record
-from src.storage.storage import StorageObject, StorageDescriptor
+from src.util.budget import ByteBudget, MeasuredResults, record_bytes, result_bytes
+from src.util.concurrency import ConcurrencyController, Control, CPUSampler, HillClimber, Rate, SemaphoreLimit, \
+    grow_pool, pool_size
 from src.util.logging import Logger
+from src.util.metrics import metrics, MetricsReporter
+from src.util.profiling import profile_section, start_profiling, start_worker_profiling, dump_worker_profile, \
+    stop_profiling, write_report
+from src.util.resources import return_freed_memory
+from src.util.transport import RecordRing, SharedRecord, TRANSPORTS, receive
+from src.util.watchdog import RecordTimeout, WorkerWatchdog, InFlight, DeadlineSafeLock, record_deadline, \
+    begin_record, pause_record, end_record, recycle_worker, recycle_worker_if_over_memory, drain_recycled
+
+# Pool workers re-import this module (as __mp_main__), so it only imports what the workers need.  The WARC and BTC
+# ingestors, the storage objects and the processors, and with them boto, warcio, requests, numpy, newspaper and bs4, are
+# imported where they are used: the parent loads the ingestor and storage it runs, and a worker the processors it runs.
+if TYPE_CHECKING:
+    from src.ingestion.warc import DownloadPolicy
+    from src.processors.dedup import NearDuplicateFilter
+    from src.storage.storage import StorageObject
 
 logger = Logger()
 
+# CPU utilization above which more workers are not expected to help
+CPU_SATURATED = 0.9
+# Fraction of the time the ingestor may wait on downloads before more parallel downloads are warranted
+INGEST_WAIT_SATURATED = 0.05
+# Seconds between looks for the records of recycled workers while the ingestor waits on the memory budget
+RECYCLED_POLL_INTERVAL = 0.5
+
+# Processor classes by name, imported on first use (see get_processor())
+PROCESSORS = {
+    'news': 'src.processors.news.NewsProcessor',
+    'copy': 'src.processors.copy.CopyProcessor',
+    'rottentomatoes': 'src.processors.rottentomatoes.RottenTomatoesProcessor',
+}
+
+START_METHODS = ['spawn', 'forkserver']
+
 
 def parse():
+    from src.processors.dedup import DEDUP_MODES
+    from src.storage.storage import OUTPUT_FORMATS
+
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('-i', '--input', help='Input file containing ingest-specific configuration', required=True)
-    parser.add_argument('-o', '--output', help='Output path (e.g. s3://<bucket>/<path> or file://<path>)',
-                        required=False)
-    parser.add_argument('-p', '--processor', help='Processor to use (e.g. news)', required=True)
+    parser.add_argument('-o', '--output', help='Output path (e.g. s3://<bucket>/<path> or file://<path>), or '
+                                               'comma-separated paths, one per processor', required=False)
+    parser.add_argument('-p', '--processor', help='Processor to use (e.g. news), or comma-separated processors that '
+                                                  'each get every record (e.g. news,copy)', required=True)
     parser.add_argument('-I', '--ingestor', help='Ingestor to use (e.g. warc-index)', required=True)
+    parser.add_argument('-n', '--ingestors', help='Ingestors to run in parallel, each over a part of the input '
+                                                  '(default=1)', type=int, default=1)
+    parser.add_argument('--ingest-mode', help=f'Run the ingestors in a thread or a process each: '
+                                              f'{", ".join(INGEST_MODES)} (default=process)', default='process')
     parser.add_argument('-t', '--threads', help='Number of threads (default=16)', default=16)
+    parser.add_argument('--memory-mb', help='Budget for the payload bytes of the records in flight and the results not '
+                                            'yet flushed, in MB.  It bounds payload bytes, not RSS, which also holds '
+                                            'the interpreters and copies of the payloads (default=unlimited)',
+                        type=float, default=None)
+    parser.add_argument('--adaptive', help='Adjust the records in flight (between --min-threads and --threads) and the '
+                                           'parallel WARC downloads (between --min-downloads and --max-downloads) at '
+                                           'runtime', action='store_true', default=False)
+    parser.add_argument('--min-threads', help='Fewest records in flight with --adaptive (default=1)', type=int,
+                        default=1)
+    parser.add_argument('--min-downloads', help='Fewest parallel WARC downloads with --adaptive (default=1)', type=int,
+                        default=1)
+    parser.add_argument('--max-downloads', help='Most parallel WARC downloads with --adaptive (default=16)', type=int,
+                        default=16)
+    parser.add_argument('--adapt-interval', help='Seconds between adjustments with --adaptive (default=10)',
+                        type=float, default=10)
+    parser.add_argument('--hedge-percentile', help='Send a second request for WARC downloads still running past this '
+                                                   'percentile of recent download latencies (default=95, 0 disables)',
+                        type=float, default=95)
+    parser.add_argument('--download-timeout', help='Seconds an S3 request may go without any progress before it is '
+                                                   'retried (default=70)', type=float, default=None)
+    parser.add_argument('-f', '--format', help=f'Output format: {", ".join(OUTPUT_FORMATS)} (default=line)',
+                        default='line')
+    parser.add_argument('--row-group-size', help='Rows per Parquet row group (default=10000)', type=int,
+                        default=10000)
+    parser.add_argument('--compression', help='Parquet compression codec: snappy, zstd, gzip, brotli, lz4 or none '
+                                              '(default=snappy)', default='snappy')
+    parser.add_argument('--part-mb', help='Roll the output into a new part once the current one reaches this many MB '
+                                          '(default=single output file)', type=float, default=None)
+    parser.add_argument('--part-records', help='Roll the output into a new part once the current one has this many '
+                                               'results (default=single output file)', type=int, default=None)
+    parser.add_argument('--upload-threads', help='Threads uploading completed parts to S3 (default=4)', type=int,
+                        default=4)
+    parser.add_argument('--partition-by-date', help='Write the results of an output <name>.<ext> into a directory '
+                                                    'per day of their timestamp, <name>/dt=YYYY-MM-DD, listed in '
+                                                    '<name>.manifest.json', action='store_true', default=False)
+    parser.add_argument('--max-open-partitions', help='Partitions with a part open at a time with --partition-by-date '
+                                                      '(default=8)', type=int, default=8)
+    parser.add_argument('--uri-index', help='Write a sidecar index of the URIs next to each output file, for point '
+                                            'lookups with python3 -m src.storage.uri_index (line format only)',
+                        action='store_true', default=False)
+    parser.add_argument('--dedup', help=f'Drop or tag near-duplicate results of the processors that support it (e.g. '
+                                        f'news articles): {", ".join(DEDUP_MODES)} (default=disabled)', default=None)
+    parser.add_argument('--dedup-threshold', help='Estimated Jaccard similarity of the word shingles from which a '
+                                                  'result is a near-duplicate (default=0.8)', type=float, default=0.8)
+    parser.add_argument('--dedup-capacity', help='Distinct results remembered per processor by --dedup, oldest '
+                                                 'forgotten first (default=100000)', type=int, default=100000)
+    parser.add_argument('--record-timeout', help='Seconds a worker may spend processing a record before the record '
+                                                 'is abandoned; workers still stuck after twice this are killed '
+                                                 '(default=disabled)', type=float, default=None)
+    parser.add_argument('--start-method', help=f'How the pool workers are started: {", ".join(START_METHODS)} '
+                                               f'(default=spawn).  With forkserver, the --preload modules are imported '
+                                               f'once and every worker is forked from them', default='spawn')
+    parser.add_argument('--preload', help='Comma-separated modules imported before the workers are forked with '
+                                          '--start-method forkserver (default=src.main and the modules of the '
+                                          'processors)', default=None)
+    parser.add_argument('--max-tasks-per-child', help='Replace each worker after it has processed this many records '
+                                                      '(default=never)', type=int, default=None)
+    parser.add_argument('--max-worker-rss', help='Replace a worker once its RSS exceeds this many MB '
+                                                 '(default=unlimited)', type=int, default=None)
+    parser.add_argument('--metrics-port', help='Serve Prometheus metrics on this local port (default=disabled)',
+                        type=int, default=None)
+    parser.add_argument('--stats-interval', help='Seconds between JSON stats log lines (default=60, 0 disables)',
+                        type=float, default=60)
+    parser.add_argument('--transport', help=f'How records reach the workers: {", ".join(TRANSPORTS)} '
+                                            f'(default=pickle)', default='pickle')
+    parser.add_argument('--shm-mb', help='Size of the shared memory ring used by --transport shm (default=256)',
+                        type=float, default=256)
+    parser.add_argument('--profile', help='Profile the ingestor, downloaders and workers, writing the profiles and a '
+                                          'merged report to this directory (default=disabled)', default=None)
+    parser.add_argument('--profile-memory', help='Include tracemalloc snapshots in the profile', action='store_true',
+                        default=False)
     return parser.parse_args()
 
 
-def flush_results(storage_object: StorageObject, results: List[Dict]):
-    if len(results) > 0:
-        logger.warning(f'Appending {len(results)} results')
-        for r in results:
-            storage_object.append(
-                str(base64.b64encode(gzip.compress(str(json.dumps(r)).encode('utf-8'), 9)).decode('ascii') + '\n'))
+def processor_module(processor: str) -> str:
+    if processor not in PROCESSORS:
+        raise Exception(f'Unknown processor: {processor}')
+    return PROCESSORS[processor].rsplit('.', 1)[0]
+
+
+def get_processor(processor: str) -> Type[Processor]:
+    module = importlib.import_module(processor_module(processor))
+    return getattr(module, PROCESSORS[processor].rsplit('.', 1)[1])
+
+
+# Modules the fork server imports for the workers by default: this module and the processors they run
+def preload_modules(processors: List[str]) -> List[str]:
+    return ['src.main'] + sorted(set(processor_module(processor) for processor in processors))
+
+
+# A pool of `processes` workers.  Spawned workers each start a fresh interpreter and import the modules they need
+# themselves.  With 'forkserver', a server process imports the `preload` modules once, and forks every worker (and
+# every replacement worker) from itself, so workers start with the modules already loaded and share their memory
+# until they write to it.
+def worker_pool(start_method: str, processes: int, preload: List[str] = None, initializer: Callable = None,
+                initargs: Tuple = (), maxtasksperchild: int = None):
+    if start_method not in START_METHODS:
+        raise Exception(f'Unknown start method: {start_method}')
+    context = get_context(start_method)
+    if start_method == 'forkserver':
+        # The fork server ignores modules it cannot import
+        for module in preload or []:
+            if importlib.util.find_spec(module) is None:
+                raise Exception(f'Unknown module to preload: {module}')
+        context.set_forkserver_preload(preload or [])
+    return context.Pool(processes, initializer=initializer, initargs=initargs, maxtasksperchild=maxtasksperchild)
+
+
+# The processor's schema, plus the column added by --dedup tag to the processors it applies to
+def output_schema(processor: str, dedup: str = None) -> List[Tuple[str, str]]:
+    from src.processors.dedup import DUPLICATE_OF
+
+    schema = get_processor(processor).schema
+    if dedup == 'tag' and get_processor(processor).dedup_field is not None:
+        schema = schema + [(DUPLICATE_OF, 'string')]
+    return schema
+
+
+def dedup_filter(processor: str, dedup: str, threshold: float, capacity: int) -> Union['NearDuplicateFilter', None]:
+    from src.processors.dedup import NearDuplicateFilter
+
+    if dedup is None:
+        return None
+    field = get_processor(processor).dedup_field
+    if field is None:
+        logger.warning(f'The {processor} processor does not support --dedup, its results are not deduplicated')
+        return None
+    return NearDuplicateFilter(field, dedup, threshold, capacity)
+
+
+# Factories of up to `partitions` ingestors over disjoint parts of the input: lines of the WARC index, CSV files or
+# ranges of BTC blocks
+def ingestor_factories(ingestor: str, input_str: str, partitions: int,
+                       policy: 'DownloadPolicy' = None) -> List[Callable[[], Ingestor]]:
+    from src.ingestion.btc import BTCIngestor
+    from src.ingestion.warc import warc_ingestor_for_lines
+
+    if ingestor == 'warc-index':
+        with open(input_str) as fd:
+            lines = [line for line in fd if line.strip() != '']
+        return [functools.partial(warc_ingestor_for_lines, 'commoncrawl', lines[i::partitions], policy)
+                for i in range(min(partitions, len(lines)))]
+    elif ingestor == 'csv-file':
+        files = input_str.split(',')
+        return [functools.partial(CSVIngestor, ','.join(files[i::partitions]))
+                for i in range(min(partitions, len(files)))]
+    elif ingestor == 'btc':
+        base_url, begin, end = input_str.split(',')
+        begin, end = int(begin), int(end)
+        bounds = [begin + (end - begin + 1) * i // partitions for i in range(partitions + 1)]
+        return [functools.partial(BTCIngestor, f'{base_url},{bounds[i]},{bounds[i + 1] - 1}')
+                for i in range(partitions) if bounds[i] < bounds[i + 1]]
+    raise Exception(f'Unknown ingestor: {ingestor}')
+
 
+# Returns the number of results flushed and their bytes (see result_bytes())
+def flush_results(storage_object: 'StorageObject', results: List[Dict]) -> Tuple[int, int]:
+    flushed, flushed_bytes = len(results), 0
+    if flushed > 0:
+        logger.warning(f'Appending {flushed} results')
+        # Slicing copies the shared list in one round-trip, and the storage object encodes the whole batch
+        batch = results[:]
+        storage_object.append_results(batch)
         del results[:]
+        flushed_bytes = result_bytes(batch)
+    return flushed, flushed_bytes
 
 
-def do_process(processor: str, storage_object: StorageObject, record: Record, results: List[Dict],
-               mutex: threading.Lock, semaphore: threading.Semaphore):
-    try:
-        if processor == 'news':
-            NewsProcessor(results, mutex).process(record)
-        elif processor == 'copy':
-            CopyProcessor(results, mutex).process(record)
-        elif processor == 'rottentomatoes':
-            RottenTomatoesProcessor(results, mutex).process(record)
-        else:
-            raise Exception(f'Unknown processor: {processor}')
-
-        if len(results) > 0 and len(results) % 100 == 0:
-            with mutex:
-                flush_results(storage_object, results)
-    except Exception as e:
-        logger.error(str(e))
-    finally:
-        semaphore.release()
-
-
-def error_callback(e: Exception):
+# Flushes every processor's buffered results from the ingestor, when the memory budget is full of them and there is no
+# record in flight to flush them (see do_process()).  Returns the bytes flushed.
+def flush_buffered(storage_objects: List['StorageObject'], results: List[List[Dict]], mutexes: List[threading.Lock],
+                   budget: ByteBudget) -> int:
+    total = 0
+    for storage_object, processor_results, mutex in zip(storage_objects, results, mutexes):
+        with mutex:
+            with metrics.timer('flush_seconds'):
+                flushed, flushed_bytes = flush_results(storage_object, processor_results)
+        metrics.inc('results_flushed_total', flushed)
+        budget.flushed(flushed_bytes)
+        total += flushed_bytes
+    metrics.inc('budget_flushes_total')
+    return total
+
+
+# Runs every processor on the record, which is received (and decoded) once.  Each processor has its own results, mutex
+# and storage object, and one that fails does not keep the others from processing the record.  Results are flushed every
+# 100 results, or right away when `flush` is set (i.e. buffered results take up too much of the memory budget).
+#
+# A worker that recycles itself never returns, so it leaves the URI of the record and the bytes it buffered and flushed
+# in `recycled` instead (see account_recycled()).
+def do_process(processors: List[str], storage_objects: List['StorageObject'], record: Union[Record, SharedRecord],
+               results: List[List[Dict]], mutexes: List[threading.Lock], semaphore: threading.Semaphore,
+               in_flight: InFlight = None, record_timeout: float = None, max_worker_rss: int = None,
+               flush: bool = False, recycled: List[Tuple[str, int, int]] = None) -> Dict:
+    # Measurements are returned with the task result, so the parent can record them without any extra IPC
+    stats = {processor: {} for processor in processors}
+    with profile_section('worker'):
+        timed_out, owned = False, False
+        begin_record(in_flight, record.uri)
+        try:
+            record = receive(record)
+            if record_timeout is not None:
+                mutexes = [DeadlineSafeLock(mutex) for mutex in mutexes]
+            with record_deadline(record_timeout):
+                for processor, processor_results, mutex in zip(processors, results, mutexes):
+                    begin = time.time()
+                    measured = MeasuredResults(processor_results)
+                    try:
+                        get_processor(processor)(measured, mutex).process(record)
+                        stats[processor]['process_seconds'] = time.time() - begin
+                    except RecordTimeout:
+                        raise
+                    except Exception as e:
+                        stats[processor]['error'] = True
+                        logger.error(f'{processor}: {str(e)}')
+                    finally:
+                        stats[processor]['buffered_bytes'] = measured.bytes
+
+            pause_record(in_flight, record.uri)
+            for processor, storage_object, processor_results, mutex in zip(processors, storage_objects, results,
+                                                                           mutexes):
+                buffered = len(processor_results)
+                if buffered > 0 and (flush or buffered % 100 == 0):
+                    with mutex:
+                        begin = time.time()
+                        stats[processor]['flushed'], stats[processor]['flushed_bytes'] = \
+                            flush_results(storage_object, processor_results)
+                        stats[processor]['flush_seconds'] = time.time() - begin
+        except RecordTimeout:
+            timed_out = True
+            logger.error(f'Abandoned {record.uri} after exceeding the {record_timeout}s deadline')
+        except Exception as e:
+            for processor in processors:
+                stats[processor]['error'] = True
+            logger.error(str(e))
+        finally:
+            owned = end_record(in_flight)
+            if owned:
+                semaphore.release()
+        # A record the watchdog gave up on has already been accounted for
+        task = (record.uri, sum(s.get('buffered_bytes', 0) for s in stats.values()),
+                sum(s.get('flushed_bytes', 0) for s in stats.values()))
+        recycled = recycled if owned else None
+        # An abandoned record may leave the processor libraries in a bad state, so start over with a fresh worker
+        if timed_out:
+            recycle_worker(f'{record.uri} timed out', recycled, task)
+        recycle_worker_if_over_memory(max_worker_rss, recycled, task)
+    return stats
+
+
+def record_task_stats(stats: Dict):
+    metrics.inc('records_completed_total')
+    for processor, processor_stats in stats.items():
+        if 'process_seconds' in processor_stats:
+            metrics.observe('process_seconds', processor_stats['process_seconds'], processor=processor)
+        if processor_stats.get('error'):
+            metrics.inc('process_errors_total', processor=processor)
+        if 'flushed' in processor_stats:
+            metrics.inc('results_flushed_total', processor_stats['flushed'])
+            metrics.observe('flush_seconds', processor_stats['flush_seconds'])
+
+
+# Wait for the records still being processed, so their results make it into the final flush
+def drain_in_flight(semaphore: threading.Semaphore, slots: int, timeout: float = None):
+    deadline = time.time() + timeout if timeout is not None else None
+    for i in range(slots):
+        remaining = deadline - time.time() if deadline is not None else None
+        if remaining is not None and remaining <= 0 or not semaphore.acquire(timeout=remaining):
+            logger.error(f'Gave up waiting on {slots - i} in-flight records')
+            return
+
+
+# Records whose worker recycled itself get neither callback nor error_callback, so they are completed here, and their
+# bytes are given back to the budget.  Returns how many there were.
+def account_recycled(recycled: List[Tuple[str, int, int]], budget: ByteBudget = None) -> int:
+    if recycled is None:
+        return 0
+    tasks = drain_recycled(recycled)
+    for uri, buffered_bytes, flushed_bytes in tasks:
+        metrics.inc('records_completed_total')
+        metrics.inc('workers_recycled_total')
+        if budget is not None:
+            budget.buffer(buffered_bytes)
+            budget.flushed(flushed_bytes)
+            budget.done(uri)
+    return len(tasks)
+
+
+# Workers release their slot before returning, so the last few callbacks may still be pending after the drain.  Wait
+# for them (killed workers never call back), so the final stats are complete.
+def wait_for_callbacks(timeout: float = 5.0, recycled: List[Tuple[str, int, int]] = None, budget: ByteBudget = None):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        account_recycled(recycled, budget)
+        outstanding = metrics.counter('records_submitted_total') - metrics.counter('records_completed_total') - \
+                      metrics.counter('workers_killed_total')
+        if outstanding <= 0:
+            return
+        time.sleep(0.01)
+
+
+# Hill-climbs the records in flight (growing the pool as needed) on records completed per second (saturated once the
+# CPUs are busy) and, when there is a download climber, the parallel downloads on bytes downloaded per second
+# (saturated once the ingestor no longer waits on downloads)
+def concurrency_controls(pool, limit: SemaphoreLimit, workers: HillClimber,
+                         downloads: HillClimber = None) -> List[Control]:
+    cpu = CPUSampler()
+    completed = Rate(lambda: metrics.counter('records_completed_total'), time.time)
+
+    def set_workers(value: int):
+        grow_pool(pool, value)
+        limit.set(value)
+
+    controls = [Control('workers', workers, lambda: (completed(), cpu.sample() >= CPU_SATURATED), set_workers)]
+    if downloads is not None:
+        downloaded = Rate(lambda: metrics.counter('download_bytes_total'), time.time)
+        waiting = Rate(lambda: metrics.histogram_sum('ingest_wait_seconds'), time.time)
+        controls.append(Control('downloads', downloads,
+                                lambda: (downloaded(), waiting() < INGEST_WAIT_SATURATED), lambda value: None))
+    return controls
+
+
+# With a memory budget, the results a task buffered and flushed are accounted for before its record is given back
+def error_callback(e: Exception, budget: ByteBudget = None, uri: str = None):
+    metrics.inc('records_completed_total')
+    metrics.inc('task_errors_total')
     logger.error(f'Error running process: {str(e)}')
+    if budget is not None:
+        budget.done(uri)
 
 
-def callback(value):
-    pass
+def callback(value, budget: ByteBudget = None, uri: str = None):
+    record_task_stats(value)
+    if budget is not None:
+        budget.buffer(sum(s.get('buffered_bytes', 0) for s in value.values()))
+        budget.flushed(sum(s.get('flushed_bytes', 0) for s in value.values()))
+        budget.done(uri)
 
 
 def main():
+    from src.ingestion.btc import BTCIngestor
+    from src.ingestion.warc import DownloadPolicy, WarcIngestor
+    from src.processors.dedup import DEDUP_MODES
+    from src.storage.partitioned import open_storage
+    from src.storage.storage import StorageDescriptor
+
     args = parse()
-    storage_desc = StorageDescriptor(args.output)
-    SyncManager.register('StorageObject', StorageObject)
+    part_bytes = int(args.part_mb * 1024 * 1024) if args.part_mb is not None else None
+    processors = args.processor.split(',')
+    outputs = args.output.split(',') if args.output is not None else []
+    if len(outputs) != len(processors):
+        raise Exception(f'Expected one output per processor, got {len(outputs)} for {len(processors)}')
+    if args.dedup is not None and args.dedup not in DEDUP_MODES:
+        raise Exception(f'Unknown dedup mode: {args.dedup}')
+    storage_descs = [StorageDescriptor(output, args.format, output_schema(processor, args.dedup), args.row_group_size,
+                                       args.compression, part_bytes, args.part_records, args.upload_threads,
+                                       dedup_filter(processor, args.dedup, args.dedup_threshold, args.dedup_capacity),
+                                       args.uri_index, args.partition_by_date, args.max_open_partitions)
+                     for processor, output in zip(processors, outputs)]
+    SyncManager.register('StorageObject', open_storage)
+    SyncManager.register('InFlight', InFlight)
+    threads = int(args.threads)
+    if args.transport not in TRANSPORTS:
+        raise Exception(f'Unknown transport: {args.transport}')
+    preload = args.preload.split(',') if args.preload is not None else preload_modules(processors)
+    # Before the manager and the pool are started, so they inherit it
+    if args.memory_mb is not None:
+        return_freed_memory()
+    initializer, initargs = None, ()
+    if args.profile is not None:
+        start_profiling(args.profile, 'main', args.profile_memory)
+        initializer, initargs = start_worker_profiling, (args.profile, args.profile_memory)
+    # With --adaptive, the pool starts with a worker per CPU and grows if more records in flight pay off
+    workers = HillClimber(args.min_threads, threads, min(threads, os.cpu_count() or 1)) if args.adaptive else None
     with SyncManager() as manager:
-        with get_context("spawn").Pool(int(args.threads)) as p:
-            results = manager.list([])
-            mutex = manager.Lock()
-            semaphore = manager.Semaphore(int(args.threads))
-            storage_object = manager.StorageObject(storage_desc)
-            if args.ingestor == 'warc-index':
-                ingestor = WarcIngestor('commoncrawl', open(args.input), manager=manager)
+        with worker_pool(args.start_method, workers.value if workers is not None else threads, preload,
+                         initializer, initargs, args.max_tasks_per_child) as p:
+            results = [manager.list([]) for _ in processors]
+            mutexes = [manager.Lock() for _ in processors]
+            semaphore = manager.Semaphore(threads)
+            storage_objects = [manager.StorageObject(storage_desc) for storage_desc in storage_descs]
+            metrics.gauge('records_in_flight',
+                          lambda: metrics.counter('records_submitted_total') - metrics.counter('records_completed_total'))
+            metrics.gauge('results_buffered', lambda: sum(len(r) for r in results))
+            for processor, storage_desc, storage_object in zip(processors, storage_descs, storage_objects):
+                if storage_desc.dedup is not None:
+                    metrics.gauge('results_duplicates', storage_object.duplicates, processor=processor)
+                if storage_desc.partitioned:
+                    metrics.gauge('output_partitions', storage_object.partitions, processor=processor)
+            budget = None
+            if args.memory_mb is not None:
+                budget = ByteBudget(int(args.memory_mb * 1024 * 1024))
+                metrics.gauge('budget_records_bytes', lambda: budget.records)
+                metrics.gauge('budget_results_bytes', lambda: budget.results)
+                metrics.gauge('budget_peak_bytes', lambda: budget.peak)
+            reporter = MetricsReporter(port=args.metrics_port, interval=args.stats_interval)
+            reporter.start()
+            in_flight = None
+            watchdog = None
+            if args.record_timeout is not None:
+                in_flight = manager.InFlight()
+                watchdog = WorkerWatchdog(in_flight, semaphore, args.record_timeout,
+                                          on_abandon=budget.done if budget is not None else None)
+                watchdog.start()
+            # Workers only recycle themselves with a record timeout or an RSS limit
+            recycled = None
+            if args.record_timeout is not None or args.max_worker_rss is not None:
+                recycled = manager.list()
+            downloads = HillClimber(args.min_downloads, args.max_downloads) if args.adaptive else None
+            policy = DownloadPolicy(args.hedge_percentile, args.download_timeout)
+            if args.ingestors > 1:
+                ingestor = CompositeIngestor(ingestor_factories(args.ingestor, args.input, args.ingestors, policy),
+                                             args.ingest_mode)
+            elif args.ingestor == 'warc-index':
+                ingestor = WarcIngestor('commoncrawl', open(args.input), manager=manager,
+                                        download_limit=(lambda: downloads.value) if downloads is not None else None,
+                                        policy=policy)
             elif args.ingestor == 'csv-file':
                 ingestor = CSVIngestor(args.input)
             elif args.ingestor == 'btc':
@@ -89,18 +493,85 @@ def main():
             else:
                 raise Exception(f'Unknown ingestor: {args.ingestor}')
 
-            for record in ingestor:
-                semaphore.acquire()
-                p.apply_async(do_process, (args.processor, storage_object, record, results, mutex, semaphore),
-                              callback=callback, error_callback=error_callback)
+            ring = None
+            if args.transport == 'shm':
+                ring = RecordRing(int(args.shm_mb * 1024 * 1024))
+                metrics.gauge('shm_in_use_bytes', ring.in_use)
+
+            controller = None
+            if args.adaptive:
+                limit = SemaphoreLimit(semaphore, threads)
+                limit.set(workers.value)
+                controller = ConcurrencyController(
+                    concurrency_controls(p, limit, workers,
+                                         downloads if args.ingestor == 'warc-index' and args.ingestors == 1 else None),
+                    args.adapt_interval)
+                controller.start()
 
-            with mutex:
-                flush_results(storage_object, results)
+            with profile_section('ingestor'):
                 try:
-                    storage_object.close_and_flush()
-                except Exception as e:
-                    logger.error(f'Error closing storage object: {str(e)}')
-                    raise e
+                    for record in ingestor:
+                        metrics.inc('records_ingested_total')
+                        with metrics.timer('admission_wait_seconds'):
+                            if budget is not None:
+                                size = record_bytes(record)
+                                while not budget.admit(record.uri, size, timeout=RECYCLED_POLL_INTERVAL):
+                                    if account_recycled(recycled, budget) > 0 or not budget.needs_flush():
+                                        continue
+                                    # A worker may have flushed the results before its callback accounted for them
+                                    if flush_buffered(storage_objects, results, mutexes, budget) == 0:
+                                        time.sleep(0.01)
+                            semaphore.acquire()
+                        metrics.inc('records_submitted_total')
+                        if ring is not None:
+                            record = ring.put(record)
+                        # Once buffered results take up half the budget, the worker that gets this record flushes them
+                        flush = budget is not None and budget.results * 2 >= budget.limit
+                        p.apply_async(do_process, (processors, storage_objects, record, results, mutexes, semaphore,
+                                                   in_flight, args.record_timeout, args.max_worker_rss, flush,
+                                                   recycled),
+                                      callback=functools.partial(callback, budget=budget, uri=record.uri),
+                                      error_callback=functools.partial(error_callback, budget=budget, uri=record.uri))
+                finally:
+                    # Stops the ingestors still running (e.g. the processes of a CompositeIngestor) if the loop raises
+                    if hasattr(ingestor, 'close'):
+                        ingestor.close()
+
+            if controller is not None:
+                controller.stop()
+                limit.release()
+            # With a watchdog, every slot is guaranteed to come back; without one, a crashed worker keeps its slot
+            drain_in_flight(semaphore, threads, None if watchdog is not None else 600)
+            if watchdog is not None:
+                watchdog.stop()
+            wait_for_callbacks(recycled=recycled, budget=budget)
+            if ring is not None:
+                ring.close()
+            if args.profile is not None:
+                size = pool_size(p)
+                p.map(dump_worker_profile, [manager.Barrier(size)] * size, chunksize=1)
+                stop_profiling()
+                logger.info(f'Wrote profile report to {write_report(args.profile)}')
+
+            # Every output is closed, even if closing an earlier one failed
+            error = None
+            for processor, storage_desc, storage_object, processor_results, mutex in \
+                    zip(processors, storage_descs, storage_objects, results, mutexes):
+                with mutex:
+                    with metrics.timer('flush_seconds'):
+                        metrics.inc('results_flushed_total', flush_results(storage_object, processor_results)[0])
+                    if storage_desc.dedup is not None:
+                        logger.info(f'{processor}: {storage_object.duplicates()} near-duplicate results '
+                                    f'{"dropped" if args.dedup == "drop" else "tagged"}')
+                    try:
+                        with metrics.timer('storage_close_seconds'):
+                            storage_object.close_and_flush()
+                    except Exception as e:
+                        logger.error(f'Error closing storage object: {str(e)}')
+                        error = error or e
+            reporter.stop()
+            if error is not None:
+                raise error
 
 
 if __name__ == '__main__':
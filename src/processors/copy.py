@@ -6,6 +6,8 @@ from src.processors.types import Record
 
 
 class CopyProcessor(Processor):
+    schema = [('uri', 'string'), ('ts', 'double'), ('content', 'string')]
+
     def __init__(self, results: List[Dict], mutex: threading.Lock):
         self.results = results
         self.mutex = mutex
@@ -0,0 +1,48 @@
+from typing import Dict, List
+
+from src.util.sketch import LSHIndex, MinHash
+
+DEDUP_MODES = ['drop', 'tag']
+
+# Column added in tag mode: the URI of the earlier result this one is a near-duplicate of, or null
+DUPLICATE_OF = 'duplicate_of'
+
+
+# Streaming stage between a processor and its output that drops (or tags) results whose `field` is a near-duplicate of
+# an earlier result's, e.g. the same syndicated article under many URIs.  The first result seen is kept, and up to
+# `capacity` of the latest distinct results are remembered.  Results without the field (e.g. errors) or with an empty
+# one pass through untouched.
+class NearDuplicateFilter:
+    def __init__(self, field: str, mode: str = 'drop', threshold: float = 0.8, capacity: int = 100000,
+                 num_perm: int = 128):
+        if mode not in DEDUP_MODES:
+            raise Exception(f'Unknown dedup mode: {mode}')
+        self.field = field
+        self.mode = mode
+        self.threshold = threshold
+        self.capacity = capacity
+        self.num_perm = num_perm
+        self.duplicates = 0
+        # Built on first use, so a filter is cheap to pickle (e.g. to the process that owns the output)
+        self.minhash = None
+        self.index = None
+
+    def filter(self, results: List[Dict]) -> List[Dict]:
+        if self.index is None:
+            self.minhash = MinHash(self.num_perm)
+            self.index = LSHIndex(self.threshold, self.num_perm, self.capacity)
+        kept = []
+        for result in results:
+            text = result.get(self.field)
+            if not text:
+                kept.append(result)
+                continue
+            original = self.index.offer(result.get('uri'), self.minhash.signature(text))
+            if original is not None:
+                self.duplicates += 1
+                if self.mode == 'drop':
+                    continue
+            if self.mode == 'tag':
+                result = dict(result, **{DUPLICATE_OF: original})
+            kept.append(result)
+        return kept
@@ -8,6 +8,9 @@ from src.processors.types import Record
 
 
 class NewsProcessor(Processor):
+    schema = [('uri', 'string'), ('ts', 'double'), ('title', 'string'), ('text', 'string')]
+    dedup_field = 'text'
+
     def __init__(self, results: List[Dict], mutex: threading.Lock):
         self.results = results
         self.mutex = mutex
@@ -1,10 +1,16 @@
 import threading
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from src.processors.types import Record
 
 
 class Processor:
+    # (column, type) pairs describing the results, used by columnar output formats.  Types are one of: string, int64,
+    # double or bool (see src/storage/parquet.py).
+    schema: List[Tuple[str, str]] = []
+    # Result field compared by --dedup to find near-duplicate results (default: the processor does not support it)
+    dedup_field: str = None
+
     def _init__(self, results: List[Dict], mutex: threading.Lock):
         self.mutex = mutex
         self.results = results
@@ -85,6 +85,9 @@ def get_metadata(html_payload: str) -> RottenTomatoes:
 
 
 class RottenTomatoesProcessor(Processor):
+    schema = [('uri', 'string'), ('ts', 'double'), ('criticScore', 'string'), ('criticNum', 'int64'),
+              ('audienceScore', 'string'), ('audienceNum', 'int64'), ('reason', 'string')]
+
     def __init__(self, results: List[Dict], mutex: threading.Lock):
         self.results = results
         self.mutex = mutex
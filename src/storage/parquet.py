@@ -0,0 +1,102 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Column types processors can use in their schema, and the Arrow type each one is stored as
+ARROW_TYPES = {
+    'string': pa.string(),
+    'int64': pa.int64(),
+    'double': pa.float64(),
+    'bool': pa.bool_(),
+}
+
+# Every processor can report a per-record error instead of a result, so every file has an error column
+ERROR_COLUMN = ('error', 'string')
+
+COMPRESSION_CODECS = ['snappy', 'zstd', 'gzip', 'brotli', 'lz4', 'none']
+
+Schema = List[Tuple[str, str]]
+
+
+def arrow_schema(schema: Schema) -> pa.Schema:
+    columns = list(schema)
+    if ERROR_COLUMN[0] not in [name for name, _ in columns]:
+        columns.append(ERROR_COLUMN)
+    fields = []
+    for name, column_type in columns:
+        if column_type not in ARROW_TYPES:
+            raise Exception(f'Unknown column type for {name}: {column_type}')
+        fields.append(pa.field(name, ARROW_TYPES[column_type], nullable=True))
+    return pa.schema(fields)
+
+
+# Processors are not strict about types (e.g. scraped counts may be strings), so convert what can be converted and
+# store nulls for the rest, rather than failing the whole row group
+def _coerce(value, arrow_type: pa.DataType):
+    if value is None:
+        return None
+    try:
+        if arrow_type == pa.string():
+            return value if isinstance(value, str) else str(value)
+        if arrow_type == pa.int64():
+            return int(value)
+        if arrow_type == pa.float64():
+            return float(value)
+        if arrow_type == pa.bool_():
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+# Writes processor results to a Parquet file, one row per result.  Results are buffered until there are enough rows
+# for a row group, so row groups keep their size regardless of how often the workers flush.  Keys that are not in the
+# schema are dropped.
+class ParquetSink:
+    def __init__(self, path: str, schema: Schema, row_group_size: int = 10000, compression: str = 'snappy'):
+        if compression not in COMPRESSION_CODECS:
+            raise Exception(f'Unknown compression codec: {compression}')
+        self.path = path
+        self.schema = arrow_schema(schema)
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.columns: Dict[str, List] = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        self.buffered_bytes = 0
+        self.writer: Optional[pq.ParquetWriter] = None
+
+    def write(self, results: List[Dict]) -> int:
+        for result in results:
+            for field in self.schema:
+                value = _coerce(result.get(field.name), field.type)
+                self.columns[field.name].append(value)
+                self.buffered_bytes += len(value) if isinstance(value, str) else 8
+        self.buffered += len(results)
+        if self.buffered >= self.row_group_size:
+            self.flush()
+        return len(results)
+
+    def flush(self):
+        if self.buffered == 0:
+            return
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+        table = pa.Table.from_pydict(self.columns, schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.columns = {name: [] for name in self.schema.names}
+        self.buffered = 0
+        self.buffered_bytes = 0
+
+    # Bytes written so far, plus the uncompressed size of the rows that are still buffered
+    def size(self) -> int:
+        written = os.path.getsize(self.path) if self.writer is not None else 0
+        return written + self.buffered_bytes
+
+    def close(self):
+        self.flush()
+        if self.writer is None:
+            # Nothing was written, but downstream readers still expect a (valid, empty) file
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+        self.writer.close()
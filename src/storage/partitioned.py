@@ -0,0 +1,167 @@
+import copy
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Union
+
+from src.storage.storage import StorageDescriptor, StorageObject, manifest_path, write_json
+
+# Partition of the results without a (usable) timestamp, as named by Hive, which most query engines understand
+DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+
+# Day (UTC) of a result's timestamp, e.g. 2021-03-01.  WARC files without a timestamp in their name get a ts of 0, and
+# CSV input passes its timestamps through as they are (e.g. in milliseconds), so timestamps that are not positive
+# numbers of seconds within the range of dates go to the default partition.
+def partition_date(ts) -> str:
+    try:
+        ts = float(ts)
+        if not math.isfinite(ts) or ts <= 0:
+            return DEFAULT_PARTITION
+        return datetime.utcfromtimestamp(ts).strftime('%Y-%m-%d')
+    except (TypeError, ValueError, OverflowError, OSError):
+        return DEFAULT_PARTITION
+
+
+# <root> of <root>.<ext>, under which the partitions are written as <root>/dt=<date>/part-00000.<ext>
+def partition_root(path: str) -> str:
+    return os.path.splitext(path)[0]
+
+
+# Rolling output of one partition, with its own manifest.  Once suspended, the next results start a new part.
+class PartitionWriter(StorageObject):
+    always_rolls = True
+
+    def __init__(self, desc: StorageDescriptor, directory: str, on_part_done: Callable[[], None],
+                 uploader: ThreadPoolExecutor = None):
+        self.directory = directory
+        self.on_part_done = on_part_done
+        super().__init__(desc, uploader)
+
+    def _part_path(self, part: int) -> str:
+        return f'{self.directory}/part-{part:05d}{os.path.splitext(self.desc.path)[1]}'
+
+    def _manifest_path(self) -> str:
+        return f'{self.directory}/manifest.json'
+
+    def _open_part(self):
+        if self.desc.file_type == 'file':
+            os.makedirs(self.directory, exist_ok=True)
+        super()._open_part()
+
+    def _part_done(self, entry: Dict):
+        super()._part_done(entry)
+        self.on_part_done()
+
+    def published_records(self) -> int:
+        with self.lock:
+            return sum(p['records'] for p in self.parts)
+
+
+# Writes results into a partition per day of their `ts` (see partition_date()), as rolling parts of at most the
+# descriptor's part limits.  Crawls mostly move forward in time, so only `max_open_partitions` partitions have a part
+# open at a time: the one least recently written to is suspended (its part published) to make room for another.
+#
+# Each partition has its own manifest, and <root>.manifest.json lists the partitions with the range of timestamps of
+# their results, so readers can skip the partitions outside of a time range (see src/storage/reader.py).
+class PartitionedStorageObject:
+    def __init__(self, desc: StorageDescriptor):
+        if desc.file_type not in ['s3', 'file']:
+            raise Exception(f'Unknown file type: {desc.file_type}')
+        self.desc = desc
+        # The partitions only write what is left after deduplication
+        self.partition_desc = copy.copy(desc)
+        self.partition_desc.dedup = None
+        self.root = partition_root(desc.path)
+        self.writers: Dict[str, PartitionWriter] = {}
+        # Partitions with an open part, least recently written to first
+        self.open: OrderedDict = OrderedDict()
+        self.ranges: Dict[str, List[Optional[float]]] = {}
+        self.lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+        self.uploader = None
+        if desc.file_type == 's3':
+            self.uploader = ThreadPoolExecutor(desc.upload_threads, thread_name_prefix='upload')
+
+    def _writer(self, dt: str) -> PartitionWriter:
+        if dt in self.open:
+            self.open.move_to_end(dt)
+            return self.writers[dt]
+        if len(self.open) >= self.desc.max_open_partitions:
+            evicted, _ = self.open.popitem(last=False)
+            self.writers[evicted].suspend()
+        if dt not in self.writers:
+            with self.lock:
+                self.writers[dt] = PartitionWriter(self.partition_desc, f'{self.root}/dt={dt}',
+                                                   lambda: self._write_manifest(complete=False), self.uploader)
+        self.open[dt] = None
+        return self.writers[dt]
+
+    def append_results(self, results: List[Dict]) -> int:
+        if self.desc.dedup is not None:
+            results = self.desc.dedup.filter(results)
+        batches: Dict[str, List[Dict]] = OrderedDict()
+        for r in results:
+            dt = partition_date(r.get('ts'))
+            batches.setdefault(dt, []).append(r)
+            if dt != DEFAULT_PARTITION:
+                ts = float(r['ts'])
+                with self.lock:
+                    bounds = self.ranges.setdefault(dt, [ts, ts])
+                    bounds[0], bounds[1] = min(bounds[0], ts), max(bounds[1], ts)
+        for dt, batch in batches.items():
+            self._writer(dt).append_results(batch)
+        return len(results)
+
+    def duplicates(self) -> int:
+        return self.desc.dedup.duplicates if self.desc.dedup is not None else 0
+
+    def partitions(self) -> int:
+        return len(self.writers)
+
+    def _write_manifest(self, complete: bool):
+        with self.manifest_lock:
+            with self.lock:
+                writers = sorted(self.writers.items())
+                ranges = {dt: list(bounds) for dt, bounds in self.ranges.items()}
+            partitions = []
+            for dt, writer in writers:
+                records = writer.published_records()
+                if records == 0:
+                    continue
+                min_ts, max_ts = ranges.get(dt, [None, None])
+                partitions.append({'dt': dt, 'manifest': writer._manifest_path(), 'records': records,
+                                   'min_ts': min_ts, 'max_ts': max_ts})
+            manifest = {
+                'format': self.desc.output_format,
+                'complete': complete,
+                'partitioned': 'dt',
+                'records': sum(p['records'] for p in partitions),
+                'partitions': partitions
+            }
+            write_json(self.desc, manifest, manifest_path(self.desc.path))
+
+    def close_and_flush(self):
+        for dt in list(self.open):
+            self.writers[dt].suspend()
+        self.open.clear()
+        if self.uploader is not None:
+            self.uploader.shutdown(wait=True)
+        failed = []
+        for writer in self.writers.values():
+            failed += writer.failed
+            if len(writer.failed) == 0:
+                writer.close_and_flush()
+        if len(failed) > 0:
+            raise Exception(f'Could not upload {len(failed)} parts: {", ".join(failed)}')
+        self._write_manifest(complete=True)
+
+
+# The storage object for the descriptor: partitioned by date, or a single (possibly rolling) output
+def open_storage(desc: StorageDescriptor) -> Union[StorageObject, PartitionedStorageObject]:
+    if desc.partitioned:
+        return PartitionedStorageObject(desc)
+    return StorageObject(desc)
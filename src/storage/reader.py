@@ -0,0 +1,281 @@
+import base64
+import gzip
+import json
+import os
+import tempfile
+from collections import deque
+from functools import lru_cache
+from multiprocessing import get_context
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from src.storage.s3 import S3Object, get_s3_connection
+from src.storage.storage import StorageDescriptor
+from src.storage.uri_index import find, index_path
+from src.util.logging import Logger
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+logger = Logger()
+
+# Files are split into chunks of roughly this many bytes, each decoded by one worker
+DEFAULT_CHUNK_BYTES = 32 * 1024 * 1024
+
+READ_BYTES = 1024 * 1024
+
+# (path, start, end): decode the lines that begin in [start, end) of the file at path.  Parquet files are a single
+# chunk, with start and end set to None.
+Chunk = Tuple[str, Optional[int], Optional[int]]
+
+
+def _descriptor(path: str) -> StorageDescriptor:
+    if not path.startswith('s3://') and not path.startswith('file://'):
+        path = f'file://{os.path.abspath(path)}'
+    return StorageDescriptor(path)
+
+
+def _is_parquet(path: str) -> bool:
+    return path.endswith('.parquet')
+
+
+# Decodes one line of the line format (see src/storage/storage.py:encode_line)
+def decode_line(line: Union[str, bytes], fields: Optional[List[str]] = None) -> Dict:
+    payload = loads(gzip.decompress(base64.b64decode(line)))
+    if fields is not None:
+        return {f: payload.get(f) for f in fields}
+    return payload
+
+
+def _s3_key(desc: StorageDescriptor):
+    conn = get_s3_connection(desc.aws_access_key_id, desc.aws_secret_access_key,
+                             host=f's3.{desc.region}.amazonaws.com')
+    return conn.get_bucket(desc.bucket).get_key(desc.path)
+
+
+def _size(desc: StorageDescriptor) -> int:
+    if desc.file_type == 's3':
+        return _s3_key(desc).size
+    return os.path.getsize(desc.path)
+
+
+# Streams the bytes of the file from offset to the end, in blocks
+def _read_from(desc: StorageDescriptor, offset: int) -> Iterator[bytes]:
+    if desc.file_type == 's3':
+        key = _s3_key(desc)
+        key.open_read(headers={'Range': f'bytes={offset}-'})
+        try:
+            for block in iter(lambda: key.read(READ_BYTES), b''):
+                yield block
+        finally:
+            key.close(fast=True)
+    else:
+        with open(desc.path, 'rb') as fd:
+            fd.seek(offset)
+            for block in iter(lambda: fd.read(READ_BYTES), b''):
+                yield block
+
+
+# Yields the lines that begin in [start, end).  A chunk that does not start at the beginning of the file starts one
+# byte early and skips the (partial) line it lands in, which the previous chunk owns; the last line of a chunk may run
+# past end.
+def _chunk_lines(desc: StorageDescriptor, start: int, end: int) -> Iterator[bytes]:
+    offset = max(start - 1, 0)
+    skip = start > 0
+    pending = b''
+    for block in _read_from(desc, offset):
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if skip:
+                skip = False
+                offset += len(line) + 1
+                continue
+            if offset >= end:
+                return
+            offset += len(line) + 1
+            if line:
+                yield line
+    if pending and not skip and offset < end:
+        yield pending
+
+
+@lru_cache(maxsize=None)
+def _s3_bucket(region: str, bucket: str, aws_access_key_id: str, aws_secret_access_key: str):
+    conn = get_s3_connection(aws_access_key_id, aws_secret_access_key, host=f's3.{region}.amazonaws.com')
+    return conn.get_bucket(bucket, validate=False)
+
+
+# Reads `length` bytes of the file from offset.  On S3, buckets are not validated and their connections are reused, so
+# each read is a single ranged GET.
+def read_range(path: str, offset: int, length: int) -> bytes:
+    desc = _descriptor(path)
+    if desc.file_type == 's3':
+        bucket = _s3_bucket(desc.region, desc.bucket, desc.aws_access_key_id, desc.aws_secret_access_key)
+        return bucket.new_key(desc.path).get_contents_as_string(
+            headers={'Range': f'bytes={offset}-{offset + length - 1}'})
+    with open(desc.path, 'rb') as fd:
+        fd.seek(offset)
+        return fd.read(length)
+
+
+def _apply(payload: Dict, transform: Optional[Callable[[Dict], Any]]) -> Any:
+    return transform(payload) if transform is not None else payload
+
+
+def _chunk_results(chunk: Chunk, fields: Optional[List[str]]) -> Iterator[Dict]:
+    path, start, end = chunk
+    if _is_parquet(path):
+        return _read_parquet(path, fields)
+    return (decode_line(line, fields) for line in _chunk_lines(_descriptor(path), start, end))
+
+
+def decode_chunk(chunk: Chunk, fields: Optional[List[str]] = None,
+                 transform: Optional[Callable[[Dict], Any]] = None) -> List[Any]:
+    return [_apply(r, transform) for r in _chunk_results(chunk, fields)]
+
+
+def map_chunk(chunk: Chunk, mapper: Callable[[Iterator[Dict]], Any], fields: Optional[List[str]] = None) -> Any:
+    return mapper(_chunk_results(chunk, fields))
+
+
+# Converting a column through numpy is several times faster than Arrow's to_pylist(), but turns nulls in numeric
+# columns into NaN, so those columns still go through to_pylist()
+def _column_values(column) -> List[Any]:
+    import pyarrow as pa
+    if column.null_count == 0 or pa.types.is_string(column.type):
+        return column.to_numpy(zero_copy_only=False).tolist()
+    return column.to_pylist()
+
+
+def _read_parquet(path: str, fields: Optional[List[str]]) -> Iterator[Dict]:
+    import pyarrow.parquet as pq
+    desc = _descriptor(path)
+    local_path = desc.path
+    if desc.file_type == 's3':
+        fd, local_path = tempfile.mkstemp(suffix='.parquet')
+        os.close(fd)
+        S3Object(desc.bucket, desc.region, desc.path, desc.aws_access_key_id, desc.aws_secret_access_key) \
+            .get(local_path)
+    try:
+        for batch in pq.ParquetFile(local_path).iter_batches(columns=fields):
+            names = batch.schema.names
+            for values in zip(*[_column_values(column) for column in batch.columns]):
+                yield dict(zip(names, values))
+    finally:
+        if desc.file_type == 's3':
+            os.remove(local_path)
+
+
+def _is_manifest(path: str) -> bool:
+    return path.endswith('.manifest.json') or path.endswith('/manifest.json')
+
+
+# Whether a partition (see src/storage/partitioned.py) may have results with a timestamp in [since, until).  Results
+# without a timestamp are left out of any time range.
+def _overlaps(partition: Dict, since: Optional[float], until: Optional[float]) -> bool:
+    if since is None and until is None:
+        return True
+    if partition.get('min_ts') is None:
+        return False
+    return (since is None or partition['max_ts'] >= since) and (until is None or partition['min_ts'] < until)
+
+
+# Expands manifests (see src/storage/storage.py:StorageObject) into the parts they list.  The manifests of partitioned
+# output are expanded into the parts of the partitions that overlap [since, until), which are the only ones read.
+def expand_paths(paths: List[str], since: Optional[float] = None, until: Optional[float] = None) -> List[str]:
+    expanded = []
+    for path in paths:
+        if not _is_manifest(path):
+            expanded.append(path)
+            continue
+        desc = _descriptor(path)
+        manifest = loads(b''.join(_read_from(desc, 0)))
+        prefix = f's3://{desc.region}.{desc.bucket}/' if desc.file_type == 's3' else 'file://'
+        if 'partitions' in manifest:
+            if not manifest.get('complete', False):
+                logger.warning(f'{path} is incomplete, reading the {len(manifest["partitions"])} partitions with '
+                               f'results so far')
+            expanded += expand_paths([f'{prefix}{p["manifest"]}' for p in manifest['partitions']
+                                      if _overlaps(p, since, until)])
+            continue
+        if not manifest.get('complete', False):
+            logger.warning(f'{path} is incomplete, reading the {len(manifest["parts"])} parts completed so far')
+        for part in manifest['parts']:
+            expanded.append(f'{prefix}{part["path"]}')
+    return expanded
+
+
+def split_chunks(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> List[Chunk]:
+    if _is_parquet(path):
+        # Arrow already decodes with multiple threads, and only reads the projected columns
+        return [(path, None, None)]
+    size = _size(_descriptor(path))
+    return [(path, start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+
+# Runs fn(chunk, *args) for every chunk, in a pool of `workers` processes (or in this process, with workers=1), and
+# yields the results in chunk order.  Only a couple of chunks per worker are in flight, so memory stays bounded when
+# the consumer is slow.
+def _run_chunks(chunks: List[Chunk], fn: Callable, args: Tuple, workers: int) -> Iterator[Any]:
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield fn(chunk, *args)
+        return
+    with get_context('spawn').Pool(workers) as pool:
+        pending = deque()
+        remaining = deque(chunks)
+        while len(remaining) > 0 or len(pending) > 0:
+            while len(remaining) > 0 and len(pending) < 2 * workers:
+                pending.append(pool.apply_async(fn, (remaining.popleft(),) + args))
+            yield pending.popleft().get()
+
+
+def _chunks(paths: Union[str, List[str]], chunk_bytes: int, since: Optional[float] = None,
+            until: Optional[float] = None) -> List[Chunk]:
+    chunks = []
+    for path in expand_paths([paths] if isinstance(paths, str) else paths, since, until):
+        chunks += split_chunks(path, chunk_bytes)
+    return chunks
+
+
+# Streams the results stored in crawl output files, in order.  Paths are local paths, file://<path>,
+# s3://<region>.<bucket>/<path> or manifests, in the line or Parquet format.  Line files are split into line-aligned
+# chunks that are decoded by a pool of `workers` processes (or in this process, with workers=1).  With `fields`, only
+# those fields are kept, which also keeps what the workers send back small.  `transform` is applied to each result in
+# the worker; with workers > 1, it has to be a module-level function, so it can be pickled.  For output partitioned by
+# date, `since` and `until` (epoch seconds) skip the partitions without results in [since, until); the results of the
+# partitions that are read are not filtered.
+def read_results(paths: Union[str, List[str]], fields: Optional[List[str]] = None,
+                 transform: Optional[Callable[[Dict], Any]] = None, workers: int = None,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES, since: Optional[float] = None,
+                 until: Optional[float] = None) -> Iterator[Any]:
+    workers = workers if workers is not None else os.cpu_count()
+    for results in _run_chunks(_chunks(paths, chunk_bytes, since, until), decode_chunk, (fields, transform), workers):
+        yield from results
+
+
+# Map side of a map-reduce over crawl output: yields mapper(<results of the chunk>) for every chunk, computed in the
+# workers, so only the (small) partial results are sent back to be merged.  The same rules as read_results() apply.
+def map_results(paths: Union[str, List[str]], mapper: Callable[[Iterator[Dict]], Any],
+                fields: Optional[List[str]] = None, workers: int = None,
+                chunk_bytes: int = DEFAULT_CHUNK_BYTES, since: Optional[float] = None,
+                until: Optional[float] = None) -> Iterator[Any]:
+    workers = workers if workers is not None else os.cpu_count()
+    yield from _run_chunks(_chunks(paths, chunk_bytes, since, until), map_chunk, (mapper, fields), workers)
+
+
+# Results stored for `uri` in output files written with a URI index (see src/storage/uri_index.py), from the same paths
+# as read_results().  Only the index blocks and lines that may match are read, and results whose URI merely has the
+# same hash are left out.
+def lookup(paths: Union[str, List[str]], uri: str) -> List[Dict]:
+    results = []
+    for path in expand_paths([paths] if isinstance(paths, str) else paths):
+        for offset, length in find(index_path(path), uri, read_range):
+            result = decode_line(read_range(path, offset, length).rstrip(b'\n'))
+            if result.get('uri') == uri:
+                results.append(result)
+    return results
@@ -1,8 +1,9 @@
 import logging
 import os
 from typing import Tuple
+from urllib.parse import urlparse
 
-from boto.s3.connection import S3Connection
+from boto.s3.connection import S3Connection, OrdinaryCallingFormat
 from boto.s3.key import Key
 
 from src.storage.remote import RemoteObject
@@ -16,6 +17,21 @@ def get_s3_credentials() -> Tuple[str, str]:
     return aws_access_key_id, aws_secret_access_key
 
 
+# Setting S3_ENDPOINT_URL (e.g. http://127.0.0.1:9000) points every S3 connection at an S3-compatible endpoint, such
+# as the local stand-in used by the benchmarks, with path-style addressing
+def get_s3_connection(aws_access_key_id: str, aws_secret_access_key: str, host: str = None) -> S3Connection:
+    endpoint = os.getenv('S3_ENDPOINT_URL')
+    if endpoint is not None:
+        url = urlparse(endpoint)
+        return S3Connection(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                            host=url.hostname, port=url.port, is_secure=url.scheme == 'https',
+                            calling_format=OrdinaryCallingFormat())
+    if host is not None:
+        return S3Connection(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                            host=host)
+    return S3Connection(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+
+
 class S3Object(RemoteObject):
     def __init__(self, bucket: str, region: str, path: str, aws_access_key_id: str, aws_secret_access_key: str):
         self.bucket = bucket
@@ -23,19 +39,18 @@ class S3Object(RemoteObject):
         self.path = path
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
-        conn = S3Connection(aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
-                            host=f's3.{self.region}.amazonaws.com')
+        conn = get_s3_connection(aws_access_key_id, aws_secret_access_key, host=f's3.{self.region}.amazonaws.com')
         bucket_conn = conn.get_bucket(bucket)
         self.k = Key(bucket_conn, path)
 
     def get(self, local_path: str) -> int:
-        with open(local_path, 'w') as fd:
+        with open(local_path, 'wb') as fd:
             self.k.get_file(fd)
             return fd.tell()
 
     def put(self, local_path: str) -> int:
         written = 0
-        with open(local_path, 'r') as fd:
+        with open(local_path, 'rb') as fd:
             try:
                 position = fd.tell()
                 fd.seek(0, os.SEEK_END)
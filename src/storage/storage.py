@@ -1,12 +1,62 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
 import re
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
 
+from src.processors.dedup import NearDuplicateFilter
 from src.storage.s3 import S3Object, get_s3_credentials
+from src.storage.uri_index import UriIndexWriter, index_path
+from src.util.logging import Logger
+
+logger = Logger()
+
+OUTPUT_FORMATS = ['line', 'parquet']
+
+UPLOAD_ATTEMPTS = 3
+
+
+# The line format: one base64-encoded, gzipped JSON document per line
+def encode_line(result: Dict) -> str:
+    return str(base64.b64encode(gzip.compress(str(json.dumps(result)).encode('utf-8'), 9)).decode('ascii') + '\n')
 
 
 class StorageDescriptor:
-    def __init__(self, output_path: str):
+    def __init__(self, output_path: str, output_format: str = 'line', schema: List[Tuple[str, str]] = None,
+                 row_group_size: int = 10000, compression: str = 'snappy', part_bytes: int = None,
+                 part_records: int = None, upload_threads: int = 4, dedup: NearDuplicateFilter = None,
+                 uri_index: bool = False, partitioned: bool = False, max_open_partitions: int = 8):
+        if output_format not in OUTPUT_FORMATS:
+            raise Exception(f'Unknown output format: {output_format}')
+        if output_format == 'parquet' and not schema:
+            raise Exception('The parquet output format requires a processor with a schema')
+        if output_format != 'line' and uri_index:
+            raise Exception('The URI index requires the line output format')
         self.output_path = output_path
+        self.output_format = output_format
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.compression = compression
+        # Roll the output into numbered parts once a part reaches either limit (default: a single output file)
+        self.part_bytes = part_bytes
+        self.part_records = part_records
+        self.upload_threads = upload_threads
+        # Filters near-duplicate results before they are written.  The storage object is shared by every worker, so
+        # results are compared across all of them.
+        self.dedup = dedup
+        # Write a sidecar URI index next to each output file (see src/storage/uri_index.py)
+        self.uri_index = uri_index
+        # Route results into a directory per day of their timestamp, keeping at most max_open_partitions parts open
+        # (see src/storage/partitioned.py)
+        self.partitioned = partitioned
+        self.max_open_partitions = max_open_partitions
+        if max_open_partitions < 1:
+            raise Exception(f'Bad number of open partitions: {max_open_partitions}')
         self.s3_pattern = 's3://([a-zA-Z0-9\\-]+)\\.([a-zA-Z0-9\\-]+)/(.*)'
         type_re = re.compile('(s3|file)://.*')
         match_type = type_re.match(output_path)
@@ -32,25 +82,270 @@ class StorageDescriptor:
                 raise Exception(f'Unknown file type: {self.file_type}')
 
 
+# Checksum recorded in the manifest for each part.  MD5 matches the ETag S3 reports for single-request uploads.
+def file_md5(path: str) -> str:
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+# <name>.<ext> -> <name>.part-00001.<ext>
+def part_path(path: str, part: int) -> str:
+    base, ext = os.path.splitext(path)
+    return f'{base}.part-{part:05d}{ext}'
+
+
+# <name>.<ext> -> <name>.manifest.json
+def manifest_path(path: str) -> str:
+    return f'{os.path.splitext(path)[0]}.manifest.json'
+
+
+def put_file(desc: StorageDescriptor, local_filename: str, path: str):
+    print(f'Flushing {local_filename} to {desc.file_type}://{desc.region}.{desc.bucket}/{path}')
+    remote_object = S3Object(desc.bucket, desc.region, path, desc.aws_access_key_id, desc.aws_secret_access_key)
+    remote_object.put(local_filename)
+
+
+# Replaces the JSON document at `path` (e.g. a manifest) in one go, so readers never see a partial one
+def write_json(desc: StorageDescriptor, document: Dict, path: str):
+    if desc.file_type == 's3':
+        local_filename = f'/tmp/{str(uuid.uuid4())}-{os.path.basename(path)}'
+    else:
+        local_filename = f'{path}.inprogress'
+    with open(local_filename, 'w') as fd:
+        json.dump(document, fd, indent=2)
+    if desc.file_type == 's3':
+        put_file(desc, local_filename, path)
+        os.remove(local_filename)
+    else:
+        os.rename(local_filename, path)
+
+
 class StorageObject:
-    def __init__(self, desc: StorageDescriptor):
+    # Write numbered parts even without part limits
+    always_rolls = False
+
+    # `uploader` shares the threads uploading parts with other storage objects, in which case whoever owns it waits for
+    # the uploads before close_and_flush()
+    def __init__(self, desc: StorageDescriptor, uploader: ThreadPoolExecutor = None):
         self.desc = desc
+        if self.desc.file_type not in ['s3', 'file']:
+            raise Exception(f'Unknown file type: {self.desc.file_type}')
+        self.rolling = self.always_rolls or desc.part_bytes is not None or desc.part_records is not None
+        self.part = 0
+        self.parts: List[Dict] = []
+        self.failed: List[str] = []
+        self.lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+        self.uploader = uploader
+        self.owns_uploader = uploader is None
+        if self.uploader is None and self.rolling and self.desc.file_type == 's3':
+            self.uploader = ThreadPoolExecutor(desc.upload_threads, thread_name_prefix='upload')
+        self._open_part()
+
+    def _part_path(self, part: int) -> str:
+        return part_path(self.desc.path, part)
+
+    def _manifest_path(self) -> str:
+        return manifest_path(self.desc.path)
+
+    def _open_part(self):
+        self.is_open = True
+        self.remote_path = self._part_path(self.part) if self.rolling else self.desc.path
         if self.desc.file_type == 's3':
-            self.local_filename = f'/tmp/{str(uuid.uuid4())}{desc.bucket}-{desc.path.replace("/", ":")}'
-            self.append_file = open(self.local_filename, mode="a+", encoding='utf-8')
-        elif self.desc.file_type == 'file':
-            self.append_file = open(desc.path, mode="a+", encoding='utf-8')
+            self.local_filename = f'/tmp/{str(uuid.uuid4())}{self.desc.bucket}-{self.remote_path.replace("/", ":")}'
+        elif self.rolling:
+            # Parts only show up under their final name once they are complete
+            self.local_filename = f'{self.remote_path}.inprogress'
+        else:
+            self.local_filename = self.desc.path
+        self.records = 0
+        self.bytes = 0
+        self.append_file = None
+        self.sink = None
+        self.uri_index = UriIndexWriter() if self.desc.uri_index else None
+        if self.desc.output_format == 'parquet':
+            # Only needed for the parquet format, so pyarrow is not a hard requirement
+            from src.storage.parquet import ParquetSink
+            self.sink = ParquetSink(self.local_filename, self.desc.schema, self.desc.row_group_size,
+                                    self.desc.compression)
         else:
-           raise Exception(f'Unknown file type: {self.desc.file_type}')
+            self.append_file = open(self.local_filename, mode="a+", encoding='utf-8')
+            # Where this run's lines start, when appending to an existing file
+            self.base_offset = self.append_file.tell()
+            if self.uri_index is not None and self.base_offset > 0:
+                # The index is rewritten when the file is closed, so it keeps the earlier runs' lines
+                if not os.path.exists(index_path(self.local_filename)):
+                    raise Exception(f'Cannot index {self.local_filename}: it has results from a run without '
+                                    f'--uri-index')
+                self.uri_index.load(index_path(self.local_filename))
+
+    def _size(self) -> int:
+        return self.sink.size() if self.sink is not None else self.bytes
+
+    def _part_full(self) -> bool:
+        return self.rolling and self.records > 0 and \
+            (self.desc.part_records is not None and self.records >= self.desc.part_records or
+             self.desc.part_bytes is not None and self._size() >= self.desc.part_bytes)
 
     def append(self, payload: str) -> int:
-        return self.append_file.write(payload)
+        if not self.is_open:
+            self._open_part()
+        written = self.append_file.write(payload)
+        self.records += 1
+        self.bytes += written
+        if self._part_full():
+            self._roll()
+        return written
 
-    def close_and_flush(self):
-        self.append_file.close()
+    # Appends a batch of processor results in the output format.  Passing the whole batch in one call matters when
+    # this object lives in a manager process, since every call is a round-trip.
+    def append_results(self, results: List[Dict]) -> int:
+        if self.desc.dedup is not None:
+            results = self.desc.dedup.filter(results)
+        if not self.is_open:
+            self._open_part()
+        if not self.rolling and self.sink is not None:
+            return self.sink.write(results)
+        for r in results:
+            if self.sink is not None:
+                self.sink.write([r])
+            else:
+                line = encode_line(r)
+                if self.uri_index is not None and r.get('uri') is not None:
+                    # Lines are ASCII, so characters are bytes
+                    self.uri_index.add(r['uri'], self.base_offset + self.bytes, len(line))
+                self.bytes += self.append_file.write(line)
+            self.records += 1
+            # A batch may span parts
+            if self._part_full():
+                self._roll()
+        return len(results)
+
+    # Near-duplicate results filtered so far (or tagged, in tag mode)
+    def duplicates(self) -> int:
+        return self.desc.dedup.duplicates if self.desc.dedup is not None else 0
+
+    def _close_part(self) -> Dict:
+        if self.sink is not None:
+            self.sink.close()
+        else:
+            self.append_file.close()
+        entry = {
+            'part': self.part,
+            'path': self.remote_path,
+            'records': self.records,
+            'bytes': os.path.getsize(self.local_filename),
+            'md5': file_md5(self.local_filename)
+        }
+        if self.uri_index is not None:
+            # Written next to the local file, and published along with it
+            self.uri_index.write(index_path(self.local_filename))
+            entry['index'] = index_path(self.remote_path)
+        return entry
+
+    # Moves (or uploads) the URI index of the part written to local_filename, if there is one, to its final path
+    def _publish_index(self, entry: Dict, local_filename: str):
+        if 'index' not in entry:
+            return
         if self.desc.file_type == 's3':
-            print(f'Flushing {self.local_filename} to {self.desc.file_type}://{self.desc.region}.{self.desc.bucket}/{self.desc.path}')
-            remote_object = S3Object(self.desc.bucket, self.desc.region, self.desc.path, self.desc.aws_access_key_id,
-                                     self.desc.aws_secret_access_key)
-            remote_object.put(self.local_filename)
+            self._put(index_path(local_filename), entry['index'])
+        elif index_path(local_filename) != entry['index']:
+            os.rename(index_path(local_filename), entry['index'])
+
+    # Closes the current part, publishes it in the background and (unless it is the last one) starts the next one.  After
+    # the last one, the next results (if any) start a new part.
+    def _roll(self, last: bool = False):
+        entry = self._close_part()
+        if self.uploader is not None:
+            self.uploader.submit(self._upload_part, entry, self.local_filename)
+        else:
+            # The index first, so it is there by the time the part shows up
+            self._publish_index(entry, self.local_filename)
+            os.rename(self.local_filename, entry['path'])
+            self._part_done(entry)
+        self.part += 1
+        if last:
+            self.is_open = False
+        else:
+            self._open_part()
+
+    # Closes the current part without publishing it, since it has no results
+    def _discard_part(self):
+        entry = self._close_part()
+        os.remove(self.local_filename)
+        if 'index' in entry:
+            os.remove(index_path(self.local_filename))
+        self.is_open = False
+
+    # Publishes the current part, if it has any results, and closes it until more results come in.  Rolling output
+    # only.
+    def suspend(self):
+        if not self.is_open:
+            return
+        if self.records > 0:
+            self._roll(last=True)
+        else:
+            self._discard_part()
 
+    def _upload_part(self, entry: Dict, local_filename: str):
+        for attempt in range(1, UPLOAD_ATTEMPTS + 1):
+            try:
+                self._publish_index(entry, local_filename)
+                self._put(local_filename, entry['path'])
+                break
+            except Exception as e:
+                logger.warning(f'Upload of {entry["path"]} failed (attempt {attempt}/{UPLOAD_ATTEMPTS}): {str(e)}')
+                if attempt == UPLOAD_ATTEMPTS:
+                    with self.lock:
+                        self.failed.append(entry['path'])
+                    return
+        os.remove(local_filename)
+        if 'index' in entry:
+            os.remove(index_path(local_filename))
+        self._part_done(entry)
+
+    def _part_done(self, entry: Dict):
+        logger.info(f'Completed part {entry["path"]} ({entry["records"]} records, {entry["bytes"]} bytes)')
+        with self.lock:
+            self.parts.append(entry)
+        self._write_manifest(complete=False)
+
+    def _put(self, local_filename: str, path: str):
+        put_file(self.desc, local_filename, path)
+
+    # The manifest lists the completed parts, so consumers can start on them while the run is still going.  It is
+    # rewritten as parts complete, and marked complete once the last part is published.
+    def _write_manifest(self, complete: bool):
+        with self.manifest_lock:
+            with self.lock:
+                parts = sorted(self.parts, key=lambda x: x['part'])
+            manifest = {
+                'format': self.desc.output_format,
+                'complete': complete,
+                'records': sum(p['records'] for p in parts),
+                'parts': parts
+            }
+            write_json(self.desc, manifest, self._manifest_path())
+
+    def close_and_flush(self):
+        if not self.rolling:
+            entry = self._close_part()
+            self._publish_index(entry, self.local_filename)
+            if self.desc.file_type == 's3':
+                self._put(self.local_filename, self.desc.path)
+                if 'index' in entry:
+                    os.remove(index_path(self.local_filename))
+            return
+        # The last part is only kept if it has results (or there would be no output at all)
+        if self.is_open and (self.records > 0 or self.part == 0 and not self.always_rolls):
+            self._roll(last=True)
+        elif self.is_open:
+            self._discard_part()
+        if self.uploader is not None and self.owns_uploader:
+            self.uploader.shutdown(wait=True)
+        if len(self.failed) > 0:
+            raise Exception(f'Could not upload {len(self.failed)} parts: {", ".join(self.failed)}')
+        self._write_manifest(complete=True)
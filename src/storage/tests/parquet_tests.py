@@ -0,0 +1,80 @@
+import base64
+import gzip
+import json
+import os
+import tempfile
+import unittest
+
+import pyarrow.parquet as pq
+
+from src.processors.news import NewsProcessor
+from src.processors.rottentomatoes import RottenTomatoesProcessor
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+class ParquetStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _storage_object(self, name: str, output_format: str, schema=None, row_group_size: int = 10000):
+        path = os.path.join(self.tmp.name, name)
+        return path, StorageObject(StorageDescriptor(f'file://{path}', output_format, schema, row_group_size))
+
+    def test_news_round_trip(self):
+        path, storage_object = self._storage_object('news.parquet', 'parquet', NewsProcessor.schema, 25)
+        results = [{'uri': f'https://example.com/{i}', 'ts': 1614556800.0 + i, 'title': f'Title {i}',
+                    'text': 'Body ' * i} for i in range(100)]
+        results.append({'error': 'Error processing record: Could not parse'})
+        for i in range(0, len(results), 10):
+            storage_object.append_results(results[i:i + 10])
+        storage_object.close_and_flush()
+
+        parquet_file = pq.ParquetFile(path)
+        self.assertEqual(parquet_file.schema_arrow.names, ['uri', 'ts', 'title', 'text', 'error'])
+        self.assertEqual(parquet_file.metadata.num_rows, 101)
+        # Results are buffered into full row groups, regardless of how small the appended batches are
+        self.assertEqual(parquet_file.metadata.row_group(0).num_rows, 25)
+
+        table = pq.read_table(path, columns=['uri', 'ts'])
+        self.assertEqual(table.num_columns, 2)
+        self.assertEqual(table.column('uri').to_pylist()[:100], [r['uri'] for r in results[:100]])
+        self.assertEqual(table.column('ts').to_pylist()[:100], [r['ts'] for r in results[:100]])
+        self.assertEqual(pq.read_table(path, columns=['error']).column('error').to_pylist()[-1],
+                         'Error processing record: Could not parse')
+
+    def test_coercion(self):
+        path, storage_object = self._storage_object('rt.parquet', 'parquet', RottenTomatoesProcessor.schema)
+        storage_object.append_results([
+            {'uri': 'https://www.rottentomatoes.com/m/a', 'ts': 1, 'criticScore': 85, 'criticNum': '120',
+             'audienceScore': '90%', 'audienceNum': 'n/a'},
+        ])
+        storage_object.close_and_flush()
+
+        row = pq.read_table(path).to_pylist()[0]
+        self.assertEqual(row['ts'], 1.0)
+        self.assertEqual(row['criticScore'], '85')
+        self.assertEqual(row['criticNum'], 120)
+        self.assertEqual(row['audienceScore'], '90%')
+        self.assertIsNone(row['audienceNum'])
+
+    def test_empty(self):
+        path, storage_object = self._storage_object('empty.parquet', 'parquet', NewsProcessor.schema)
+        storage_object.close_and_flush()
+        self.assertEqual(pq.read_table(path).num_rows, 0)
+
+    def test_line_format(self):
+        path, storage_object = self._storage_object('news.txt', 'line')
+        results = [{'uri': f'https://example.com/{i}', 'ts': i} for i in range(10)]
+        storage_object.append_results(results)
+        storage_object.close_and_flush()
+
+        with open(path) as fd:
+            decoded = [json.loads(gzip.decompress(base64.b64decode(line))) for line in fd]
+        self.assertEqual(decoded, results)
+
+    def test_parquet_requires_schema(self):
+        with self.assertRaises(Exception):
+            StorageDescriptor(f'file://{self.tmp.name}/x.parquet', 'parquet', [])
@@ -0,0 +1,133 @@
+import base64
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.storage.partitioned import DEFAULT_PARTITION, PartitionedStorageObject, partition_date
+from src.storage.reader import lookup, read_results
+from src.storage.storage import StorageDescriptor
+
+DAY = 86400
+# 2021-03-01T00:00:00Z
+MARCH_1 = 1614556800
+
+
+def decode_lines(path: str):
+    with open(path) as fd:
+        return [json.loads(gzip.decompress(base64.b64decode(line))) for line in fd]
+
+
+# Stands in for S3Object, "uploading" into a local directory
+class MockS3Object:
+    root = None
+
+    def __init__(self, bucket: str, region: str, path: str, aws_access_key_id: str, aws_secret_access_key: str):
+        self.path = os.path.join(MockS3Object.root, bucket, path)
+
+    def put(self, local_path: str) -> int:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(local_path, self.path)
+        return os.path.getsize(self.path)
+
+
+class PartitionDateTests(unittest.TestCase):
+    def test_dates(self):
+        self.assertEqual(partition_date(MARCH_1), '2021-03-01')
+        self.assertEqual(partition_date(MARCH_1 + DAY - 1), '2021-03-01')
+        self.assertEqual(partition_date(str(MARCH_1 + DAY)), '2021-03-02')
+        # Milliseconds, and values that are not finite or out of the range of dates
+        for ts in [None, 0.0, 'yesterday', '1614556800123', 'nan', float('nan'), float('inf'), 1e20, -1.0]:
+            self.assertEqual(partition_date(ts), DEFAULT_PARTITION)
+
+
+class PartitionedStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        # Three days, interleaved, plus results without a timestamp
+        self.results = [{'uri': f'https://example.com/{i}', 'ts': MARCH_1 + (i % 3) * DAY + i, 'text': 'Text ' * i}
+                        for i in range(30)] + [{'error': 'Error processing record'}]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _manifest(self, path: str):
+        with open(path) as fd:
+            return json.load(fd)
+
+    def test_layout(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = PartitionedStorageObject(StorageDescriptor(f'file://{path}', partitioned=True,
+                                                                    max_open_partitions=2, part_records=4))
+        for i in range(0, len(self.results), 5):
+            storage_object.append_results(self.results[i:i + 5])
+        storage_object.close_and_flush()
+
+        manifest = self._manifest(os.path.join(self.tmp.name, 'news.manifest.json'))
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(manifest['records'], len(self.results))
+        self.assertEqual([p['dt'] for p in manifest['partitions']],
+                         ['2021-03-01', '2021-03-02', '2021-03-03', DEFAULT_PARTITION])
+        self.assertEqual(manifest['partitions'][1]['min_ts'], MARCH_1 + DAY + 1)
+        self.assertEqual(manifest['partitions'][1]['max_ts'], MARCH_1 + DAY + 28)
+        for i, day in enumerate(['2021-03-01', '2021-03-02', '2021-03-03']):
+            directory = os.path.join(self.tmp.name, 'news', f'dt={day}')
+            partition = self._manifest(os.path.join(directory, 'manifest.json'))
+            self.assertTrue(partition['complete'])
+            self.assertEqual(partition['records'], 10)
+            # Parts are numbered on through the suspensions of the partition
+            self.assertEqual([p['path'] for p in partition['parts']],
+                             [os.path.join(directory, f'part-{n:05d}.json') for n in range(len(partition['parts']))])
+            results = []
+            for part in partition['parts']:
+                self.assertLessEqual(part['records'], 4)
+                results += decode_lines(part['path'])
+            self.assertEqual(results, self.results[i:30:3])
+        self.assertFalse(any(name.endswith('.inprogress') for _, _, names in os.walk(self.tmp.name) for name in names))
+
+    def test_bad_timestamps(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = PartitionedStorageObject(StorageDescriptor(f'file://{path}', partitioned=True))
+        bad = [{'uri': 'https://example.com/ms', 'ts': '1614556800123'}, {'uri': 'https://example.com/inf', 'ts': 1e20}]
+        storage_object.append_results(self.results[:3] + bad)
+        storage_object.close_and_flush()
+        manifest = self._manifest(os.path.join(self.tmp.name, 'news.manifest.json'))
+        self.assertEqual([(p['dt'], p['records']) for p in manifest['partitions']],
+                         [('2021-03-01', 1), ('2021-03-02', 1), ('2021-03-03', 1), (DEFAULT_PARTITION, 2)])
+
+    def test_time_range(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = PartitionedStorageObject(StorageDescriptor(f'file://{path}', partitioned=True,
+                                                                    uri_index=True))
+        storage_object.append_results(self.results)
+        storage_object.close_and_flush()
+        manifest = os.path.join(self.tmp.name, 'news.manifest.json')
+        self.assertEqual(len(list(read_results(manifest, workers=1))), len(self.results))
+        self.assertEqual(list(read_results(manifest, workers=1, since=MARCH_1 + DAY, until=MARCH_1 + 2 * DAY)),
+                         self.results[1:30:3])
+        self.assertEqual(len(list(read_results(manifest, workers=1, since=MARCH_1 + DAY))), 20)
+        self.assertEqual(list(read_results(manifest, workers=1, until=MARCH_1)), [])
+        self.assertEqual(lookup(manifest, 'https://example.com/7'), [self.results[7]])
+
+    @patch('src.storage.storage.S3Object', MockS3Object)
+    @patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+    def test_upload(self):
+        MockS3Object.root = os.path.join(self.tmp.name, 's3')
+        storage_object = PartitionedStorageObject(StorageDescriptor('s3://us-east-1.bucket/out/news.json',
+                                                                    partitioned=True, max_open_partitions=1,
+                                                                    upload_threads=2))
+        storage_object.append_results(self.results)
+        storage_object.close_and_flush()
+
+        remote = os.path.join(MockS3Object.root, 'bucket')
+        manifest = self._manifest(os.path.join(remote, 'out', 'news.manifest.json'))
+        self.assertEqual(manifest['partitions'][0]['manifest'], 'out/news/dt=2021-03-01/manifest.json')
+        results = []
+        for p in manifest['partitions']:
+            for part in self._manifest(os.path.join(remote, p['manifest']))['parts']:
+                results += decode_lines(os.path.join(remote, part['path']))
+        self.assertEqual(sorted(results, key=lambda r: r.get('uri', '')),
+                         sorted(self.results, key=lambda r: r.get('uri', '')))
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+from src.processors.news import NewsProcessor
+from src.storage.reader import lookup, read_results, split_chunks, decode_chunk
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+def title_length(payload):
+    return len(payload['title'])
+
+
+class ReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.results = [{'uri': f'https://example.com/{i}', 'ts': float(i), 'title': f'Title {i}',
+                         'text': 'Text ' * (i % 50)} for i in range(200)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name: str, output_format: str = 'line', **kwargs) -> str:
+        path = os.path.join(self.tmp.name, name)
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', output_format, NewsProcessor.schema,
+                                                         **kwargs))
+        storage_object.append_results(self.results)
+        storage_object.close_and_flush()
+        return path
+
+    def test_chunks_are_line_aligned(self):
+        path = self._write('news.json')
+        # Chunk boundaries land in the middle of lines, on line boundaries and inside a single line
+        for chunk_bytes in [1, 7, 100, 333, 4096, os.path.getsize(path)]:
+            chunks = split_chunks(path, chunk_bytes)
+            decoded = []
+            for chunk in chunks:
+                decoded += decode_chunk(chunk)
+            self.assertEqual(decoded, self.results, f'chunk_bytes={chunk_bytes}')
+
+    def test_projection_and_transform(self):
+        path = self._write('news.json')
+        self.assertEqual(list(read_results(path, fields=['uri'], workers=1, chunk_bytes=500)),
+                         [{'uri': r['uri']} for r in self.results])
+        self.assertEqual(list(read_results(f'file://{path}', transform=title_length, workers=1)),
+                         [len(r['title']) for r in self.results])
+
+    def test_manifest_and_parquet(self):
+        self._write('news.json', part_records=30)
+        self.assertEqual(list(read_results(os.path.join(self.tmp.name, 'news.manifest.json'), workers=1)),
+                         self.results)
+        path = self._write('news.parquet', 'parquet')
+        self.assertEqual(list(read_results(path, fields=['uri', 'ts'], workers=1)),
+                         [{'uri': r['uri'], 'ts': r['ts']} for r in self.results])
+
+    def test_workers(self):
+        path = self._write('news.json')
+        self.assertEqual(list(read_results(path, transform=title_length, workers=2, chunk_bytes=1000)),
+                         [len(r['title']) for r in self.results])
+
+    def test_lookup(self):
+        path = self._write('news.json', uri_index=True)
+        self.assertEqual(lookup(path, 'https://example.com/17'), [self.results[17]])
+        self.assertEqual(lookup(f'file://{path}', 'https://example.com/200'), [])
+        # Parts, through the manifest, and a URI stored twice
+        self.results.append(dict(self.results[150], ts=999.0))
+        self._write('rolling.json', part_records=64, uri_index=True)
+        manifest = os.path.join(self.tmp.name, 'rolling.manifest.json')
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'rolling.part-00003.json.uriidx')))
+        self.assertEqual(lookup([manifest], 'https://example.com/150'), [self.results[150], self.results[-1]])
+        self.assertEqual(lookup([manifest], 'https://example.com/199'), [self.results[199]])
+
+    def test_lookup_after_appending(self):
+        first = self.results
+        path = self._write('news.json', uri_index=True)
+        self.results = [dict(r, uri=r['uri'] + '/again') for r in first[:10]]
+        self._write('news.json', uri_index=True)
+        # The earlier run's results are still indexed
+        self.assertEqual(lookup(path, 'https://example.com/17'), [first[17]])
+        self.assertEqual(lookup(path, 'https://example.com/3/again'), [self.results[3]])
+        # ...but there is nothing to keep when the earlier run did not write an index
+        self._write('plain.json')
+        with self.assertRaises(Exception):
+            self._write('plain.json', uri_index=True)
@@ -0,0 +1,163 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.processors.dedup import NearDuplicateFilter
+from src.processors.news import NewsProcessor
+from src.storage.storage import StorageDescriptor, StorageObject
+
+
+def decode_lines(path: str):
+    with open(path) as fd:
+        return [json.loads(gzip.decompress(base64.b64decode(line))) for line in fd]
+
+
+def md5(path: str) -> str:
+    with open(path, 'rb') as fd:
+        return hashlib.md5(fd.read()).hexdigest()
+
+
+# Stands in for S3Object, "uploading" into a local directory
+class MockS3Object:
+    root = None
+    uploads = []
+    lock = threading.Lock()
+
+    def __init__(self, bucket: str, region: str, path: str, aws_access_key_id: str, aws_secret_access_key: str):
+        self.path = os.path.join(MockS3Object.root, bucket, path)
+
+    def put(self, local_path: str) -> int:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        shutil.copyfile(local_path, self.path)
+        with MockS3Object.lock:
+            MockS3Object.uploads.append(self.path)
+        return os.path.getsize(self.path)
+
+
+class RollingStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.results = [{'uri': f'https://example.com/{i}', 'ts': i, 'title': f'Title {i}', 'text': 'Text ' * i}
+                        for i in range(35)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roll_by_records(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', part_records=10))
+        for i in range(0, len(self.results), 5):
+            storage_object.append_results(self.results[i:i + 5])
+            # Completed parts are published (and listed in the manifest) while the run is still going
+            if i == 10:
+                with open(os.path.join(self.tmp.name, 'news.manifest.json')) as fd:
+                    manifest = json.load(fd)
+                self.assertFalse(manifest['complete'])
+                self.assertEqual(len(manifest['parts']), 1)
+                self.assertEqual(decode_lines(manifest['parts'][0]['path']), self.results[:10])
+        storage_object.close_and_flush()
+
+        with open(os.path.join(self.tmp.name, 'news.manifest.json')) as fd:
+            manifest = json.load(fd)
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(manifest['records'], 35)
+        self.assertEqual([p['records'] for p in manifest['parts']], [10, 10, 10, 5])
+        decoded = []
+        for i, part in enumerate(manifest['parts']):
+            self.assertEqual(part['path'], os.path.join(self.tmp.name, f'news.part-{i:05d}.json'))
+            self.assertEqual(part['md5'], md5(part['path']))
+            self.assertEqual(part['bytes'], os.path.getsize(part['path']))
+            decoded += decode_lines(part['path'])
+        self.assertEqual(decoded, self.results)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),
+                         ['news.manifest.json'] + [f'news.part-{i:05d}.json' for i in range(4)])
+
+    def test_roll_by_bytes(self):
+        path = os.path.join(self.tmp.name, 'news.parquet')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', 'parquet', NewsProcessor.schema,
+                                                         part_bytes=500))
+        for r in self.results:
+            storage_object.append_results([r])
+        storage_object.close_and_flush()
+
+        with open(os.path.join(self.tmp.name, 'news.manifest.json')) as fd:
+            manifest = json.load(fd)
+        self.assertGreater(len(manifest['parts']), 1)
+        self.assertEqual(manifest['records'], 35)
+        self.assertTrue(all(p['path'].endswith('.parquet') for p in manifest['parts']))
+
+    def test_no_empty_last_part(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', part_records=5))
+        storage_object.append_results(self.results[:10])
+        storage_object.append_results(self.results[10:15])
+        storage_object.close_and_flush()
+
+        with open(os.path.join(self.tmp.name, 'news.manifest.json')) as fd:
+            manifest = json.load(fd)
+        self.assertEqual([p['records'] for p in manifest['parts']], [5, 5, 5])
+        self.assertFalse(any(name.endswith('.inprogress') for name in os.listdir(self.tmp.name)))
+
+    @patch('src.storage.storage.S3Object', MockS3Object)
+    @patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'test', 'AWS_SECRET_ACCESS_KEY': 'test'})
+    def test_parallel_upload(self):
+        MockS3Object.root = os.path.join(self.tmp.name, 's3')
+        MockS3Object.uploads = []
+        storage_object = StorageObject(StorageDescriptor('s3://us-east-1.bucket/out/news.json', part_records=10,
+                                                         upload_threads=2))
+        storage_object.append_results(self.results)
+        storage_object.append_results(self.results)
+        storage_object.close_and_flush()
+
+        remote = os.path.join(MockS3Object.root, 'bucket', 'out')
+        with open(os.path.join(remote, 'news.manifest.json')) as fd:
+            manifest = json.load(fd)
+        self.assertTrue(manifest['complete'])
+        self.assertEqual([p['path'] for p in manifest['parts']], [f'out/news.part-{i:05d}.json' for i in range(7)])
+        decoded = []
+        for part in manifest['parts']:
+            local = os.path.join(MockS3Object.root, 'bucket', part['path'])
+            self.assertEqual(part['md5'], md5(local))
+            decoded += decode_lines(local)
+        self.assertEqual(decoded, self.results + self.results)
+
+
+class DedupStorageTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        article = ' '.join(f'word{i}' for i in range(300))
+        self.results = [{'uri': 'https://a.com/1', 'ts': 1, 'title': 'A', 'text': article},
+                        {'error': 'Error processing record'},
+                        {'uri': 'https://b.com/1', 'ts': 2, 'title': 'A', 'text': article.replace('word7 ', 'x ')},
+                        {'uri': 'https://c.com/1', 'ts': 3, 'title': 'C', 'text': ''},
+                        {'uri': 'https://d.com/1', 'ts': 4, 'title': 'D', 'text': article[::-1]}]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_drop(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}', dedup=NearDuplicateFilter('text')))
+        self.assertEqual(storage_object.append_results(self.results), 4)
+        storage_object.close_and_flush()
+        self.assertEqual(storage_object.duplicates(), 1)
+        self.assertEqual([r.get('uri') for r in decode_lines(path)],
+                         ['https://a.com/1', None, 'https://c.com/1', 'https://d.com/1'])
+
+    def test_tag(self):
+        path = os.path.join(self.tmp.name, 'news.json')
+        storage_object = StorageObject(StorageDescriptor(f'file://{path}',
+                                                         dedup=NearDuplicateFilter('text', mode='tag')))
+        storage_object.append_results(self.results[:2])
+        storage_object.append_results(self.results[2:])
+        storage_object.close_and_flush()
+        self.assertEqual([r.get('duplicate_of') for r in decode_lines(path) if 'uri' in r],
+                         [None, 'https://a.com/1', None, None])
+        self.assertEqual(storage_object.duplicates(), 1)
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from src.storage.reader import read_range
+from src.storage.uri_index import UriIndexWriter, find
+
+
+class UriIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, entries) -> str:
+        path = os.path.join(self.tmp.name, f'{len(entries)}.uriidx')
+        writer = UriIndexWriter()
+        for uri, offset, length in entries:
+            writer.add(uri, offset, length)
+        writer.write(path)
+        return path
+
+    @patch('src.storage.uri_index.BLOCK_ENTRIES', 16)
+    def test_blocks(self):
+        entries = [(f'https://example.com/{i % 100}', i * 10, 10) for i in range(1000)]
+        path = self._write(entries)
+        for uri in ['https://example.com/0', 'https://example.com/42', 'https://example.com/99']:
+            self.assertEqual(sorted(find(path, uri, read_range)), [(o, l) for u, o, l in entries if u == uri])
+        self.assertEqual(find(path, 'https://example.com/100', read_range), [])
+
+    @patch('src.storage.uri_index.BLOCK_ENTRIES', 4)
+    def test_equal_hashes_span_blocks(self):
+        entries = [('https://example.com/same', i, 1) for i in range(10)] + [('https://example.com/other', 10, 1)]
+        path = self._write(entries)
+        self.assertEqual(find(path, 'https://example.com/same', read_range), [(i, 1) for i in range(10)])
+        self.assertEqual(find(path, 'https://example.com/other', read_range), [(10, 1)])
+
+    def test_empty(self):
+        self.assertEqual(find(self._write([]), 'https://example.com/', read_range), [])
+
+    # A later run appending to the output rewrites its index
+    def test_rewritten(self):
+        path = self._write([])
+        self.assertEqual(find(path, 'https://example.com/', read_range), [])
+        writer = UriIndexWriter()
+        writer.add('https://example.com/', 0, 10)
+        writer.write(path)
+        self.assertEqual(find(path, 'https://example.com/', read_range), [(0, 10)])
+
+    def test_reads(self):
+        reads = []
+
+        def counting_read(path: str, offset: int, length: int) -> bytes:
+            reads.append(length)
+            return read_range(path, offset, length)
+
+        path = self._write([(f'https://example.com/{i}', i, 1) for i in range(50000)])
+        self.assertEqual(find(path, 'https://example.com/123', counting_read), [(123, 1)])
+        self.assertEqual(find(path, 'https://example.com/456', counting_read), [(456, 1)])
+        # The header, then one block, per lookup
+        self.assertEqual(len(reads), 4)
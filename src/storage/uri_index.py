@@ -0,0 +1,130 @@
+import argparse
+import hashlib
+import json
+import struct
+from array import array
+from typing import Callable, List, Tuple
+
+import numpy
+
+# Sidecar index of a line-format output file, mapping the hash of each result's URI to the byte range of its line:
+#
+#   header   magic, version, number of entries, entries per block
+#   fences   the first hash of every block of entries (uint64)
+#   entries  (hash uint64, offset uint64, length uint32), sorted by hash
+#
+# A lookup reads the header and fences, binary searches them for the one block that may hold the hash, and reads that
+# block (20 KB), so it takes two small reads no matter how large the output is.  On S3, these are ranged GETs.  The
+# header is not cached, since a later run appending to the output rewrites the index.
+INDEX_MAGIC = b'URIX'
+INDEX_VERSION = 1
+HEADER = struct.Struct('<4sIQI')
+ENTRY = numpy.dtype([('hash', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+BLOCK_ENTRIES = 1024
+
+# Bytes read for the header, which covers the fences of about 8 million entries
+HEADER_READ_BYTES = 64 * 1024
+
+
+# <name>.<ext> -> <name>.<ext>.uriidx
+def index_path(path: str) -> str:
+    return f'{path}.uriidx'
+
+
+# Stable across processes and runs, unlike hash()
+def uri_hash(uri: str) -> int:
+    return int.from_bytes(hashlib.blake2b(uri.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+# Collects the (hash, offset, length) of every line as it is written, and writes the index once the file is complete.
+# Entries are kept in compact arrays, about 20 bytes each.
+class UriIndexWriter:
+    def __init__(self):
+        self.hashes = array('Q')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    # Starts from the entries of an existing (local) index, e.g. of the lines of earlier runs appending to the same file
+    def load(self, path: str):
+        with open(path, 'rb') as fd:
+            data = fd.read()
+        magic, version, count, block_entries = HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise Exception(f'Not a URI index: {path}')
+        begin = HEADER.size + (count + block_entries - 1) // block_entries * 8
+        entries = numpy.frombuffer(data, dtype=ENTRY, count=count, offset=begin)
+        self.hashes.frombytes(entries['hash'].astype('<u8').tobytes())
+        self.offsets.frombytes(entries['offset'].astype('<u8').tobytes())
+        self.lengths.frombytes(entries['length'].astype('<u4').tobytes())
+
+    def add(self, uri: str, offset: int, length: int):
+        self.hashes.append(uri_hash(uri))
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def write(self, path: str) -> int:
+        entries = numpy.empty(len(self.hashes), dtype=ENTRY)
+        entries['hash'] = numpy.frombuffer(self.hashes, dtype=numpy.uint64)
+        entries['offset'] = numpy.frombuffer(self.offsets, dtype=numpy.uint64)
+        entries['length'] = numpy.frombuffer(self.lengths, dtype=numpy.uint32)
+        entries.sort(order=['hash', 'offset'], kind='stable')
+        fences = entries['hash'][::BLOCK_ENTRIES].astype('<u8')
+        with open(path, 'wb') as fd:
+            fd.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(entries), BLOCK_ENTRIES))
+            fd.write(fences.tobytes())
+            fd.write(entries.tobytes())
+            return fd.tell()
+
+
+# Reads `length` bytes of the file at `path`, from `offset` (see src/storage/reader.py:read_range())
+RangeReader = Callable[[str, int, int], bytes]
+
+
+# Header and fences of an index, as (entries, block entries, fences)
+def _load_header(path: str, read_range: RangeReader) -> Tuple[int, int, numpy.ndarray]:
+    data = read_range(path, 0, HEADER_READ_BYTES)
+    magic, version, count, block_entries = HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        raise Exception(f'Not a URI index: {path}')
+    blocks = (count + block_entries - 1) // block_entries
+    end = HEADER.size + blocks * 8
+    if len(data) < end:
+        data += read_range(path, len(data), end - len(data))
+    return count, block_entries, numpy.frombuffer(data[HEADER.size:end], dtype='<u8')
+
+
+# (offset, length) of the lines of the file whose URI has the same hash as `uri`
+def find(index: str, uri: str, read_range: RangeReader) -> List[Tuple[int, int]]:
+    count, block_entries, fences = _load_header(index, read_range)
+    if count == 0:
+        return []
+    h = numpy.uint64(uri_hash(uri))
+    # Equal hashes may continue past the end of a block, so the search starts at the block before the first fence
+    # that is not smaller
+    first = max(int(numpy.searchsorted(fences, h, side='left')) - 1, 0)
+    last = int(numpy.searchsorted(fences, h, side='right'))
+    begin, end = first * block_entries, min(max(last, first + 1) * block_entries, count)
+    data = read_range(index, HEADER.size + len(fences) * 8 + begin * ENTRY.itemsize, (end - begin) * ENTRY.itemsize)
+    entries = numpy.frombuffer(data, dtype=ENTRY)
+    matches = entries[entries['hash'] == h]
+    return [(int(e['offset']), int(e['length'])) for e in matches]
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Fetch the results stored for a URI from indexed crawl output')
+    parser.add_argument('-u', '--uri', help='URI to look up', required=True)
+    parser.add_argument('paths', help='Output files or manifests (local, file:// or s3://<region>.<bucket>/<path>)',
+                        nargs='+')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    # The reader imports the storage objects, which import this module
+    from src.storage.reader import lookup
+
+    args = parse()
+    for result in lookup(args.paths, args.uri):
+        print(json.dumps(result))
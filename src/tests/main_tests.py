@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.main import do_process, get_processor, preload_modules, worker_pool
+from src.processors.processor import Processor
+from src.processors.types import Record
+
+
+class FailingProcessor(Processor):
+    def __init__(self, results, mutex: threading.Lock):
+        self.results = results
+        super().__init__()
+
+    def process(self, record: Record):
+        raise Exception(f'Cannot process {record.uri}')
+
+
+# 'failing' fails on every record, and 'later' copies records like 'copy'
+def processors(processor: str):
+    if processor == 'failing':
+        return FailingProcessor
+    return get_processor('copy' if processor == 'later' else processor)
+
+
+class DoProcessTests(unittest.TestCase):
+    @patch('src.main.get_processor', processors)
+    def test_failing_processor(self):
+        results = [[], [], []]
+        mutexes = [threading.Lock() for _ in results]
+        semaphore = threading.Semaphore(0)
+        record = Record('https://a.com/', 1.5, 'content')
+        stats = do_process(['copy', 'failing', 'later'], [None] * 3, record, results, mutexes, semaphore)
+        # The processors before and after the failing one keep their results
+        self.assertEqual(results, [[{'uri': 'https://a.com/', 'ts': 1.5, 'content': 'content'}], [],
+                                   [{'uri': 'https://a.com/', 'ts': 1.5, 'content': 'content'}]])
+        self.assertEqual({p: s.get('error', False) for p, s in stats.items()},
+                         {'copy': False, 'failing': True, 'later': False})
+        self.assertTrue(semaphore.acquire(blocking=False))
+
+
+class WorkerStartupTests(unittest.TestCase):
+    def test_lazy_processors(self):
+        # In a fresh interpreter, as a worker would be
+        script = 'import sys, src.main\n' \
+                 'heavy = ["newspaper", "bs4", "boto", "warcio", "requests", "numpy"]\n' \
+                 'assert not any(m in sys.modules for m in heavy), [m for m in heavy if m in sys.modules]\n' \
+                 'src.main.get_processor("copy")\n' \
+                 'assert "src.processors.news" not in sys.modules\n' \
+                 'assert src.main.get_processor("news").__name__ == "NewsProcessor"\n' \
+                 'assert "newspaper" in sys.modules and "src.processors.rottentomatoes" not in sys.modules\n'
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        subprocess.run([sys.executable, '-c', script], cwd=root, check=True)
+        with self.assertRaises(Exception):
+            get_processor('unknown')
+
+    def test_preload_modules(self):
+        self.assertEqual(preload_modules(['news', 'copy', 'news']),
+                         ['src.main', 'src.processors.copy', 'src.processors.news'])
+        with self.assertRaises(Exception):
+            preload_modules(['unknown'])
+
+    def test_worker_pool(self):
+        with self.assertRaises(Exception):
+            worker_pool('fork', 1)
+        with self.assertRaises(Exception):
+            worker_pool('forkserver', 1, ['src.main', 'src.no_such_module'])
+        with worker_pool('forkserver', 2, ['src.main', 'src.processors.copy']) as p:
+            self.assertEqual(p.map(len, ['a', 'bc']), [1, 2])
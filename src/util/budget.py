@@ -0,0 +1,105 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Union
+
+from src.processors.types import Record
+from src.util.transport import SharedRecord
+
+
+# Approximate bytes of buffered results: the length of their string and bytes values
+def result_bytes(results: Iterable[Dict]) -> int:
+    return sum(len(v) for result in results for v in result.values() if isinstance(v, (str, bytes)))
+
+
+# Bytes of a record's content, as held by the ingestor, the pool's task queue (or the shared memory ring) and a worker.
+# The content of CSV records is the row, measured like a result.
+def record_bytes(record: Union[Record, SharedRecord]) -> int:
+    if isinstance(record, SharedRecord):
+        return record.length
+    if isinstance(record.content, dict):
+        return result_bytes([record.content])
+    return len(record.content) if record.content is not None else 0
+
+
+# Passed to a processor in place of the shared results list, counting the bytes of the results it appends
+class MeasuredResults:
+    def __init__(self, results: List[Dict]):
+        self.results = results
+        self.bytes = 0
+
+    def append(self, result: Dict):
+        self.bytes += result_bytes([result])
+        self.results.append(result)
+
+    def __len__(self):
+        return len(self.results)
+
+
+# Memory budget for the bytes in flight: records that were ingested but are not done processing, plus the results
+# buffered until they are flushed.  The ingestor admits each record against the budget, keyed by its URI, and the
+# record's bytes are given back when its task completes (or is abandoned).  Results are accounted for as they are
+# buffered and flushed, and do not wait.  They are normally flushed by the workers (see do_process()), but once the
+# buffered results keep a record out and no record is left in flight to flush them, admit() returns False and the caller
+# is expected to flush them itself (see main()).
+#
+# A record larger than the whole budget is admitted once nothing else is in flight, so it is processed alone rather
+# than never.
+class ByteBudget:
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise Exception(f'Bad memory budget: {limit} bytes')
+        self.limit = limit
+        self.records = 0
+        self.results = 0
+        self.peak = 0
+        self.charges: Dict[str, List[int]] = defaultdict(list)
+        self.changed = threading.Condition()
+
+    @property
+    def used(self) -> int:
+        return self.records + self.results
+
+    def _fits(self, size: int) -> bool:
+        return self.used <= 0 or self.used + size <= self.limit
+
+    # True when only the buffered results are in the way
+    def needs_flush(self) -> bool:
+        return self.results > 0 and self.records <= 0
+
+    # Waits for room for a record of `size` bytes and charges it to `key`.  Returns False (without waiting any longer)
+    # once the buffered results need to be flushed to make room, or after `timeout` seconds.
+    def admit(self, key: str, size: int, timeout: float = None) -> bool:
+        with self.changed:
+            self.changed.wait_for(lambda: self._fits(size) or self.needs_flush(), timeout)
+            if not self._fits(size):
+                return False
+            self.records += size
+            self.charges[key].append(size)
+            self.peak = max(self.peak, self.used)
+            return True
+
+    # The record admitted under `key` is done with
+    def done(self, key: str):
+        with self.changed:
+            charges = self.charges.get(key)
+            if not charges:
+                return
+            self.records -= charges.pop()
+            if not charges:
+                del self.charges[key]
+            self.changed.notify_all()
+
+    def buffer(self, size: int):
+        if size == 0:
+            return
+        with self.changed:
+            self.results += size
+            self.peak = max(self.peak, self.used)
+            self.changed.notify_all()
+
+    def flushed(self, size: int):
+        if size == 0:
+            return
+        with self.changed:
+            self.results -= size
+            self.changed.notify_all()
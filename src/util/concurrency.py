@@ -0,0 +1,160 @@
+import os
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from src.util.logging import Logger
+from src.util.metrics import metrics
+
+logger = Logger()
+
+
+# Hill-climbing search for the concurrency that maximizes throughput, between `minimum` and `maximum`.  Every update
+# moves the value one step: in the same direction while throughput improves, in the other direction once it drops.
+# When throughput is flat, the value goes down if the resource is saturated (more concurrency would only cost memory)
+# and up otherwise.  Steps are a quarter of the current value (at least 1), so large pools move quickly.
+class HillClimber:
+    def __init__(self, minimum: int, maximum: int, initial: int = None, tolerance: float = 0.05):
+        if minimum < 1 or maximum < minimum:
+            raise Exception(f'Bad concurrency bounds: {minimum}..{maximum}')
+        self.minimum = minimum
+        self.maximum = maximum
+        self.value = min(maximum, max(minimum, initial if initial is not None else maximum))
+        self.tolerance = tolerance
+        self.direction = -1
+        self.last: Optional[float] = None
+
+    def update(self, throughput: float, saturated: bool) -> int:
+        if self.last is None or self.last <= 0:
+            self.direction = -1 if saturated else 1
+        else:
+            change = (throughput - self.last) / self.last
+            if change < -self.tolerance:
+                self.direction = -self.direction
+            elif change <= self.tolerance:
+                self.direction = -1 if saturated else 1
+        self.last = throughput
+        step = max(1, self.value // 4)
+        self.value = min(self.maximum, max(self.minimum, self.value + self.direction * step))
+        return self.value
+
+
+# Caps the permits of a semaphore (e.g. the records in flight) below the number it was created with, by holding on to
+# the difference.  Lowering the limit waits (briefly) for permits to come back, so it may take a few calls to get there.
+class SemaphoreLimit:
+    def __init__(self, semaphore: threading.Semaphore, permits: int):
+        self.semaphore = semaphore
+        self.permits = permits
+        self.held = 0
+
+    @property
+    def limit(self) -> int:
+        return self.permits - self.held
+
+    def set(self, limit: int, timeout: float = 0.1):
+        target = self.permits - limit
+        while self.held < target and self.semaphore.acquire(timeout=timeout):
+            self.held += 1
+        while self.held > target:
+            self.semaphore.release()
+            self.held -= 1
+
+    # Gives back every permit, e.g. before draining the records in flight
+    def release(self):
+        self.set(self.permits)
+
+
+# Grows a multiprocessing pool to `processes` workers.  Pool has no public way to resize, but its worker handler thread
+# keeps starting workers until there are _processes of them, so raising that is enough.  Pools never shrink: a lower
+# limit on the records in flight leaves the extra workers idle.
+def grow_pool(pool, processes: int):
+    if processes > pool._processes:
+        pool._processes = processes
+
+
+def pool_size(pool) -> int:
+    return pool._processes
+
+
+# Busy fraction of all CPUs since the previous call, from /proc/stat (or the load average where there is none)
+class CPUSampler:
+    def __init__(self):
+        self.last = self._times()
+
+    @staticmethod
+    def _times() -> Optional[Tuple[int, int]]:
+        try:
+            with open('/proc/stat') as fd:
+                fields = [int(v) for v in fd.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        # idle and iowait
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+        return sum(fields), idle
+
+    def sample(self) -> float:
+        current = self._times()
+        if current is None or self.last is None:
+            return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+        total, idle = current[0] - self.last[0], current[1] - self.last[1]
+        self.last = current
+        return 1.0 - idle / total if total > 0 else 0.0
+
+
+# A concurrency setting under control: `measure` returns the throughput and saturation since the previous call, and
+# `apply` puts the climber's new value into effect
+class Control:
+    def __init__(self, name: str, climber: HillClimber, measure: Callable[[], Tuple[float, bool]],
+                 apply: Callable[[int], None]):
+        self.name = name
+        self.climber = climber
+        self.measure = measure
+        self.apply = apply
+
+
+# Adjusts every control every `interval` seconds and exports its value as the concurrency{control=<name>} gauge
+class ConcurrencyController:
+    def __init__(self, controls: List[Control], interval: float = 10.0):
+        self.controls = controls
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        for control in controls:
+            metrics.gauge('concurrency', lambda c=control: c.climber.value, control=control.name)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def step(self):
+        for control in self.controls:
+            throughput, saturated = control.measure()
+            value = control.climber.value
+            control.apply(control.climber.update(throughput, saturated))
+            if control.climber.value != value:
+                logger.info(f'{control.name} concurrency {value} -> {control.climber.value} '
+                            f'(throughput={throughput:.1f}/s, saturated={saturated})')
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                logger.error(f'Concurrency controller step failed: {str(e)}')
+
+
+# Rate of a counter (or of a histogram's sum) since the previous call
+class Rate:
+    def __init__(self, value: Callable[[], float], clock: Callable[[], float]):
+        self.value = value
+        self.clock = clock
+        self.last = value(), clock()
+
+    def __call__(self) -> float:
+        value, now = self.value(), self.clock()
+        elapsed = now - self.last[1]
+        rate = (value - self.last[0]) / elapsed if elapsed > 0 else 0.0
+        self.last = value, now
+        return rate
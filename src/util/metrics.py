@@ -0,0 +1,224 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Callable, Optional
+
+from src.util.logging import Logger
+
+logger = Logger()
+
+# Upper bounds (in seconds) of the latency histogram buckets.  Fixed buckets keep observe() cheap and make it trivial
+# to export Prometheus histograms.
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def metric_key(name: str, labels: Dict[str, str]) -> MetricKey:
+    if not labels:
+        return name, ()
+    return name, tuple(sorted(labels.items()))
+
+
+def format_labels(labels: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    all_labels = labels + extra
+    if len(all_labels) == 0:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in all_labels) + '}'
+
+
+class Histogram:
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    # Estimate a quantile by interpolating within the bucket that contains it
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if seen + c >= rank and c > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': round(self.quantile(0.5), 6),
+            'p99': round(self.quantile(0.99), 6)
+        }
+
+
+# Process-local registry of counters, gauges and latency histograms.  Updates only take an uncontended lock, so it is
+# cheap enough to leave on in production.  Pool workers do not update it directly; they return their measurements
+# with the task result and the parent records them (see src/main.py:record_task_stats).
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[MetricKey, float] = {}
+        self.gauges: Dict[MetricKey, float] = {}
+        self.gauge_fns: Dict[MetricKey, Callable[[], float]] = {}
+        self.histograms: Dict[MetricKey, Histogram] = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        with self.lock:
+            self.gauges[metric_key(name, labels)] = value
+
+    # Registers a gauge that is sampled whenever the metrics are exported (e.g. a queue length)
+    def gauge(self, name: str, fn: Callable[[], float], **labels):
+        with self.lock:
+            self.gauge_fns[metric_key(name, labels)] = fn
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        begin = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - begin, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        with self.lock:
+            return self.counters.get(metric_key(name, labels), 0)
+
+    # Total of the values observed by a histogram (e.g. the seconds spent waiting)
+    def histogram_sum(self, name: str, **labels) -> float:
+        with self.lock:
+            histogram = self.histograms.get(metric_key(name, labels))
+            return histogram.sum if histogram is not None else 0.0
+
+    def _sample_gauges(self) -> Dict[MetricKey, float]:
+        with self.lock:
+            gauges = dict(self.gauges)
+            gauge_fns = dict(self.gauge_fns)
+        for key, fn in gauge_fns.items():
+            try:
+                gauges[key] = fn()
+            except Exception as e:
+                logger.warning(f'Could not sample gauge {key[0]}: {str(e)}')
+        return gauges
+
+    # Prometheus text exposition format
+    def render_prometheus(self, prefix: str = 'crawl_') -> str:
+        gauges = self._sample_gauges()
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f'{prefix}{name}{format_labels(labels)} {value}')
+            for (name, labels), value in sorted(gauges.items()):
+                lines.append(f'{prefix}{name}{format_labels(labels)} {value}')
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + [float('inf')], histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else str(bound)
+                    lines.append(f'{prefix}{name}_bucket{format_labels(labels, (("le", le),))} {cumulative}')
+                lines.append(f'{prefix}{name}_sum{format_labels(labels)} {histogram.sum}')
+                lines.append(f'{prefix}{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self) -> Dict:
+        gauges = self._sample_gauges()
+
+        def flat(key: MetricKey) -> str:
+            return key[0] + format_labels(key[1])
+
+        with self.lock:
+            return {
+                'uptime': round(time.time() - self.started, 3),
+                'counters': {flat(k): v for k, v in sorted(self.counters.items())},
+                'gauges': {flat(k): v for k, v in sorted(gauges.items())},
+                'latency': {flat(k): h.summary() for k, h in sorted(self.histograms.items())}
+            }
+
+    def stats_line(self) -> str:
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+
+metrics = Metrics()
+
+
+def _metrics_handler(registry: Metrics):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body = registry.render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            elif self.path == '/stats':
+                body = registry.stats_line().encode('utf-8')
+                content_type = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return MetricsHandler
+
+
+# Serves /metrics (Prometheus) and /stats (JSON) and periodically logs a JSON stats line
+class MetricsReporter:
+    def __init__(self, registry: Metrics = metrics, port: Optional[int] = None, interval: Optional[float] = 60,
+                 host: str = '127.0.0.1'):
+        self.registry = registry
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.server = None
+        self.threads = []
+        if port is not None:
+            self.server = ThreadingHTTPServer((host, port), _metrics_handler(registry))
+            self.threads.append(threading.Thread(target=self.server.serve_forever, daemon=True))
+            logger.info(f'Serving metrics on http://{host}:{self.server.server_port}/metrics')
+        if interval is not None and interval > 0:
+            self.threads.append(threading.Thread(target=self._log_stats, daemon=True))
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def _log_stats(self):
+        while not self.stopped.wait(self.interval):
+            logger.info(f'stats {self.registry.stats_line()}')
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        logger.info(f'stats {self.registry.stats_line()}')
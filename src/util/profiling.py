@@ -0,0 +1,199 @@
+import argparse
+import cProfile
+import glob
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from src.util.logging import Logger
+
+logger = Logger()
+
+
+# Per-process profiling state.  cProfile only sees the thread that enabled it, so every thread that enters a
+# profile_section() gets its own profiler, labelled with the name of the first section the thread entered (e.g.
+# ingestor, downloader or worker).  Profiles are dumped to <directory>/<name>-<pid>-<thread>.prof, and tracemalloc
+# snapshots (optional) to <directory>/<role>-<pid>.tracemalloc, to be merged by merge_profiles().
+class ProfileSession:
+    def __init__(self, directory: str, role: str, memory: bool = False, dump_interval: float = 10.0):
+        self.directory = directory
+        self.role = role
+        self.memory = memory
+        self.dump_interval = dump_interval
+        self.lock = threading.Lock()
+        self.profilers: Dict[str, cProfile.Profile] = {}
+        self.names: Dict[str, str] = {}
+        self.depths: Dict[str, int] = {}
+        self.last_dump = time.time()
+        os.makedirs(directory, exist_ok=True)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start(16)
+
+    def _thread_key(self) -> str:
+        thread = threading.current_thread()
+        return f'{thread.name}.{thread.ident}'
+
+    def _profiler(self, key: str, name: str) -> cProfile.Profile:
+        with self.lock:
+            profiler = self.profilers.get(key)
+            if profiler is None:
+                profiler = self.profilers[key] = cProfile.Profile()
+                self.names[key] = name
+                self.depths[key] = 0
+            return profiler
+
+    @contextmanager
+    def section(self, name: str):
+        key = self._thread_key()
+        profiler = self._profiler(key, name)
+        # Nested sections in the same thread just keep the outer one running
+        self.depths[key] += 1
+        if self.depths[key] == 1:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            self.depths[key] -= 1
+            if self.depths[key] == 0:
+                profiler.disable()
+                if time.time() - self.last_dump > self.dump_interval:
+                    self.dump(key)
+
+    def _path(self, key: str) -> str:
+        thread = key.replace('/', '_').replace(' ', '_').replace('-', '_')
+        return os.path.join(self.directory, f'{self.names[key]}-{os.getpid()}-{thread}.prof')
+
+    # Dumps the given thread's profile (or every idle profile), plus a memory snapshot.  A profiler can only be
+    # dumped while it is disabled, so running sections are skipped.
+    def dump(self, key: str = None):
+        self.last_dump = time.time()
+        with self.lock:
+            keys = [key] if key is not None else list(self.profilers.keys())
+            profilers = [(k, self.profilers[k]) for k in keys if self.depths.get(k, 0) == 0]
+        for k, profiler in profilers:
+            try:
+                profiler.dump_stats(self._path(k))
+            except Exception as e:
+                logger.warning(f'Could not dump profile for {k}: {str(e)}')
+        if self.memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            snapshot.dump(os.path.join(self.directory, f'{self.role}-{os.getpid()}.tracemalloc'))
+
+
+session: Optional[ProfileSession] = None
+
+
+def start_profiling(directory: str, role: str, memory: bool = False) -> ProfileSession:
+    global session
+    session = ProfileSession(directory, role, memory)
+    return session
+
+
+# Pool initializer for profiled workers.  Workers that exit on their own (e.g. when recycled) dump their profile on
+# the way out; at the end of a run, the parent asks the remaining workers to dump (see dump_worker_profile).
+def start_worker_profiling(directory: str, memory: bool = False):
+    from multiprocessing.util import Finalize
+    start_profiling(directory, 'worker', memory)
+    Finalize(session, session.dump, exitpriority=100)
+
+
+# Profiles the enclosed block when profiling is enabled, otherwise does nothing
+@contextmanager
+def profile_section(name: str):
+    if session is None:
+        yield
+        return
+    with session.section(name):
+        yield
+
+
+# Wraps a function (e.g. a thread target), so every call runs in a profile_section()
+def profiled(fn, name: str):
+    def _profiled(*args, **kwargs):
+        with profile_section(name):
+            return fn(*args, **kwargs)
+
+    return _profiled
+
+
+# Pool task that dumps the calling worker's profile.  Each task waits on the barrier, so the N tasks submitted for
+# N workers end up in N different workers.
+def dump_worker_profile(barrier: threading.Barrier, timeout: float = 30.0):
+    try:
+        barrier.wait(timeout)
+    except threading.BrokenBarrierError:
+        pass
+    if session is not None:
+        session.dump()
+
+
+def stop_profiling():
+    global session
+    if session is not None:
+        session.dump()
+        session = None
+
+
+def _merge_memory(paths: List[str], top: int) -> List[str]:
+    totals: Dict[Tuple[str, int], List[int]] = {}
+    for path in paths:
+        snapshot = tracemalloc.Snapshot.load(path)
+        for stat in snapshot.statistics('lineno'):
+            frame = stat.traceback[0]
+            entry = totals.setdefault((frame.filename, frame.lineno), [0, 0])
+            entry[0] += stat.size
+            entry[1] += stat.count
+    lines = [f'Live allocations across {len(paths)} processes (top {top} by size):']
+    for (filename, lineno), (size, count) in sorted(totals.items(), key=lambda x: x[1][0], reverse=True)[:top]:
+        lines.append(f'{size / 1024:12.1f} KiB {count:10d} blocks  {filename}:{lineno}')
+    return lines
+
+
+def _format_stats(paths: List[str], title: str, top: int) -> List[str]:
+    out = io.StringIO()
+    stats = pstats.Stats(*paths, stream=out)
+    stats.sort_stats('cumulative').print_stats(top)
+    return [f'==== {title} ({len(paths)} profiles) ====', out.getvalue()]
+
+
+# Merges every profile in the directory into a single report, overall and per section name, sorted by cumulative
+# time, followed by the merged memory snapshots
+def merge_profiles(directory: str, top: int = 40) -> str:
+    profiles = sorted(glob.glob(os.path.join(directory, '*.prof')))
+    if len(profiles) == 0:
+        return f'No profiles found in {directory}'
+    lines = _format_stats(profiles, 'all processes and threads', top)
+    names: Dict[str, List[str]] = {}
+    for path in profiles:
+        names.setdefault(os.path.basename(path).split('-')[0], []).append(path)
+    for name in sorted(names):
+        lines += _format_stats(names[name], name, top)
+    snapshots = sorted(glob.glob(os.path.join(directory, '*.tracemalloc')))
+    if len(snapshots) > 0:
+        lines += _merge_memory(snapshots, top)
+    return '\n'.join(lines)
+
+
+def write_report(directory: str, top: int = 40) -> str:
+    report_path = os.path.join(directory, 'report.txt')
+    with open(report_path, 'w') as fd:
+        fd.write(merge_profiles(directory, top))
+    return report_path
+
+
+def parse():
+    parser = argparse.ArgumentParser(description='Merge the profiles written by main.py --profile into one report')
+    parser.add_argument('-d', '--directory', help='Profile directory', required=True)
+    parser.add_argument('-n', '--top', help='Number of entries to show per section (default=40)', type=int,
+                        default=40)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse()
+    print(merge_profiles(args.directory, args.top))
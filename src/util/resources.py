@@ -0,0 +1,47 @@
+import os
+import resource
+import sys
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+# Current resident set size in bytes.  Uses /proc when available (Linux) and falls back to the peak RSS reported
+# by getrusage, which is the best we can do elsewhere.
+def current_rss(pid: int = None) -> int:
+    path = f'/proc/{pid if pid is not None else "self"}/statm'
+    try:
+        with open(path) as fd:
+            return int(fd.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if pid is not None:
+            return 0
+        return peak_rss()
+
+
+# Peak resident set size of this process in bytes
+def peak_rss() -> int:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KB everywhere else
+    if sys.platform == 'darwin':
+        return maxrss
+    return maxrss * 1024
+
+
+# Allocations from this size up are mmapped by glibc, and unmapped as soon as they are freed
+MMAP_THRESHOLD = 128 * 1024
+# mallopt() parameter
+M_MMAP_THRESHOLD = -3
+
+
+# glibc raises its mmap threshold (up to 32 MB) every time a mapped block is freed, after which large record and result
+# strings come from the heap, and freed ones tend to stay resident.  Pinning the threshold keeps the RSS of processes
+# that pass large payloads around close to what they hold.  Applies to this process, the processes it forks, and
+# (through the environment) the processes it spawns.
+def return_freed_memory():
+    os.environ.setdefault('MALLOC_MMAP_THRESHOLD_', str(MMAP_THRESHOLD))
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').mallopt(M_MMAP_THRESHOLD, MMAP_THRESHOLD)
+    except (OSError, AttributeError):
+        # Not glibc
+        pass
@@ -0,0 +1,228 @@
+import heapq
+import zlib
+from collections import deque
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+
+import numpy
+
+
+# Space-Saving heavy-hitters summary (Metwally et al.), which monitors at most `capacity` items, so memory is fixed no
+# matter how many distinct items there are.  Every monitored item's count overestimates its true count by at most
+# its error, and the error is never more than total / capacity.  Any item that occurs more than total / capacity times
+# is guaranteed to be monitored.
+#
+# The minimum is tracked with a lazily updated heap: increments do not touch the heap, and stale entries are
+# refreshed when they reach the top.
+class SpaceSaving:
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise Exception(f'Capacity must be positive: {capacity}')
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.errors: Dict[Hashable, int] = {}
+        self.heap: List[Tuple[int, Hashable]] = []
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def offer(self, item: Hashable, count: int = 1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (count, item))
+            return
+        minimum, evicted = self._pop_min()
+        del self.counts[evicted]
+        del self.errors[evicted]
+        self.counts[item] = minimum + count
+        self.errors[item] = minimum
+        heapq.heappush(self.heap, (minimum + count, item))
+
+    def _pop_min(self) -> Tuple[int, Hashable]:
+        while True:
+            count, item = heapq.heappop(self.heap)
+            current = self.counts.get(item)
+            if current == count:
+                return count, item
+            if current is not None:
+                heapq.heappush(self.heap, (current, item))
+
+    def _rebuild_heap(self):
+        self.heap = [(c, i) for i, c in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    # Smallest monitored count, which bounds the count of every item that is not monitored
+    def min_count(self) -> int:
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def error_bound(self) -> float:
+        return self.total / self.capacity
+
+    # Merges another summary into this one (Agarwal et al., "Mergeable Summaries").  Items missing from a full summary
+    # may have occurred up to its minimum count, which is added to both their count and error.  The bound stays
+    # total / capacity for the merged total.
+    def merge(self, other: 'SpaceSaving') -> 'SpaceSaving':
+        self_min, other_min = self.min_count(), other.min_count()
+        counts, errors = {}, {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, self_min) + other.counts.get(item, other_min)
+            errors[item] = self.errors.get(item, self_min) + other.errors.get(item, other_min)
+        keep = heapq.nlargest(self.capacity, counts.items(), key=lambda x: x[1])
+        self.counts = {item: count for item, count in keep}
+        self.errors = {item: errors[item] for item in self.counts}
+        self.total += other.total
+        self._rebuild_heap()
+        return self
+
+    # The k items with the largest counts, as (item, count, error), where count - error <= true count <= count
+    def top(self, k: int = None) -> List[Tuple[Hashable, int, int]]:
+        k = k if k is not None else len(self.counts)
+        return [(item, count, self.errors[item])
+                for item, count in heapq.nlargest(k, self.counts.items(), key=lambda x: (x[1], x[0]))]
+
+
+# Shingles hashed at a time, which bounds the temporary (shingles x permutations) matrix
+MINHASH_CHUNK = 4096
+
+
+# MinHash signatures (Broder) of the word shingles of a text: the fraction of positions where two signatures agree
+# estimates the Jaccard similarity of the two texts' shingle sets.  Words are hashed with CRC32 rather than hash(),
+# which is salted per process, so signatures computed by different processes agree.  Each position hashes the
+# shingles with its own multiply-add-shift function, (a * x + b) mod 2^64 >> 32 with an odd `a`, which is a few
+# times faster in numpy than arithmetic modulo a prime.
+class MinHash:
+    def __init__(self, num_perm: int = 128, shingle_words: int = 5, seed: int = 1):
+        rng = numpy.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.a = rng.randint(0, 1 << 63, size=num_perm, dtype=numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+        self.b = rng.randint(0, 1 << 63, size=num_perm, dtype=numpy.uint64)
+
+    # Distinct hashes of the runs of `shingle_words` consecutive words (or of all of them, in a shorter text)
+    def shingles(self, text: str) -> numpy.ndarray:
+        words = text.lower().split()
+        if len(words) == 0:
+            return numpy.zeros(0, dtype=numpy.uint64)
+        hashes = numpy.fromiter((zlib.crc32(w.encode('utf-8')) for w in words), dtype=numpy.uint64, count=len(words))
+        k = min(self.shingle_words, len(words))
+        n = len(words) - k + 1
+        shingles = numpy.zeros(n, dtype=numpy.uint64)
+        for i in range(k):
+            shingles = (shingles * numpy.uint64(1000003) + hashes[i:i + n]) & numpy.uint64(0xFFFFFFFF)
+        return numpy.unique(shingles)
+
+    def signature(self, text: str) -> numpy.ndarray:
+        signature = numpy.full(self.num_perm, 1 << 32, dtype=numpy.uint64)
+        shingles = self.shingles(text)
+        for i in range(0, len(shingles), MINHASH_CHUNK):
+            # In place, to spare the temporaries
+            hashed = numpy.multiply(shingles[i:i + MINHASH_CHUNK, None], self.a)
+            hashed += self.b
+            hashed >>= numpy.uint64(32)
+            numpy.minimum(signature, hashed.min(axis=0), out=signature)
+        return signature.astype(numpy.uint32)
+
+
+def jaccard(a: numpy.ndarray, b: numpy.ndarray) -> float:
+    return float(numpy.count_nonzero(a == b)) / len(a)
+
+
+# Integral of y over x by the trapezoidal rule (numpy.trapz is gone from NumPy 2, and numpy.trapezoid is new in it)
+def trapezoid(y: numpy.ndarray, x: numpy.ndarray) -> float:
+    return float(((y[1:] + y[:-1]) * numpy.diff(x)).sum() / 2)
+
+
+# Bands and rows per band of an LSH index over `num_perm` MinHash positions, minimizing the weighted probabilities of
+# false positives below the threshold and false negatives above it.  Two signatures with similarity s share a band with
+# probability 1 - (1 - s^rows)^bands.  False negatives are weighted more by default, since the candidates that share a
+# band are checked against the threshold anyway, and a missed duplicate is never found.
+def lsh_bands(threshold: float, num_perm: int, false_negative_weight: float = 0.9) -> Tuple[int, int]:
+    below = numpy.linspace(0.0, threshold, 200)
+    above = numpy.linspace(threshold, 1.0, 200)
+    best, best_error = (1, num_perm), None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            false_positive = trapezoid(1 - (1 - below ** rows) ** bands, below)
+            false_negative = trapezoid((1 - above ** rows) ** bands, above)
+            error = (1 - false_negative_weight) * false_positive + false_negative_weight * false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+
+# Signatures remembered per LSH bucket, the oldest dropped first once it is full
+LSH_BUCKET_SIZE = 16
+
+
+# Streaming near-duplicate index over MinHash signatures, with LSH banding: a signature is compared only with the ones
+# it shares a band with, and is a duplicate if their estimated similarity reaches the threshold.  At most `capacity`
+# signatures are kept, and the oldest are forgotten first, so memory is fixed no matter how long the stream is.  Each
+# band bucket keeps the latest `bucket_size` signatures in it, so a bucket shared by many dissimilar texts (e.g. the
+# same boilerplate) cannot make every check expensive; an older signature that shares only that band with a new one
+# is then missed.
+class LSHIndex:
+    def __init__(self, threshold: float, num_perm: int = 128, capacity: int = 100000,
+                 bucket_size: int = LSH_BUCKET_SIZE):
+        if not 0 < threshold <= 1:
+            raise Exception(f'Similarity threshold must be in (0, 1]: {threshold}')
+        if capacity < 1:
+            raise Exception(f'Capacity must be positive: {capacity}')
+        self.threshold = threshold
+        self.capacity = capacity
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self.bucket_size = bucket_size
+        # Band hash -> ids of the latest signatures in that bucket, oldest first, for each band
+        self.tables: List[Dict[int, Deque[int]]] = [{} for _ in range(self.bands)]
+        self.entries: Dict[int, Tuple[Hashable, numpy.ndarray]] = {}
+        self.order: Deque[int] = deque()
+        self.next_id = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _band_hashes(self, signature: numpy.ndarray) -> List[int]:
+        return [hash(signature[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    # Returns the key of an earlier near-duplicate of the signature, or adds it under `key` if there is none
+    def offer(self, key: Hashable, signature: numpy.ndarray) -> Optional[Hashable]:
+        band_hashes = self._band_hashes(signature)
+        candidates = {candidate for table, h in zip(self.tables, band_hashes) for candidate in table.get(h, ())}
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            other_key, other = self.entries[candidate]
+            similarity = jaccard(signature, other)
+            if similarity >= best_similarity:
+                best, best_similarity = other_key, similarity
+        if best is not None:
+            return best
+        if len(self.entries) >= self.capacity:
+            self._evict()
+        entry = self.next_id
+        self.next_id += 1
+        for table, h in zip(self.tables, band_hashes):
+            bucket = table.get(h)
+            if bucket is None:
+                bucket = table[h] = deque(maxlen=self.bucket_size)
+            bucket.append(entry)
+        self.entries[entry] = (key, signature)
+        self.order.append(entry)
+        return None
+
+    def _evict(self):
+        entry = self.order.popleft()
+        _, signature = self.entries.pop(entry)
+        # Recomputed rather than kept, which would take about as much memory as the signature.  Ids are added in order
+        # and the oldest is evicted first, so it is at the front of its buckets (unless a full bucket dropped it).
+        for table, h in zip(self.tables, self._band_hashes(signature)):
+            bucket = table.get(h)
+            if bucket is not None and bucket[0] == entry:
+                bucket.popleft()
+                if len(bucket) == 0:
+                    del table[h]
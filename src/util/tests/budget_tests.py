@@ -0,0 +1,142 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from multiprocessing import get_context
+from multiprocessing.managers import SyncManager
+
+from src.main import account_recycled, do_process
+from src.processors.types import Record
+from src.storage.storage import StorageDescriptor, StorageObject
+from src.util.budget import ByteBudget, MeasuredResults, record_bytes, result_bytes
+
+
+class StorageManager(SyncManager):
+    pass
+
+
+StorageManager.register('StorageObject', StorageObject)
+
+
+class ByteBudgetTests(unittest.TestCase):
+    def test_admit(self):
+        budget = ByteBudget(100)
+        self.assertTrue(budget.admit('a', 60))
+        self.assertFalse(budget.admit('b', 60, timeout=0.01))
+        self.assertTrue(budget.admit('b', 40))
+        self.assertEqual((budget.used, budget.peak), (100, 100))
+        budget.done('a')
+        self.assertTrue(budget.admit('c', 60, timeout=0.01))
+        # Unknown (or already abandoned) records are ignored
+        budget.done('d')
+        self.assertEqual(budget.used, 100)
+
+    def test_oversized_record_runs_alone(self):
+        budget = ByteBudget(100)
+        self.assertTrue(budget.admit('a', 10))
+        admitted = []
+        thread = threading.Thread(target=lambda: admitted.append(budget.admit('huge', 1000)))
+        thread.start()
+        thread.join(0.05)
+        self.assertEqual(admitted, [])
+        budget.done('a')
+        thread.join(1)
+        self.assertEqual(admitted, [True])
+        self.assertEqual(budget.used, 1000)
+
+    def test_flush_makes_room(self):
+        budget = ByteBudget(100)
+        budget.admit('a', 30)
+        budget.buffer(80)
+        self.assertFalse(budget.admit('b', 30, timeout=0.01))
+        # With no record left in flight, flushing the results is the only way in, so admit() does not wait
+        budget.done('a')
+        self.assertFalse(budget.admit('b', 30))
+        budget.flushed(80)
+        self.assertTrue(budget.admit('b', 30))
+        self.assertEqual((budget.records, budget.results, budget.peak), (30, 0, 110))
+
+    def test_duplicate_keys(self):
+        budget = ByteBudget(100)
+        budget.admit('a', 10)
+        budget.admit('a', 20)
+        budget.done('a')
+        budget.done('a')
+        self.assertEqual(budget.used, 0)
+
+
+class RecycledWorkersTests(unittest.TestCase):
+    # With an RSS limit of 0 MB, every worker recycles itself after its record, and neither callback fires
+    def test_records_come_back(self):
+        budget = ByteBudget(10000)
+        called = []
+        flushed = 0
+        with SyncManager() as manager, get_context('spawn').Pool(1) as p:
+            recycled, results, mutexes = manager.list(), [manager.list()], [manager.Lock()]
+            semaphore = manager.Semaphore(1)
+            deadline = time.time() + 30
+            for i in range(4):
+                record = Record(f'https://a.com/{i}', 0, 'x' * 4000)
+                # Later records only fit once earlier ones have been given back (and their results flushed), as in
+                # main()
+                while not budget.admit(record.uri, record_bytes(record), timeout=0.05):
+                    if account_recycled(recycled, budget) == 0 and budget.needs_flush():
+                        flushed += budget.results
+                        budget.flushed(budget.results)
+                    self.assertLess(time.time(), deadline)
+                semaphore.acquire()
+                p.apply_async(do_process, (['copy'], [None], record, results, mutexes, semaphore, None, None, 0,
+                                           False, recycled), callback=called.append, error_callback=called.append)
+            while budget.records > 0 and time.time() < deadline:
+                account_recycled(recycled, budget)
+                time.sleep(0.01)
+            buffered = result_bytes(results[0])
+        self.assertEqual(called, [])
+        self.assertEqual(budget.records, 0)
+        self.assertEqual(budget.results + flushed, buffered)
+        self.assertEqual(buffered, 4 * (4000 + len('https://a.com/0')))
+
+    # Workers that flush the results before recycling give back the flushed bytes too
+    def test_flushed_records_come_back(self):
+        budget = ByteBudget(10000)
+        called = []
+        with tempfile.TemporaryDirectory() as tmp, StorageManager() as manager, get_context('spawn').Pool(1) as p:
+            path = os.path.join(tmp, 'copy.json')
+            storage_object = manager.StorageObject(StorageDescriptor(f'file://{path}'))
+            recycled, results, mutexes = manager.list(), [manager.list()], [manager.Lock()]
+            semaphore = manager.Semaphore(1)
+            deadline = time.time() + 30
+            for i in range(4):
+                record = Record(f'https://a.com/{i}', 0, 'x' * 4000)
+                while not budget.admit(record.uri, record_bytes(record), timeout=0.05):
+                    account_recycled(recycled, budget)
+                    self.assertLess(time.time(), deadline)
+                semaphore.acquire()
+                p.apply_async(do_process, (['copy'], [storage_object], record, results, mutexes, semaphore, None,
+                                           None, 0, True, recycled), callback=called.append,
+                              error_callback=called.append)
+            while budget.records > 0 and time.time() < deadline:
+                account_recycled(recycled, budget)
+                time.sleep(0.01)
+            storage_object.close_and_flush()
+            with open(path) as fd:
+                lines = fd.readlines()
+        self.assertEqual(called, [])
+        self.assertEqual((budget.records, budget.results), (0, 0))
+        self.assertEqual(len(lines), 4)
+
+
+class SizesTests(unittest.TestCase):
+    def test_sizes(self):
+        self.assertEqual(record_bytes(Record('https://a.com/', 0, 'x' * 10)), 10)
+        # A CSV row
+        row = {'uri': 'https://a.com/', 'ts': 0, 'title': 'x' * 10}
+        self.assertEqual(record_bytes(Record('https://a.com/', 0, row)), 24)
+        self.assertEqual(result_bytes([{'uri': 'abc', 'ts': 1.5, 'text': 'hello'}, {'error': 'e'}]), 9)
+        results = []
+        measured = MeasuredResults(results)
+        measured.append({'uri': 'abc', 'content': 'x' * 7})
+        self.assertEqual((len(measured), measured.bytes), (1, 10))
+        self.assertEqual(results, [{'uri': 'abc', 'content': 'x' * 7}])
+
@@ -0,0 +1,56 @@
+import threading
+import unittest
+
+from src.util.concurrency import HillClimber, Rate, SemaphoreLimit
+
+
+class HillClimberTests(unittest.TestCase):
+    # Throughput grows with concurrency up to `best` and falls off after, and the CPUs are saturated from `best` on
+    def _climb(self, climber: HillClimber, best: int, steps: int = 40):
+        values = []
+        for _ in range(steps):
+            value = climber.value
+            throughput = 100.0 * min(value, best) - 20.0 * max(0, value - best)
+            values.append(climber.update(throughput, value >= best))
+        return values
+
+    def test_finds_the_knee(self):
+        values = self._climb(HillClimber(1, 64, initial=1), best=12)
+        self.assertTrue(all(8 <= v <= 16 for v in values[-10:]), values)
+        values = self._climb(HillClimber(1, 64), best=12)
+        self.assertTrue(all(8 <= v <= 16 for v in values[-10:]), values)
+
+    def test_bounds(self):
+        climber = HillClimber(2, 6, initial=4)
+        self.assertEqual(max(self._climb(climber, best=100)), 6)
+        climber = HillClimber(2, 6, initial=4)
+        for _ in range(10):
+            climber.update(0.0, True)
+        self.assertEqual(climber.value, 2)
+        with self.assertRaises(Exception):
+            HillClimber(0, 4)
+
+
+class SemaphoreLimitTests(unittest.TestCase):
+    def test_limit(self):
+        semaphore = threading.Semaphore(8)
+        limit = SemaphoreLimit(semaphore, 8)
+        limit.set(3)
+        self.assertEqual(limit.limit, 3)
+        self.assertEqual(sum(1 for _ in range(8) if semaphore.acquire(blocking=False)), 3)
+        # One record comes back, and lowering the limit can only take what is free
+        semaphore.release()
+        limit.set(1, timeout=0.01)
+        self.assertEqual(limit.limit, 2)
+        limit.release()
+        self.assertEqual(limit.limit, 8)
+        self.assertEqual(sum(1 for _ in range(8) if semaphore.acquire(blocking=False)), 6)
+
+
+class RateTests(unittest.TestCase):
+    def test_rate(self):
+        values, now = [10.0], [100.0]
+        rate = Rate(lambda: values[0], lambda: now[0])
+        values[0], now[0] = 40.0, 110.0
+        self.assertEqual(rate(), 3.0)
+        self.assertEqual(rate(), 0.0)
@@ -0,0 +1,71 @@
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+from src.util.metrics import Histogram, Metrics, MetricsReporter
+
+
+class HistogramTests(unittest.TestCase):
+    def test_buckets(self):
+        histogram = Histogram([0.1, 1.0, 10.0])
+        # Buckets are upper bounds (le), and values past the last one land in an overflow bucket
+        for value in [0.05, 0.1, 0.5, 1.0, 5.0, 50.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 2, 1, 1])
+        self.assertEqual(histogram.count, 6)
+        self.assertAlmostEqual(histogram.sum, 56.65)
+
+    def test_quantile(self):
+        histogram = Histogram([0.1, 1.0, 10.0])
+        self.assertEqual(histogram.quantile(0.5), 0.0)
+        for _ in range(4):
+            histogram.observe(0.5)
+        # Interpolated within the bucket (0.1, 1.0]
+        self.assertAlmostEqual(histogram.quantile(0.5), 0.55)
+        self.assertAlmostEqual(histogram.quantile(1.0), 1.0)
+        histogram.observe(100.0)
+        self.assertEqual(histogram.quantile(1.0), 10.0)
+        self.assertEqual(histogram.summary(), {'count': 5, 'sum': 102.0, 'p50': 0.6625, 'p99': 10.0})
+
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = Metrics()
+        self.registry.inc('records_total', 3)
+        self.registry.inc('errors_total', processor='news')
+        self.registry.gauge('in_flight', lambda: 7)
+        self.registry.observe('process_seconds', 0.002, processor='news')
+        self.registry.observe('process_seconds', 200.0, processor='news')
+
+    def test_prometheus(self):
+        lines = self.registry.render_prometheus().splitlines()
+        self.assertIn('crawl_records_total 3', lines)
+        self.assertIn('crawl_errors_total{processor="news"} 1', lines)
+        self.assertIn('crawl_in_flight 7', lines)
+        # Cumulative buckets, ending with +Inf, then the sum and count
+        buckets = [line for line in lines if line.startswith('crawl_process_seconds_bucket')]
+        self.assertEqual(buckets[0], 'crawl_process_seconds_bucket{processor="news",le="0.001"} 0')
+        self.assertEqual(buckets[1], 'crawl_process_seconds_bucket{processor="news",le="0.0025"} 1')
+        self.assertEqual(buckets[-2], 'crawl_process_seconds_bucket{processor="news",le="120.0"} 1')
+        self.assertEqual(buckets[-1], 'crawl_process_seconds_bucket{processor="news",le="+Inf"} 2')
+        self.assertIn('crawl_process_seconds_sum{processor="news"} 200.002', lines)
+        self.assertIn('crawl_process_seconds_count{processor="news"} 2', lines)
+
+    def test_served(self):
+        reporter = MetricsReporter(self.registry, port=0, interval=None)
+        reporter.start()
+        try:
+            url = f'http://127.0.0.1:{reporter.server.server_port}'
+            with urllib.request.urlopen(f'{url}/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                self.assertEqual(response.read().decode('utf-8'), self.registry.render_prometheus())
+            with urllib.request.urlopen(f'{url}/stats') as response:
+                stats = json.loads(response.read())
+            self.assertEqual(stats['counters'], {'errors_total{processor="news"}': 1, 'records_total': 3})
+            self.assertEqual(stats['gauges'], {'in_flight': 7})
+            self.assertEqual(stats['latency']['process_seconds{processor="news"}']['count'], 2)
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'{url}/other')
+        finally:
+            reporter.stop()
@@ -0,0 +1,149 @@
+import random
+import unittest
+from collections import Counter
+
+import numpy
+
+from src.util.sketch import LSHIndex, MinHash, jaccard, lsh_bands, SpaceSaving, trapezoid
+
+
+def text(rng: random.Random, words: int) -> str:
+    return ' '.join(f'word{rng.randint(0, 5000)}' for _ in range(words))
+
+
+def zipf_stream(rng: random.Random, n: int, distinct: int):
+    return [f'domain{min(int(rng.paretovariate(1.1)), distinct)}.com' for _ in range(n)]
+
+
+class SpaceSavingTests(unittest.TestCase):
+    def _check_bounds(self, summary: SpaceSaving, truth: Counter):
+        bound = summary.error_bound()
+        for item, count, error in summary.top():
+            self.assertLessEqual(count - error, truth[item])
+            self.assertGreaterEqual(count, truth[item])
+            self.assertLessEqual(error, bound)
+        # Anything more frequent than the bound must be monitored
+        for item, count in truth.items():
+            if count > bound:
+                self.assertIn(item, summary.counts)
+
+    def test_exact_under_capacity(self):
+        summary = SpaceSaving(10)
+        for item in 'abracadabra':
+            summary.offer(item)
+        self.assertEqual(summary.top(1), [('a', 5, 0)])
+        self.assertEqual(summary.counts, dict(Counter('abracadabra')))
+        self.assertEqual(summary.total, 11)
+
+    def test_bounds(self):
+        rng = random.Random(1)
+        stream = zipf_stream(rng, 50000, 100000)
+        summary = SpaceSaving(100)
+        for item in stream:
+            summary.offer(item)
+        self.assertEqual(len(summary), 100)
+        self.assertEqual(summary.total, len(stream))
+        self._check_bounds(summary, Counter(stream))
+        truth = [item for item, _ in Counter(stream).most_common(5)]
+        self.assertEqual([item for item, _, _ in summary.top(5)], truth)
+
+    def test_merge(self):
+        rng = random.Random(2)
+        streams = [zipf_stream(rng, 20000, 50000) for _ in range(4)]
+        merged = SpaceSaving(100)
+        for stream in streams:
+            partial = SpaceSaving(100)
+            for item in stream:
+                partial.offer(item)
+            merged.merge(partial)
+        truth = Counter()
+        for stream in streams:
+            truth.update(stream)
+        self.assertEqual(merged.total, sum(len(s) for s in streams))
+        self.assertLessEqual(len(merged), 100)
+        self._check_bounds(merged, truth)
+        # The merged summary keeps working as a stream summary
+        merged.offer('new.com', 5)
+        self.assertEqual(merged.total, sum(len(s) for s in streams) + 5)
+
+
+class MinHashTests(unittest.TestCase):
+    def test_estimate(self):
+        rng = random.Random(1)
+        minhash = MinHash()
+        words = text(rng, 1000).split()
+        edited = list(words)
+        for i in range(0, len(edited), 50):
+            edited[i] = 'edit'
+        a, b = minhash.shingles(' '.join(words)), minhash.shingles(' '.join(edited))
+        truth = len(set(a) & set(b)) / len(set(a) | set(b))
+        estimate = jaccard(minhash.signature(' '.join(words)), minhash.signature(' '.join(edited)))
+        self.assertAlmostEqual(estimate, truth, delta=0.1)
+        self.assertEqual(jaccard(minhash.signature(' '.join(words)), minhash.signature(' '.join(words).upper())), 1.0)
+        self.assertLess(jaccard(minhash.signature(' '.join(words)), minhash.signature(text(rng, 1000))), 0.1)
+
+    def test_short_texts(self):
+        minhash = MinHash()
+        self.assertEqual(len(minhash.shingles('')), 0)
+        self.assertEqual(len(minhash.shingles('two words')), 1)
+        self.assertEqual(minhash.signature('two words').shape, (128,))
+
+
+class LSHIndexTests(unittest.TestCase):
+    def test_bands(self):
+        for threshold in [0.5, 0.8, 0.9]:
+            bands, rows = lsh_bands(threshold, 128)
+            self.assertLessEqual(bands * rows, 128)
+            # The S-curve rises around the threshold
+            self.assertLess(1 - (1 - (threshold - 0.2) ** rows) ** bands, 0.5)
+            self.assertGreater(1 - (1 - (threshold + 0.05) ** rows) ** bands, 0.5)
+        self.assertEqual([lsh_bands(threshold, 128) for threshold in [0.5, 0.8, 0.9]], [(32, 4), (14, 9), (8, 16)])
+
+    def test_trapezoid(self):
+        x = numpy.linspace(0.0, 2.0, 201)
+        self.assertAlmostEqual(trapezoid(x ** 2, x), 8 / 3, places=4)
+        self.assertEqual(trapezoid(numpy.ones(3), numpy.array([0.0, 0.5, 2.0])), 2.0)
+
+    def test_near_duplicates(self):
+        rng = random.Random(2)
+        minhash = MinHash()
+        index = LSHIndex(0.8)
+        originals = [text(rng, 500) for _ in range(50)]
+        for i, original in enumerate(originals):
+            self.assertIsNone(index.offer(i, minhash.signature(original)))
+        for i, original in enumerate(originals):
+            words = original.split()
+            words[rng.randrange(len(words))] = 'edit'
+            self.assertEqual(index.offer(f'copy{i}', minhash.signature(' '.join(words))), i)
+        self.assertEqual(len(index), 50)
+
+    def test_capacity(self):
+        rng = random.Random(3)
+        minhash = MinHash()
+        index = LSHIndex(0.8, capacity=10)
+        texts = [text(rng, 200) for _ in range(30)]
+        for i, t in enumerate(texts):
+            index.offer(i, minhash.signature(t))
+        self.assertEqual(len(index), 10)
+        self.assertEqual(sum(len(bucket) for table in index.tables for bucket in table.values()), 10 * index.bands)
+        # The oldest are forgotten, the latest are still found
+        self.assertIsNone(index.offer('again', minhash.signature(texts[0])))
+        self.assertEqual(index.offer('again', minhash.signature(texts[29])), 29)
+
+    # A dissimilar signature in the same bucket does not hide an earlier one that shares only that band
+    def test_shared_bucket(self):
+        index = LSHIndex(0.5)
+        self.assertEqual((index.bands, index.rows), (32, 4))
+        original = numpy.arange(128, dtype=numpy.uint32)
+        other = original + 1000
+        other[:4] = original[:4]
+        edited = original.copy()
+        edited[4::4] += 1000
+        self.assertIsNone(index.offer('original', original))
+        self.assertIsNone(index.offer('other', other))
+        self.assertEqual(index.offer('edited', edited), 'original')
+        # Once the bucket is full, the oldest signatures in it are no longer compared
+        index = LSHIndex(0.5, bucket_size=1)
+        index.offer('original', original)
+        index.offer('other', other)
+        self.assertIsNone(index.offer('edited', edited))
@@ -0,0 +1,65 @@
+import unittest
+from multiprocessing import get_context
+
+from src.processors.types import Record
+from src.util.transport import RecordRing, SharedRecord, HEADER, receive
+
+
+def content_of(record) -> str:
+    return receive(record).content
+
+
+class RecordRingTests(unittest.TestCase):
+    def setUp(self):
+        self.ring = RecordRing(4096)
+
+    def tearDown(self):
+        self.ring.close()
+
+    def test_round_trip(self):
+        sent = self.ring.put(Record('https://a.com/', 1.5, b'caf\xc3\xa9 \xff'))
+        self.assertIsInstance(sent, SharedRecord)
+        record = receive(sent)
+        self.assertEqual((record.uri, record.ts, record.content), ('https://a.com/', 1.5, 'café '))
+        self.assertEqual(self.ring.in_use(), 0)
+
+    def test_wrap_and_fallback(self):
+        size = 1000 - HEADER.size
+        first, second, third = [self.ring.put(Record(str(i), 0, 'x' * size)) for i in range(3)]
+        self.assertEqual([first.offset, second.offset, third.offset], [0, 1000, 2000])
+        # Does not fit at the end, and the start is still in use
+        fourth = self.ring.put(Record('3', 0, 'y' * (size + 200)))
+        self.assertIsInstance(fourth, Record)
+        self.assertIsInstance(self.ring.put(Record('big', 0, 'z' * 5000)), Record)
+
+        # Space is reclaimed in order, so consuming the second record frees nothing until the first is consumed
+        receive(second)
+        self.assertEqual(self.ring.in_use(), 3000)
+        receive(first)
+        self.assertEqual(self.ring.in_use(), 1000)
+        wrapped = self.ring.put(Record('3', 0, 'y' * (size + 200)))
+        self.assertEqual(wrapped.offset, 0)
+        self.assertIsInstance(self.ring.put(Record('4', 0, 'w' * size)), Record)
+        self.assertEqual(receive(wrapped).content, 'y' * (size + 200))
+        self.assertEqual(receive(third).content, 'x' * size)
+        self.assertEqual(self.ring.in_use(), 0)
+
+    def test_wrapped_and_full(self):
+        size = 1000 - HEADER.size
+        sent = [self.ring.put(Record(str(i), 0, str(i) * size)) for i in range(4)]
+        receive(sent[0])
+        wrapped = self.ring.put(Record('4', 0, '4' * size))
+        self.assertEqual(wrapped.offset, 0)
+        # Wrapped and full up to the second record, which has not been consumed yet
+        self.assertIsInstance(self.ring.put(Record('5', 0, '5' * size)), Record)
+        self.assertEqual([receive(r).content for r in sent[1:] + [wrapped]], [str(i) * size for i in range(1, 5)])
+        self.assertEqual(self.ring.in_use(), 0)
+
+    def test_workers(self):
+        contents = [f'page {i} ' * (i * 40) for i in range(20)]
+        with get_context('spawn').Pool(2) as p:
+            sent = [self.ring.put(Record(str(i), i, c)) for i, c in enumerate(contents[:8])]
+            self.assertEqual(p.map(content_of, sent), contents[:8])
+            sent = [self.ring.put(Record(str(i), i, c)) for i, c in enumerate(contents[8:])]
+            self.assertEqual(p.map(content_of, sent), contents[8:])
+        self.assertEqual(self.ring.in_use(), 0)
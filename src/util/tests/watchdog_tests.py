@@ -0,0 +1,121 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+import unittest
+from multiprocessing.managers import SyncManager
+
+from src.util.watchdog import InFlight, RecordTimeout, WorkerWatchdog, begin_record, end_record, pause_record, \
+    record_deadline
+
+
+class InFlightManager(SyncManager):
+    pass
+
+
+InFlightManager.register('InFlight', InFlight)
+
+
+class RecordDeadlineTests(unittest.TestCase):
+    def test_timeout(self):
+        previous = signal.getsignal(signal.SIGALRM)
+        with self.assertRaises(RecordTimeout):
+            with record_deadline(0.05):
+                time.sleep(5)
+        self.assertEqual(signal.getsignal(signal.SIGALRM), previous)
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_disabled(self):
+        for seconds in [None, 0]:
+            with record_deadline(seconds):
+                time.sleep(0.01)
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+    def test_finishes_in_time(self):
+        with record_deadline(5):
+            pass
+        self.assertEqual(signal.getitimer(signal.ITIMER_REAL), (0.0, 0.0))
+
+
+class InFlightTests(unittest.TestCase):
+    def test_end_record(self):
+        self.assertTrue(end_record(None))
+        in_flight = InFlight()
+        begin_record(in_flight, 'https://a.com/')
+        self.assertEqual(in_flight.records[os.getpid()][0], 'https://a.com/')
+        pause_record(in_flight, 'https://a.com/')
+        self.assertEqual(in_flight.records[os.getpid()], ('https://a.com/', None))
+        self.assertTrue(end_record(in_flight))
+        self.assertEqual(in_flight.items(), [])
+        # The watchdog gave up on the record (and released its slot) first
+        self.assertFalse(end_record(in_flight))
+
+
+class WorkerWatchdogTests(unittest.TestCase):
+    def setUp(self):
+        self.workers = [subprocess.Popen(['sleep', '30']) for _ in range(3)]
+
+    def tearDown(self):
+        for worker in self.workers:
+            worker.kill()
+            worker.wait()
+
+    def test_check(self):
+        stuck, busy, flushing = [w.pid for w in self.workers]
+        now = time.time()
+        in_flight = InFlight()
+        in_flight.set(stuck, 'https://stuck.com/', now - 25)
+        in_flight.set(busy, 'https://busy.com/', now - 5)
+        in_flight.set(flushing, 'https://flushing.com/', None)
+        semaphore = threading.Semaphore(0)
+        abandoned = []
+        watchdog = WorkerWatchdog(in_flight, semaphore, record_timeout=10, on_abandon=abandoned.append)
+        self.assertEqual(watchdog.check(now), 1)
+        self.assertEqual(self.workers[0].wait(5), -signal.SIGKILL)
+        self.assertIsNone(self.workers[1].poll())
+        self.assertIsNone(self.workers[2].poll())
+        self.assertEqual(abandoned, ['https://stuck.com/'])
+        self.assertTrue(semaphore.acquire(blocking=False))
+        self.assertFalse(semaphore.acquire(blocking=False))
+        self.assertEqual(sorted(in_flight.records), sorted([busy, flushing]))
+        # Past the grace period, but records being flushed are never interrupted
+        self.assertEqual(watchdog.check(now + 100), 1)
+        self.assertEqual(list(in_flight.records), [flushing])
+
+    # The worker finishes its record right as the watchdog gives up on it: either the worker gets to keep its slot
+    # and is left alone, or it is killed before end_record() returns, never both or neither
+    def test_finishes_at_deadline(self):
+        semaphore = threading.Semaphore(0)
+        abandoned = []
+        for worker in self.workers:
+            in_flight = InFlight()
+            in_flight.set(worker.pid, 'https://late.com/', 0.0)
+            watchdog = WorkerWatchdog(in_flight, semaphore, record_timeout=5, on_abandon=abandoned.append)
+            # Exactly at the deadline, and past the grace period, the record is not abandoned
+            self.assertEqual(watchdog.check(10.0), 0)
+            owned = []
+            ending = threading.Thread(target=lambda: owned.append(in_flight.end(worker.pid)))
+            ending.start()
+            killed = watchdog.check(10.1)
+            ending.join()
+            self.assertEqual(killed + owned.count(True), 1)
+            if killed:
+                self.assertEqual(worker.wait(5), -signal.SIGKILL)
+            else:
+                self.assertIsNone(worker.poll())
+        self.assertEqual(len(abandoned), sum(worker.poll() is not None for worker in self.workers))
+        self.assertEqual(len(abandoned), sum(semaphore.acquire(blocking=False) for _ in self.workers))
+
+    # Shared through a manager, as in main()
+    def test_managed_in_flight(self):
+        with InFlightManager() as manager:
+            in_flight = manager.InFlight()
+            in_flight.set(self.workers[0].pid, 'https://a.com/', 0.0)
+            in_flight.set(self.workers[1].pid, 'https://b.com/', 1.0)
+            self.assertFalse(in_flight.abandon(self.workers[1].pid, 'https://b.com/', 0.0))
+            self.assertTrue(in_flight.abandon(self.workers[0].pid, 'https://a.com/', 0.0))
+            self.assertFalse(in_flight.end(self.workers[0].pid))
+            self.assertTrue(in_flight.end(self.workers[1].pid))
+        self.assertEqual(self.workers[0].wait(5), -signal.SIGKILL)
+        self.assertIsNone(self.workers[1].poll())
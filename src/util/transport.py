@@ -0,0 +1,110 @@
+import struct
+import threading
+from collections import deque
+from multiprocessing.shared_memory import SharedMemory
+from typing import Deque, Dict, Optional, Tuple, Union
+
+from src.processors.types import Record
+from src.util.metrics import metrics
+
+TRANSPORTS = ['pickle', 'shm']
+
+# Every payload in the ring is preceded by a header holding its state, so a worker can hand the space back without
+# any IPC
+HEADER = struct.Struct('<B7x')
+IN_USE = 1
+CONSUMED = 2
+
+# Segments attached by this (worker) process, by name
+_attached: Dict[str, SharedMemory] = {}
+
+
+# What is sent to a worker in place of a Record whose content is in a RecordRing: the URI, ts and where to find the
+# UTF-8 encoded content
+class SharedRecord:
+    def __init__(self, uri, ts, name: str, offset: int, length: int):
+        self.uri = uri
+        self.ts = ts
+        self.name = name
+        self.offset = offset
+        self.length = length
+
+    # Decodes the content straight out of the segment and marks its space as consumed
+    def record(self) -> Record:
+        shm = _attached.get(self.name)
+        if shm is None:
+            shm = _attached[self.name] = SharedMemory(self.name)
+        start = self.offset + HEADER.size
+        content = str(shm.buf[start:start + self.length], 'utf-8', 'ignore')
+        HEADER.pack_into(shm.buf, self.offset, CONSUMED)
+        return Record(self.uri, self.ts, content)
+
+
+# Resolves what the ingestor sent into a Record (run in the workers)
+def receive(record: Union[Record, SharedRecord]) -> Record:
+    if isinstance(record, SharedRecord):
+        return record.record()
+    return record
+
+
+# Ring buffer in a shared memory segment, which carries record content from the ingestor to the pool workers.  The
+# content is written once by the ingestor and decoded in place by the worker, instead of being pickled into the task,
+# written to the pool's pipe, read back and unpickled.
+#
+# Space is handed out in order, and is reclaimed from the oldest allocation as workers mark payloads as consumed (which
+# they do as soon as they have decoded them, so a slow or killed worker does not hold on to its space).  A record that
+# does not fit is sent as is.
+class RecordRing:
+    def __init__(self, size: int):
+        self.shm = SharedMemory(create=True, size=size)
+        self.size = size
+        # (offset, end) of the allocations that may not have been consumed yet, oldest first
+        self.allocations: Deque[Tuple[int, int]] = deque()
+        self.lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _reclaim(self):
+        while len(self.allocations) > 0 and HEADER.unpack_from(self.shm.buf, self.allocations[0][0])[0] == CONSUMED:
+            self.allocations.popleft()
+
+    def _allocate(self, size: int) -> Optional[int]:
+        self._reclaim()
+        if len(self.allocations) == 0:
+            return 0 if size <= self.size else None
+        tail, head = self.allocations[0][0], self.allocations[-1][1]
+        # The allocations have wrapped around once the newest starts before the oldest.  Then head == tail means the
+        # ring is full, not empty, so this is not inferred from head and tail.
+        if self.allocations[-1][0] >= tail:
+            if head + size <= self.size:
+                return head
+            # Wrap around, leaving the end of the segment unused until the tail wraps as well
+            return 0 if size <= tail else None
+        return head if head + size <= tail else None
+
+    def put(self, record: Record) -> Union[Record, SharedRecord]:
+        content = record.content.encode('utf-8') if isinstance(record.content, str) else None
+        if content is None:
+            return record
+        size = HEADER.size + len(content)
+        with self.lock:
+            offset = self._allocate(size)
+            if offset is None:
+                metrics.inc('shm_fallback_total')
+                return record
+            self.allocations.append((offset, offset + size))
+            HEADER.pack_into(self.shm.buf, offset, IN_USE)
+        self.shm.buf[offset + HEADER.size:offset + size] = content
+        metrics.inc('shm_bytes_total', len(content))
+        return SharedRecord(record.uri, record.ts, self.shm.name, offset, len(content))
+
+    def in_use(self) -> int:
+        with self.lock:
+            self._reclaim()
+            return sum(end - offset for offset, end in self.allocations)
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
@@ -0,0 +1,198 @@
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from src.util.logging import Logger
+from src.util.metrics import metrics
+from src.util.resources import current_rss
+
+logger = Logger()
+
+
+class RecordTimeout(Exception):
+    pass
+
+
+def _raise_record_timeout(signum, frame):
+    raise RecordTimeout()
+
+
+def _deadline_enabled(seconds: Optional[float]) -> bool:
+    return seconds is not None and seconds > 0 and threading.current_thread() is threading.main_thread()
+
+
+# Soft deadline for processing a single record.  This relies on SIGALRM, so it only applies to the main thread of a
+# process (e.g. a pool worker).  Code stuck in a C extension will not see the exception until it gets back to the
+# interpreter, which is why the WorkerWatchdog exists.
+@contextmanager
+def record_deadline(seconds: Optional[float]):
+    if not _deadline_enabled(seconds):
+        yield
+        return
+    previous = signal.signal(signal.SIGALRM, _raise_record_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+# Wraps the shared results mutex, so a deadline cannot fire while the lock is held.  An expired deadline is deferred
+# until the lock is released; otherwise, an abandoned record could leave the lock held forever.
+class DeadlineSafeLock:
+    def __init__(self, lock: threading.Lock):
+        self.lock = lock
+
+    def acquire(self, *args, **kwargs):
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+        acquired = self.lock.acquire(*args, **kwargs)
+        if not acquired:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+        return acquired
+
+    def release(self):
+        try:
+            self.lock.release()
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGALRM})
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+# The records the pool workers are processing, keyed by worker pid, with when they started (None while the worker is
+# doing something the watchdog must not interrupt).  Shared through a manager (see main()), whose server runs every
+# method under the lock, so a worker finishing its record and the watchdog killing it cannot interleave: either the
+# worker ends the record first and is not killed, or the kill lands before the worker gets past end_record() (and into
+# e.g. the pool's task queue, whose lock it would leave held).
+class InFlight:
+    def __init__(self):
+        self.records: Dict[int, Tuple[str, Optional[float]]] = {}
+        self.lock = threading.Lock()
+
+    def set(self, pid: int, uri: str, started: Optional[float]):
+        with self.lock:
+            self.records[pid] = (uri, started)
+
+    # Returns True if the record was still in flight, i.e. the watchdog had not given up on it
+    def end(self, pid: int) -> bool:
+        with self.lock:
+            return self.records.pop(pid, None) is not None
+
+    def items(self) -> List[Tuple[int, Tuple[str, Optional[float]]]]:
+        with self.lock:
+            return list(self.records.items())
+
+    # Kills the worker, unless it has finished the record (or moved on to another one) since the caller looked.
+    # Returns True if it was killed.
+    def abandon(self, pid: int, uri: str, started: float) -> bool:
+        with self.lock:
+            if self.records.get(pid) != (uri, started):
+                return False
+            del self.records[pid]
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return True
+
+
+# Marks the calling worker as processing a record, which makes it eligible to be killed by the watchdog
+def begin_record(in_flight: Optional[InFlight], uri: str):
+    if in_flight is not None:
+        in_flight.set(os.getpid(), uri, time.time())
+
+
+# Marks the calling worker as busy with something the watchdog must not interrupt (e.g. flushing under the mutex)
+def pause_record(in_flight: Optional[InFlight], uri: str):
+    if in_flight is not None:
+        in_flight.set(os.getpid(), uri, None)
+
+
+# Returns True if the caller owns the record's in-flight slot, i.e. the watchdog has not already given up on it
+def end_record(in_flight: Optional[InFlight]) -> bool:
+    if in_flight is None:
+        return True
+    return in_flight.end(os.getpid())
+
+
+# Exit the current pool worker, so the pool replaces it with a fresh process.  The task ends without calling back
+# either the pool's callback or its error_callback, so `task` (e.g. the URI of the record it was processing) is left
+# in `recycled`, when given, for the parent to account for (see drain_recycled()).
+def recycle_worker(reason: str, recycled: List = None, task=None):
+    logger.warning(f'Recycling worker {os.getpid()}: {reason}')
+    if recycled is not None:
+        recycled.append(task)
+    sys.exit(0)
+
+
+def recycle_worker_if_over_memory(max_rss_mb: Optional[int], recycled: List = None, task=None):
+    if max_rss_mb is None:
+        return
+    rss = current_rss()
+    if rss > max_rss_mb * 1024 * 1024:
+        recycle_worker(f'RSS of {rss // (1024 * 1024)} MB exceeds {max_rss_mb} MB', recycled, task)
+
+
+# Tasks left by the workers recycled since the last call (run in the parent, which is the only one to remove them)
+def drain_recycled(recycled: List) -> List:
+    drained = []
+    while len(recycled) > 0:
+        drained.append(recycled.pop(0))
+    return drained
+
+
+# Kills pool workers that blow through the record deadline without returning to the interpreter (e.g. spinning in
+# lxml).  The pool replaces killed workers, and the watchdog releases the semaphore slot the abandoned record held (and
+# calls `on_abandon` with its URI, e.g. to give back its share of the memory budget).
+class WorkerWatchdog:
+    def __init__(self, in_flight: InFlight, semaphore: threading.Semaphore,
+                 record_timeout: float, grace: float = None, interval: float = 1.0,
+                 on_abandon: Callable[[str], None] = None):
+        self.in_flight = in_flight
+        self.semaphore = semaphore
+        self.on_abandon = on_abandon
+        self.record_timeout = record_timeout
+        self.grace = grace if grace is not None else record_timeout
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f'Watchdog check failed: {str(e)}')
+
+    def check(self, now: float = None) -> int:
+        now = now if now is not None else time.time()
+        killed = 0
+        for pid, (uri, started) in self.in_flight.items():
+            if started is None or now - started <= self.record_timeout + self.grace:
+                continue
+            # The worker may have finished the record since we looked, in which case it already released the slot
+            if not self.in_flight.abandon(pid, uri, started):
+                continue
+            logger.error(f'Killed worker {pid}: {uri} has been processing for {now - started:.1f}s')
+            self.semaphore.release()
+            if self.on_abandon is not None:
+                self.on_abandon(uri)
+            metrics.inc('workers_killed_total')
+            killed += 1
+        return killed